@@ -3,111 +3,115 @@ Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging
 
 Author: Lovina Putri  
 Date Created: 14/06/2025  
-Last Updated: 13/09/2025  
+Last Updated: 18/10/2026  
 Project: ORBIS EM Data Fetch and Cleaning from WRDS for large and medium firms
-Version: 4
+Version: 9
 '''
 
 # Import packages
 import os
-import wrds
+import catalog as cat
+import wrds_extract as wx
+from instrument import Probe
+from manifest import Manifest
 
 # Creating scratch directory
 group   = "....."  #change to your directory for group based on institution / WRDS subscription
 scratch = f"/scratch/{group}/wrds_batch"
 os.makedirs(scratch, exist_ok=True)
 
-# Connect to WRDS
-db = wrds.Connection(wrds_username='your_username')
+# WRDS login and concurrency knob: each worker holds its own WRDS connection,
+# so keep this within your WRDS concurrent-session allowance
+wrds_username = 'your_username'
+workers       = 4
+n_groups      = 4   # split the 24 ISO codes into this many country groups
+
+# Output mode: "parquet" writes each chunk straight into the typed dataset in
+# orbis_dataset/ (size=/ctryiso=/year=); "csv" keeps the old _partN.csv files,
+# which then need 03_append_parquet.py
+output      = "parquet"
+dataset_dir = os.path.join(scratch, "orbis_dataset")
+
+# Shard manifest: reruns skip shards recorded as done and re-fetch the rest.
+# verify = "hash" re-hashes finished files instead of only checking sizes.
+manifest = Manifest(os.path.join(scratch, "manifest.sqlite"))
+verify   = "size"
+
+# Per-chunk WRDS fetch / write timings go to logs/events.jsonl (pipeline.py report)
+probe = Probe(os.path.join(scratch, "logs"))
+
+# Pull mode: "full" re-extracts every period; "incremental" only fetches rows
+# with closdate after each (size, country) watermark, minus a restatement
+# window, and merges them into orbis_dataset/ (requires output = "parquet")
+mode             = "full"
+restatement_days = 365
+delta_dir        = os.path.join(scratch, "orbis_delta")
 
 # Data management
-# 1) Emerging Markets ISO Code (Categories by MSCI)
-iso_codes = [
-    'BR','CL','CN','CO','CZ','EG','GR','HU','IN','ID','KR','KW',
-    'MY','MX','PE','PH','PL','QA','SA','ZA','TW','TH','TR','AE'
-]
-
-# 2) Static vars FROM company_id_table
-static_vars = [
-    'name_internat','name_native','akaname',
-    'slegalf','legalfrm','dateinc','dateinc_year','dateinc_char',
-    'lei_lei','sd_ticker','sd_isin','city_internat','city_native',
-    'country','region_in_country','bvdid','category_of_company','contact_ctryiso'
-]
-
-# 3) Sector and activities vars FROM ob_industry_classifications
-sector_vars = [
-    'major_sector', 'nace2_main_section', 'naceccod2', 
-    'nacecdes2', 'nacepcod2', 'nacepdes2',
-    'naicsccod2017', 'naicscdes2017', 'ussicccod', 'ussiccdes'
-]
+# ISO codes and the static / sector / fin_vars lists live in catalog.py; set
+# catalog.STUDY_VARS to extract only the variables a study needs
+iso_codes = cat.ISO_CODES
 
-# 4) Time-varying vars FROM the cash-flow table
-fin_vars    = [ 'closdate','filing_type','orig_currency','exchrate',
-                'fias','ifas','tfas','ofas','cuas','debt','ocas','toas',
-                'capi','ltdb','wkca','ncas','empl','opre','turn','taxa',
-                'staf','inte','cf','ace','df_employees','emp_orig_range_value',
-                'av','ncli','oncl','culi','ocli','tshf','_315506','_315507',
-                '_315522', 'cost', 'depr', 'expt', '_315501', '_315502', 
-                'fiex', 'shfd', 'osfd', 'tshf', 'cash', 'ebta', 'oppl', 'pl', 
-                'fdpp', 'fdpc', 'fcdp', '_315524', '_315525', '_315523']
-
-# 5) Define sub-periods as (start_date, end_date) tuples
+# Define sub-periods as (label, start_date, end_date) tuples
 periods = [
-    ("2005-01-01", "2009-12-31"),
-    ("2010-01-01", "2014-12-31"),
-    ("2015-01-01", "2019-12-31"),
-    ("2020-01-01", "2024-12-31"),
+    ("2005_2009", "2005-01-01", "2009-12-31"),
+    ("2010_2014", "2010-01-01", "2014-12-31"),
+    ("2015_2019", "2015-01-01", "2019-12-31"),
+    ("2020_2024", "2020-01-01", "2024-12-31"),
 ]
 
-# Pre-compute column lists & ISO list
-iso_list = ",".join(f"'{c}'" for c in iso_codes)
-c_cols   = ", ".join(f"c.{v}" for v in static_vars)
-p_cols   = ", ".join(f"p.{v}" for v in sector_vars)
-f_cols   = ", ".join(f"f.{v}" for v in fin_vars)
+# Pre-compute column lists
+c_cols, p_cols, f_cols = cat.select_cols()
 
 # Map sizes to their table suffix
 suffix_map = {"large":"l","medium":"m"}
 
-# Create SQL template
-sql_template = """
-SELECT {c_cols}, {p_cols}, {f_cols}
-FROM {schema}.ob_w_ind_g_fins_cfl_usd_{suffix}   AS f
-  JOIN {schema}.ob_w_company_id_table_{suffix}   AS c ON f.bvdid = c.bvdid
-  JOIN {schema}.ob_industry_classifications_{suffix}   AS p ON f.bvdid = p.bvdid
-WHERE c.contact_ctryiso IN ({iso_list})
-  AND f.closdate BETWEEN '2005-01-01' AND '2024-12-31'
-ORDER BY c.contact_ctryiso, c.bvdid, f.closdate
-"""
-
-# Loop over Orbis schemas & suffixes
-for size, suffix in suffix_map.items():
-    schema = f"bvd_orbis_{size}"
-
-    # Loop over each sub-period
-    for start, end in periods:
-        # Swap the dates
-        dated_sql = sql_template.replace(
-            "BETWEEN '2005-01-01' AND '2024-12-31'",
-            f"BETWEEN '{start}' AND '{end}'"
-        )
-
-        # 2) Format in the schema, suffix, and column lists
-        query = dated_sql.format(
-            schema   = schema,
-            suffix   = suffix,
-            c_cols   = c_cols,
-            p_cols   = p_cols,
-            f_cols   = f_cols,
-            iso_list = iso_list
-        )
-
-        # Stream & write into scratch
-        for i, chunk in enumerate(
-              db.raw_sql(query, chunksize=250_000, return_iter=True),
-              start=1
-        ):
-            fn = f"orbis_em__ID_{size}_{start[:4]}_{end[:4]}_part{i}.csv"
-            out_path = os.path.join(scratch, fn)
-            chunk.to_csv(out_path, index=False)
-            print(f"[{size} {start[:4]}–{end[:4]}] wrote {len(chunk)} rows → {out_path}")
+if mode == "incremental" and output != "parquet":
+    raise ValueError('mode = "incremental" merges into orbis_dataset/ and needs output = "parquet"')
+
+# Shard over size × sub-period × country group (or size × country group for deltas)
+if mode == "incremental":
+    since     = wx.delta_since(manifest, dataset_dir, suffix_map, iso_codes,
+                               restatement_days, floor=periods[0][1])
+    shards    = wx.make_delta_shards(suffix_map, iso_codes, n_groups)
+    query_for = lambda s: wx.build_delta_query(s, c_cols, p_cols, f_cols, since)
+    target    = delta_dir
+else:
+    shards    = wx.make_shards(suffix_map, periods, iso_codes, n_groups)
+    query_for = lambda s: wx.build_query(s, c_cols, p_cols, f_cols)
+    target    = dataset_dir
+
+# Fixed Arrow schema for the Parquet output
+schema = wx.orbis_schema(cat.selected(cat.STATIC_VARS),
+                         cat.selected(cat.SECTOR_VARS),
+                         cat.selected(cat.FIN_VARS))
+
+# Stream & write into scratch (called from the worker threads)
+def write_chunk(shard, part, chunk):
+    if output == "parquet":
+        paths = wx.write_parquet_chunk(target, shard, wx.shard_tag(shard, n_groups),
+                                       part, chunk, schema)
+        wx.log(f"[{shard.size} {shard.label} g{shard.group}] wrote {len(chunk):,} rows → {target}")
+        return paths
+    fn = f"orbis_em__ID_{wx.shard_tag(shard, n_groups)}_part{part}.csv"
+    out_path = os.path.join(scratch, fn)
+    chunk.to_csv(out_path, index=False)
+    wx.log(f"[{shard.size} {shard.label} g{shard.group}] wrote {len(chunk)} rows → {out_path}")
+    return [out_path]
+
+wx.run_shards(
+    shards,
+    query_for     = query_for,
+    write_chunk   = write_chunk,
+    wrds_username = wrds_username,
+    workers       = workers,
+    chunksize     = 250_000,
+    manifest      = manifest,
+    probe         = probe,
+    verify        = verify,
+    key_for       = lambda s: wx.shard_key(s, (c_cols, p_cols, f_cols), output),
+)
+
+# Fold the delta into the store and advance the watermarks
+if mode == "incremental":
+    wx.merge_delta(delta_dir, dataset_dir, manifest)
@@ -3,9 +3,12 @@ Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging
 
 Author: Lovina Putri  
 Date Created: 21/06/2025  
-Last Updated: 17/07/2025  
+Last Updated: 18/10/2026  
 Project: Convert all csv to one parquet file
-Version: 2
+Version: 3
+
+Only needed when 01/02 run with output = "csv"; the default "parquet" mode
+writes the typed orbis_dataset/ directly and this step can be skipped.
 '''
 
 #!/usr/bin/env python3
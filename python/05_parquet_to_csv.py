@@ -1,44 +1,162 @@
-'''            
+'''
 Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
 
-Author: Lovina Putri  
-Date Created: 21/06/2025  
-Last Updated: 19/07/2025  
-Project: Convert each cleaned Parquet (one per year) into CSV
-Version: 2
+Author: Lovina Putri
+Date Created: 21/06/2025
+Last Updated: 18/10/2026
+Project: Export the cleaned Parquet (one partition per year) for Stata: typed
+         .dta parts or (gzipped) CSV, in parallel, with a column/row selection,
+         plus the firm dimension once (merge m:1 firm_id in Stata)
+Version: 7
 '''
 
 # Import packages
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import duckdb
+import pandas as pd
+import pyarrow as pa
+
+import catalog as cat
+import moments as mo
+import runlog as rl
+from instrument import Probe
 
-# Paths
+# ── Paths ──────────────────────────────────────────────────────────────────────
 DATA_DIR = "/scratch/[your_group]/wrds_batch"
 PARQ_DIR = os.path.join(DATA_DIR, "orbis_em_2005_24_cleaned_by_year")
-CSV_DIR  = os.path.join(DATA_DIR, "orbis_em_2005_24_cleaned_by_year_csv")
-
-# Make sure directory exist
-os.makedirs(CSV_DIR, exist_ok=True)
-
-# Connect to DuckDB
-con = duckdb.connect()
-con.execute("PRAGMA memory_limit='60GB';")
-con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
-
-# Loop through every .parquet file and write a .csv next to it
-for fname in sorted(os.listdir(PARQ_DIR)):
-    if not fname.endswith(".parquet"):
-        continue
-    parq_path = os.path.join(PARQ_DIR,   fname)
-    csv_name  = fname.replace(".parquet", ".csv")
-    csv_path  = os.path.join(CSV_DIR,    csv_name)
-    print(f"Converting {fname} → {csv_name}")
-    con.execute(f"""
-      COPY (
-        SELECT * 
-        FROM parquet_scan('{parq_path}')
-      ) TO '{csv_path}'
-      (FORMAT CSV, HEADER TRUE);
-    """)
-
-print("All Parquet files converted to CSV.")
+CSV_DIR  = os.path.join(DATA_DIR, "orbis_em_2005_24_cleaned_by_year_csv")   # also the .dta parts
+FIRMS    = os.path.join(DATA_DIR, "orbis_firms.parquet")
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+# "dta"    : typed Stata files data_year=YYYY_partNNN.dta (see stata/01_append_dta.do)
+# "csv.gz" : one gzipped CSV per year (Stata 16+ reads it after gunzip, or zcat)
+# "csv"    : one plain CSV per year, as before (stata/01_append_csv.do)
+FORMAT = "dta"
+
+# Variables that stata/04_tfpr_real.do reads (it drops *_usd / *_defl and
+# rebuilds them); bvdid/country come from firms.dta through firm_id
+TFPR_DO_VARS = (['ctryiso', 'closdate', 'major_sector', 'nace2_main_section', 'naceccod2',
+                 'deflator', 'exchrate', 'empl'] + cat.MONETARY_VARS)
+
+COLUMNS    = None                 # None = every column; or e.g. TFPR_DO_VARS
+WHERE      = None                 # SQL row filter, e.g. "staf >= 0 AND ctryiso IN ('BR', 'IN')"
+FIRM_VARS  = None                 # firm dimension columns to export; None = all
+BATCH_ROWS = 500_000              # rows per streamed batch (= per .dta part)
+WORKERS    = int(os.environ.get("NSLOTS", 4))
+MEMORY_GB  = 60                   # DuckDB memory_limit, split across the workers
+
+# Codes that Stata's import delimited reads as numbers, which 04_tfpr_real.do
+# relies on (string(naceccod2) and the leading-zero fix); kept numeric in .dta
+STATA_NUMERIC = ['naceccod2', 'naicsccod2017', 'ussicccod']
+
+
+# ── Projection ─────────────────────────────────────────────────────────────────
+def select_list(present, columns, keys):
+    '''SELECT list: the key columns plus `columns` (all if None) present in the
+    source, with the numeric codes cast for Stata.'''
+    names = list(present) if columns is None else \
+        list(dict.fromkeys(keys + [c for c in columns if c in present]))
+    if FORMAT != "dta":
+        return ", ".join(names)
+    return ", ".join(f"TRY_CAST({c} AS DOUBLE) AS {c}" if c in STATA_NUMERIC else c
+                     for c in names)
+
+
+def connect(workers):
+    con = duckdb.connect()
+    con.execute(f"PRAGMA memory_limit='{max(1, MEMORY_GB // workers)}GB';")
+    con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
+    con.execute(f"PRAGMA threads={max(1, (os.cpu_count() or 1) // workers)};")
+    return con
+
+
+# ── Writers ────────────────────────────────────────────────────────────────────
+def write_dta(con, sql, stem):
+    '''Stream `sql` in BATCH_ROWS batches, one typed .dta part per batch.
+
+    A .dta header carries the row count, so a file cannot be appended to;
+    parts keep memory at one batch whatever the partition size.
+    '''
+    reader = con.execute(sql).to_arrow_reader(BATCH_ROWS)
+    strings = [f.name for f in reader.schema
+               if pa.types.is_string(f.type) or pa.types.is_large_string(f.type)
+               or (pa.types.is_dictionary(f.type) and pa.types.is_string(f.type.value_type))]
+    rows = parts = 0
+    for batch in reader:
+        df = batch.to_pandas()
+        # A string variable is str in every part: NULL is '', Stata's missing
+        # string (to_stata cannot type an all-NULL column, and append fails on
+        # str/numeric). Numeric storage types may differ; append promotes them.
+        for c in strings:
+            df[c] = df[c].astype(object).where(df[c].notna(), '')
+        dates = {c: 'td' for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])}
+        parts += 1
+        df.to_stata(os.path.join(CSV_DIR, f"{stem}_part{parts:03d}.dta"), write_index=False,
+                    convert_dates=dates, version=118)
+        rows += len(df)
+    return rows, parts
+
+
+def write_csv(con, sql, stem, probe):
+    '''One COPY per file; DuckDB streams it, so memory stays at memory_limit.'''
+    gz = FORMAT == "csv.gz"
+    path = os.path.join(CSV_DIR, f"{stem}.csv" + (".gz" if gz else ""))
+    probe.sql(con, f"""
+      COPY ({sql}) TO '{path}'
+      (FORMAT CSV, HEADER TRUE{", COMPRESSION gzip" if gz else ""});
+    """, f"copy_{stem}")
+    return None, 1
+
+
+def export(args):
+    '''Export one source (a year partition or the firm dimension).'''
+    stem, scan, select, where, workers = args
+    probe = Probe(os.path.join(DATA_DIR, "logs"))
+    con = connect(workers)
+    sql = f"SELECT {select} FROM {scan}" + (f" WHERE {where}" if where else "")
+    t0 = time.perf_counter()
+    if FORMAT == "dta":
+        rows, parts = write_dta(con, sql, stem)
+    else:
+        rows, parts = write_csv(con, sql, stem, probe)
+    nbytes = sum(os.path.getsize(os.path.join(CSV_DIR, f)) for f in os.listdir(CSV_DIR)
+                 if f.startswith(stem + "_part") or f.startswith(stem + ".csv"))
+    probe.event('export', file=stem, format=FORMAT, rows=rows, parts=parts, bytes=nbytes,
+                wall_s=round(time.perf_counter() - t0, 3))
+    con.close()
+    return stem, rows, parts, nbytes
+
+
+if __name__ == '__main__':
+    os.makedirs(CSV_DIR, exist_ok=True)
+    for f in os.listdir(CSV_DIR):           # stale parts of an earlier, larger export
+        if f.startswith(("data_year=", "firms")):
+            os.remove(os.path.join(CSV_DIR, f))
+
+    # One run id for the events of every worker when run by hand
+    os.environ.setdefault("PIPELINE_RUN", rl.new_run_id())
+
+    scans = [(f"data_year={y}", f"parquet_scan('{p}/*.parquet', hive_partitioning => true)")
+             for y, p in mo.year_partitions(PARQ_DIR)]
+    present = [r[0] for r in duckdb.sql(f"DESCRIBE SELECT * FROM {scans[0][1]}").fetchall()]
+    select = select_list(present, COLUMNS, ['firm_id', 'year'])
+    tasks = [(stem, scan, select, WHERE, WORKERS) for stem, scan in scans]
+
+    # Names, cities and code descriptions: once per firm, not on every firm-year
+    if os.path.exists(FIRMS):
+        firm_cols = duckdb.sql(f"DESCRIBE SELECT * FROM read_parquet('{FIRMS}')").fetchall()
+        tasks.append(("firms", f"read_parquet('{FIRMS}')",
+                      select_list([r[0] for r in firm_cols], FIRM_VARS, ['firm_id', 'bvdid']),
+                      None, WORKERS))
+
+    print(f"Exporting {len(tasks)} file(s) as {FORMAT} → {CSV_DIR} on {WORKERS} worker(s)")
+    total = 0
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        for stem, rows, n_parts, nbytes in pool.map(export, tasks):
+            print(f"  {stem}: " + (f"{rows:,} rows, {n_parts} part(s), " if rows is not None else "")
+                  + f"{nbytes / 2**20:,.1f} MB")
+            total += nbytes
+    print(f"All Parquet files exported ({total / 2**30:,.2f} GB).")
@@ -2,23 +2,40 @@
 Compustat Annual Fundamentals Fetch
 Author: Lovina Putri
 Date Created: 08/03/2025
+Last Updated: 18/10/2026
 Project: Compustat EM Data Fetch
-Version: 1
+Version: 5
 '''
 
 # Import packages
 import os
-import wrds
+import pyarrow as pa
+import pyarrow.parquet as pq
+import wrds_extract as wx
+from instrument import Probe
+from manifest import Manifest
 
 # Creating scratch directory
 group   = "....."  #change to your directory for group based on institution / WRDS subscription
 scratch = f"/scratch/{group}/wrds_compustat"
 os.makedirs(scratch, exist_ok=True)
 
-# Connect to WRDS
-db = wrds.Connection(wrds_username="your_username")
+# WRDS login and concurrency knob (one WRDS connection per worker)
+wrds_username = "your_username"
+workers       = 4
 
-# Define the Compustat variables
+# Output: "parquet" writes one dataset compustat_parquet/fyear=YYYY/;
+# "csv" keeps comp_{year}_partN.csv for 02_compustat.do
+output      = "parquet"
+dataset_dir = os.path.join(scratch, "compustat_parquet")
+
+# Shard manifest: reruns skip years recorded as done and re-fetch the rest
+manifest = Manifest(os.path.join(scratch, "manifest.sqlite"))
+
+# Per-chunk WRDS fetch / write timings go to logs/events.jsonl (pipeline.py report)
+probe = Probe(os.path.join(scratch, "logs"))
+
+# Define the Compustat variables (only what 02_compustat.do uses)
 comp_vars = [
     "gvkey",       # firm identifier
     "conm",        # company name
@@ -35,25 +52,54 @@ comp_vars = [
 
 cols = ", ".join(comp_vars)
 
-# Loop over each calendar year to keep the chunks small
-for year in range(2009, 2024):
-    print(f"Fetching Compustat data for fiscal year {year}…")
-    
-    sql = f"""
-        SELECT {cols},
-               fyear
-          FROM comp.funda
-         WHERE fyear BETWEEN 2009 AND 2023
-    """
-    
-    # Stream it in chunks of 100k rows
-    for i, chunk in enumerate(
-        db.raw_sql(sql, chunksize=100_000, return_iter=True),
-        start=1
-    ):
-        fn = f"comp_{year}_part{i}.csv"
-        out_path = os.path.join(scratch, fn)
+# One fiscal year per query; the standard funda screen and the year predicate
+# are evaluated on the WRDS server
+sql_template = """
+    SELECT {cols},
+           fyear
+      FROM comp.funda
+     WHERE fyear   = {year}
+       AND indfmt  = 'INDL'
+       AND datafmt = 'STD'
+       AND consol  = 'C'
+       AND popsrc  = 'D'
+"""
+
+# Fixed Arrow schema for the Parquet output
+schema = pa.schema(
+    [("gvkey", pa.string()), ("conm", pa.string())]
+    + [(v, pa.float64()) for v in comp_vars[2:]]
+    + [("fyear", pa.int32())]
+)
+
+# One shard per fiscal year
+years  = list(range(2009, 2024))
+shards = [wx.Shard("comp", "funda", str(yr), yr, yr, 1, ()) for yr in years]
+
+# Stream & write into scratch (called from the worker threads)
+def write_chunk(shard, part, chunk):
+    if output == "parquet":
+        out_dir = os.path.join(dataset_dir, f"fyear={shard.label}")
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, f"comp_{shard.label}_part{part}.parquet")
+        table = pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False)
+        pq.write_table(table, out_path)
+    else:
+        out_path = os.path.join(scratch, f"comp_{shard.label}_part{part}.csv")
         chunk.to_csv(out_path, index=False)
-        print(f"  → wrote {len(chunk)} rows to {fn}")
-        
-print("All done!")  
+    wx.log(f"  → wrote {len(chunk)} rows to {os.path.basename(out_path)}")
+    return [out_path]
+
+wx.run_shards(
+    shards,
+    query_for     = lambda s: sql_template.format(cols=cols, year=s.start),
+    write_chunk   = write_chunk,
+    wrds_username = wrds_username,
+    workers       = workers,
+    chunksize     = 100_000,
+    manifest      = manifest,
+    probe         = probe,
+    key_for       = lambda s: ("comp", f"funda:{output}", s.label, ""),
+)
+
+print("All done!")
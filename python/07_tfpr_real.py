@@ -0,0 +1,250 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Hsieh-Klenow real wedges, TFPQ/TFPR and Whited-Zhao finance inputs in DuckDB
+         (port of stata/04_tfpr_real.do)
+Version: 5
+'''
+
+# Import packages
+import os
+import duckdb
+import pandas as pd
+import catalog as cat
+from instrument import Probe
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+CLEAN_DIR = os.path.join(DATA_DIR, "orbis_em_2005_24_cleaned_by_year")
+ALPHA_DIR = os.path.join(DATA_DIR, "alpha")          # alpha_io.parquet (12_io_alpha.py) or alpha_*.dta (03_io.do)
+OUT_DIR   = os.path.join(DATA_DIR, "orbis_clean")     # year=YYYY/ partitions
+os.makedirs(OUT_DIR, exist_ok=True)
+
+# ── DuckDB connection ──────────────────────────────────────────────────────────
+con = duckdb.connect()
+con.execute("PRAGMA memory_limit='60GB';")
+con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
+
+# Statement profiles → logs/profiles/, logs/events.jsonl (pipeline.py report)
+probe = Probe(os.path.join(DATA_DIR, "logs"))
+
+# Stata semantics: log/power of a non-positive number and x / 0 are missing
+cat.stata_macros(con)
+
+def count(sql):
+    return con.execute(sql).fetchone()[0]
+
+# ── Input ──────────────────────────────────────────────────────────────────────
+src = f"parquet_scan('{CLEAN_DIR}/*/*.parquet', hive_partitioning => true)"
+
+# 04_tfpr_real.do drops the cleaner's *_usd / *_defl and rebuilds real USD values
+cols  = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {src}").fetchall()]
+keep  = [c for c in cols if not (c.endswith("_usd") or c.endswith("_defl"))]
+money = [v for v in cat.MONETARY_VARS if v in cols]
+
+# ── IO alpha lookups ───────────────────────────────────────────────────────────
+alpha_io    = os.path.join(ALPHA_DIR, "alpha_io.parquet")
+alpha_files = {name: os.path.join(ALPHA_DIR, f"{name}.dta")
+               for name in ("alpha_manuf", "alpha_others", "alpha_broad")}
+if os.path.exists(alpha_io):
+    con.execute(f"""
+      CREATE TEMP TABLE alpha_manuf  AS SELECT ctryiso, code AS major_sector, alpha
+        FROM read_parquet('{alpha_io}') WHERE level = 'major_sector';
+      CREATE TEMP TABLE alpha_others AS SELECT ctryiso, code AS nace2_main_section, alpha
+        FROM read_parquet('{alpha_io}') WHERE level = 'nace2_main_section';
+      CREATE TEMP TABLE alpha_broad  AS SELECT ctryiso, CAST(code AS INTEGER) AS broad_sector,
+        alpha AS alpha_bs FROM read_parquet('{alpha_io}') WHERE level = 'broad_sector';
+    """)
+elif all(os.path.exists(p) for p in alpha_files.values()):
+    for name, path in alpha_files.items():
+        con.register(f"{name}_df", pd.read_stata(path))
+    con.execute("""
+      CREATE TEMP TABLE alpha_manuf  AS SELECT ctryiso, major_sector, any_value(alpha) AS alpha
+        FROM alpha_manuf_df  GROUP BY ALL;
+      CREATE TEMP TABLE alpha_others AS SELECT ctryiso, nace2_main_section, any_value(alpha) AS alpha
+        FROM alpha_others_df GROUP BY ALL;
+      CREATE TEMP TABLE alpha_broad  AS SELECT ctryiso, CAST(broad_sector AS INTEGER) AS broad_sector,
+        any_value(alpha_bs) AS alpha_bs FROM alpha_broad_df GROUP BY ALL;
+    """)
+else:
+    print(f"WARNING: IO alpha files not found in {ALPHA_DIR}; tfpq2/tfpr2 will be missing")
+    con.execute("""
+      CREATE TEMP TABLE alpha_manuf  (ctryiso VARCHAR, major_sector VARCHAR, alpha DOUBLE);
+      CREATE TEMP TABLE alpha_others (ctryiso VARCHAR, nace2_main_section VARCHAR, alpha DOUBLE);
+      CREATE TEMP TABLE alpha_broad  (ctryiso VARCHAR, broad_sector INTEGER, alpha_bs DOUBLE);
+    """)
+
+# ── 1. Additional data cleaning + value added ──────────────────────────────────
+usd_block = ",\n        ".join(
+    f"{v} * (100.0 / deflator) * exchrate AS {v}_usd" for v in money)
+
+probe.sql(con, f"""
+CREATE OR REPLACE TEMP TABLE real AS
+WITH
+  src AS (
+    SELECT {", ".join(keep)}
+    FROM {src}
+    WHERE staf IS NOT NULL AND staf >= 0
+  ),
+
+  -- turn falls back to opre; drop if both are negative
+  turn_fix AS (
+    SELECT * REPLACE (CASE WHEN turn IS NULL OR turn = 0 THEN opre ELSE turn END AS turn)
+    FROM src
+  ),
+
+  -- real USD values, broad sector, NACE recodes
+  usd AS (
+    SELECT
+      *,
+      {usd_block},
+      CASE substr(nace2_main_section, 1, 1)
+        WHEN 'A' THEN 1 WHEN 'B' THEN 2 WHEN 'C' THEN 3 ELSE 4
+      END AS broad_sector,
+      CAST(CAST(TRY_CAST(naceccod2 AS DOUBLE) AS BIGINT) AS VARCHAR) AS nace_raw
+    FROM turn_fix
+    WHERE NOT COALESCE(turn < 0 AND opre < 0, false)
+  ),
+
+  nace AS (
+    SELECT
+      * EXCLUDE (nace_raw),
+      CASE WHEN length(nace_raw) = 3 THEN '0' || nace_raw ELSE nace_raw END AS nace_code
+    FROM usd
+  ),
+
+  industry AS (
+    SELECT
+      *,
+      TRY_CAST(substr(nace_code, 1, 1) AS INTEGER) AS industry1,
+      TRY_CAST(substr(nace_code, 1, 2) AS INTEGER) AS industry2,
+      TRY_CAST(substr(nace_code, 1, 3) AS INTEGER) AS industry3,
+      TRY_CAST(substr(nace_code, 1, 4) AS INTEGER) AS industry4
+    FROM nace
+  ),
+
+  -- 2. va_prod fallback cascade (Stata: `a | b & c` is `a | (b & c)`)
+  va1 AS (SELECT *, av_usd + staf_usd AS va_prod FROM industry),
+  va2 AS (SELECT * REPLACE (CASE WHEN va_prod IS NULL AND depr_usd IS NOT NULL
+                                 THEN ebta_usd + staf_usd + depr_usd ELSE va_prod END AS va_prod) FROM va1),
+  va3 AS (SELECT * REPLACE (CASE WHEN va_prod IS NULL OR (va_prod <= 0 AND depr_usd IS NOT NULL)
+                                 THEN oppl_usd + staf_usd + depr_usd ELSE va_prod END AS va_prod) FROM va2),
+  va4 AS (SELECT * REPLACE (CASE WHEN va_prod IS NULL OR (va_prod <= 0 AND cost_usd IS NOT NULL)
+                                 THEN opre_usd - cost_usd ELSE va_prod END AS va_prod) FROM va3),
+  va5 AS (SELECT * REPLACE (CASE WHEN va_prod IS NULL OR va_prod <= 0
+                                 THEN ebta_usd + staf_usd ELSE va_prod END AS va_prod) FROM va4),
+  va6 AS (SELECT * REPLACE (CASE WHEN va_prod IS NULL OR va_prod <= 0
+                                 THEN oppl_usd + staf_usd ELSE va_prod END AS va_prod) FROM va5)
+
+SELECT
+  *,
+  floor(industry4 / 1000) AS ind1,
+  floor(industry4 / 100)  AS ind2,
+  floor(industry4 / 10)   AS ind3,
+  va_prod AS va_usd,
+  CASE WHEN (va_prod - staf_usd) / va_prod > 0 THEN (va_prod - staf_usd) / va_prod END AS alpha_1
+FROM va6
+WHERE va_prod > 0
+""", 'real')
+print(f"rows with positive value added: {count('SELECT COUNT(*) FROM real'):,}")
+
+# ── α from ORBIS and from the IO tables ────────────────────────────────────────
+probe.sql(con, f"""
+CREATE OR REPLACE TEMP TABLE tfp AS
+WITH
+  alpha_orbis AS (
+    SELECT ctryiso, nace2_main_section, avg(alpha_1) AS alpha_orbis
+    FROM real GROUP BY ALL
+  ),
+  -- egen id = group(bvdid): firm_id is assigned in bvdid order by 04_clean_db
+  firm_ids AS (
+    SELECT firm_id, row_number() OVER (ORDER BY firm_id) AS id
+    FROM (SELECT DISTINCT firm_id FROM real)
+  ),
+  alpha AS (
+    SELECT
+      r.* REPLACE (COALESCE(r.alpha_1, ao.alpha_orbis) AS alpha_1),
+      ao.alpha_orbis,
+      f.id,
+      COALESCE(am.alpha, ot.alpha, ab.alpha_bs) AS alpha,
+      ab.alpha_bs
+    FROM real AS r
+    LEFT JOIN alpha_orbis  AS ao USING (ctryiso, nace2_main_section)
+    LEFT JOIN firm_ids     AS f  USING (firm_id)
+    LEFT JOIN alpha_manuf  AS am USING (ctryiso, major_sector)
+    LEFT JOIN alpha_others AS ot USING (ctryiso, nace2_main_section)
+    LEFT JOIN alpha_broad  AS ab USING (ctryiso, broad_sector)
+  )
+
+-- TFPQ / TFPR with the ORBIS α (1) and the IO α (2)
+SELECT
+  *,
+  {cat.tfp_block()},
+  safe_ln(tfpq1) AS ln_tfpq1,
+  safe_ln(tfpq2) AS ln_tfpq2,
+  safe_ln(tfpr1) AS ln_tfpr1,
+  safe_ln(tfpr2) AS ln_tfpr2
+FROM alpha
+""", 'tfp')
+con.execute("DROP TABLE real")
+
+# ── Demeaned logs, 3. finance inputs, write ────────────────────────────────────
+print(f"Writing year partitions → {OUT_DIR}/year=*/")
+probe.sql(con, f"""
+COPY (
+  WITH
+    means AS (
+      SELECT
+        nace2_main_section, ctryiso,
+        avg(ln_tfpq1) AS avg_ln_tfpq1, avg(ln_tfpq2) AS avg_ln_tfpq2,
+        avg(ln_tfpr1) AS avg_ln_tfpr1, avg(ln_tfpr2) AS avg_ln_tfpr2
+      FROM tfp GROUP BY ALL
+    ),
+    demeaned AS (
+      SELECT
+        t.*,
+        m.avg_ln_tfpq1, t.ln_tfpq1 - m.avg_ln_tfpq1 AS d_ln_tfpq1,
+        m.avg_ln_tfpq2, t.ln_tfpq2 - m.avg_ln_tfpq2 AS d_ln_tfpq2,
+        m.avg_ln_tfpr1, t.ln_tfpr1 - m.avg_ln_tfpr1 AS d_ln_tfpr1,
+        m.avg_ln_tfpr2, t.ln_tfpr2 - m.avg_ln_tfpr2 AS d_ln_tfpr2,
+        t.tshf_usd - t.shfd_usd AS D_si,
+        t.shfd_usd              AS E_si
+      FROM tfp AS t
+      LEFT JOIN means AS m USING (nace2_main_section, ctryiso)
+    ),
+
+    -- profit-flow fallback cascade
+    pf1 AS (SELECT *, cf_usd * (deflator / 100) AS PF_si FROM demeaned
+            WHERE D_si > 0 AND E_si > 0),
+    pf2 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR (PF_si <= 0 AND depr_usd IS NOT NULL)
+                                   THEN (oppl_usd + depr_usd) * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf1),
+    pf3 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR (PF_si <= 0 AND depr_usd IS NOT NULL)
+                                   THEN (pl_usd + depr_usd) * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf2),
+    pf4 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR PF_si <= 0
+                                   THEN oppl_usd * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf3),
+    pf5 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR PF_si <= 0
+                                   THEN pl_usd * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf4),
+    pf6 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR PF_si <= 0
+                                   THEN _315506_usd * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf5),
+    pf7 AS (SELECT * REPLACE (CASE WHEN PF_si IS NULL OR PF_si <= 0
+                                   THEN va_usd * (deflator / 100) ELSE PF_si END AS PF_si) FROM pf6)
+
+  SELECT
+    *,
+    PF_si * (100 / deflator)   AS F_si,
+    safe_ln(F_si)              AS f_i,
+    safe_ln(D_si)              AS d_i,
+    safe_ln(E_si)              AS e_i,
+    pow(d_i - e_i, 2)          AS de_i
+  FROM pf7
+  WHERE PF_si > 0
+)
+TO '{OUT_DIR}'
+(FORMAT PARQUET, PARTITION_BY (year), OVERWRITE TRUE, FILENAME_PATTERN 'data_{{i}}');
+""", 'copy_years')
+n_out = count(f"SELECT COUNT(*) FROM parquet_scan('{OUT_DIR}/*/*.parquet')")
+print(f"orbis_clean rows: {n_out:,}")
+print("All done!")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 1
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_tfpr_real
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting real wedges at $(date)" > 07_tfpr_real.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 07_tfpr_real.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 07_tfpr_real.log
+
+# 2) Build real wedges and TFP
+echo "Running 07_tfpr_real.py at $(date)" &>> 07_tfpr_real.log
+if python3 07_tfpr_real.py &>> 07_tfpr_real.log; then
+  echo "07_tfpr_real.py finished successfully at $(date)" &>> 07_tfpr_real.log
+else
+  echo "ERROR: 07_tfpr_real.py failed! See above log." &>> 07_tfpr_real.log
+  exit 1
+fi
+
+echo "Finished real wedges at $(date)" &>> 07_tfpr_real.log
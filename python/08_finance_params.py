@@ -0,0 +1,287 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Whited-Zhao finance parameters (beta_D, beta_E, beta_DE, alpha_s, gamma_s)
+         from grouped within-firm sufficient statistics (port of stata/05_finance_loop.do),
+         plus one resolved (ctryiso, ind2) lookup with the level each value came from
+Version: 3
+'''
+
+# Import packages
+import os
+import duckdb
+import numpy as np
+import pandas as pd
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+CLEAN_DIR = os.path.join(DATA_DIR, "orbis_clean")     # from 07_tfpr_real.py
+OUT_DIR   = DATA_DIR                                  # fin_param*.parquet / .dta
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+MIN_OBS = 10          # 05_finance_loop.do skips industries with fewer rows
+GAMMA_RANGE = (0, 4)  # 07_tfpr_finance.do falls back while gamma_s is outside this
+THREADS = os.cpu_count()
+
+# f_i = b_D d_i + b_E e_i + b_DE de_i + u_i + e_it, estimated by `xtreg, fe`
+Y  = 'f_i'
+XS = ['d_i', 'e_i', 'de_i']
+K  = len(XS)
+
+# GROUPING_ID(ctryiso, ind2, ind1) → estimation level
+LEVELS = {
+    1: ('ctry_ind2', ['ctryiso', 'ind2']),
+    2: ('ctry_ind1', ['ctryiso', 'ind1']),
+    5: ('ind2',      ['ind2']),
+    6: ('ind1',      ['ind1']),
+}
+
+# ── DuckDB connection ──────────────────────────────────────────────────────────
+con = duckdb.connect()
+con.execute("PRAGMA memory_limit='60GB';")
+con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
+con.execute(f"PRAGMA threads={THREADS};")
+
+
+# ── 1. Sufficient statistics, all levels in one scan ───────────────────────────
+def moment_sql():
+    '''Per (level, group) within-firm cross-products of [X y] plus group totals.
+
+    The inner query sums raw moments by (level key, firm) under GROUPING SETS;
+    the outer one removes each firm's mean (S_xy - S_x S_y / n) and sums over
+    firms, which is exactly the X'X and X'y of the fixed-effects transform.
+    '''
+    vs = XS + [Y]
+    raw, within = [], []
+    for i, a in enumerate(vs):
+        raw.append(f"SUM({a}) AS s_{a}")
+        for b in vs[i:]:
+            raw.append(f"SUM({a} * {b}) AS s_{a}__{b}")
+            within.append(f"SUM(s_{a}__{b} - s_{a} * s_{b} / n) AS w_{a}__{b}")
+    totals = [f"SUM(s_{a}) AS t_{a}" for a in vs]
+    return f"""
+    WITH firm AS (
+      SELECT
+        GROUPING_ID(ctryiso, ind2, ind1) AS lvl,
+        ctryiso, ind2, ind1, id,
+        COUNT(*) AS n,
+        {", ".join(raw)}
+      FROM parquet_scan('{CLEAN_DIR}/*/*.parquet', hive_partitioning => true)
+      WHERE ind2 IS NOT NULL AND ind1 IS NOT NULL
+        AND {" AND ".join(f"{v} IS NOT NULL" for v in vs)}
+      GROUP BY GROUPING SETS (
+        (ctryiso, ind2, id), (ctryiso, ind1, id), (ind2, id), (ind1, id)
+      )
+    )
+    SELECT
+      lvl, ctryiso, ind2, ind1,
+      SUM(n) AS n,
+      COUNT(*) AS n_firms,
+      {", ".join(totals)},
+      {", ".join(within)}
+    FROM firm
+    WHERE lvl IN (5, 6) OR ctryiso IS NOT NULL
+    GROUP BY lvl, ctryiso, ind2, ind1
+    HAVING SUM(n) >= {MIN_OBS}
+    """
+
+
+# ── 2. Batched within-OLS solve ────────────────────────────────────────────────
+def _scaled_cond(xx):
+    '''Condition number of X'X rescaled to unit diagonal (scale-free).'''
+    d = np.sqrt(np.clip(np.diagonal(xx, axis1=-2, axis2=-1), 0, None))
+    flat = ~(d > 0).all(axis=-1)                  # a regressor without within variation
+    d = np.where(flat[..., None], 1.0, d)
+    c = np.linalg.cond(xx / (d[..., :, None] * d[..., None, :]))
+    return np.where(flat | ~np.isfinite(c), np.inf, c)
+
+
+def _sweep(xx, xy, tol=1e-9):
+    '''Solve one system dropping collinear regressors in order, like Stata's
+    rmcoll: a regressor whose within variance is (numerically) explained by the
+    ones already kept gets a zero coefficient.'''
+    keep = []
+    for k in range(K):
+        cand = keep + [k]
+        if xx[k, k] > 0 and _scaled_cond(xx[np.ix_(cand, cand)]) < 1 / tol:
+            keep = cand
+    b = np.zeros(K)
+    if keep:
+        b[keep] = np.linalg.solve(xx[np.ix_(keep, keep)], xy[keep])
+    return b
+
+
+def solve(m):
+    '''Fixed-effects coefficients and constant for every group in `m`.'''
+    G = len(m)
+    xx, xy = np.empty((G, K, K)), np.empty((G, K))
+    for i, a in enumerate(XS):
+        xy[:, i] = m[f"w_{a}__{Y}"]
+        for j, b in enumerate(XS[i:], start=i):
+            xx[:, i, j] = xx[:, j, i] = m[f"w_{a}__{b}"]
+
+    beta = np.full((G, K), np.nan)
+    ok = _scaled_cond(xx) < 1e9
+    if ok.any():
+        beta[ok] = np.linalg.solve(xx[ok], xy[ok][..., None])[..., 0]
+    for g in np.flatnonzero(~ok):
+        beta[g] = _sweep(xx[g], xy[g])
+
+    out = m[['lvl', 'ctryiso', 'ind2', 'ind1', 'n', 'n_firms']].copy()
+    for i, a in enumerate(XS):
+        out[f"beta_{a}"] = beta[:, i]
+    # xtreg, fe reports the constant at the grand means of the estimation sample
+    xbar = np.column_stack([m[f"t_{a}"] for a in XS]) / m['n'].to_numpy()[:, None]
+    out['constant'] = m[f"t_{Y}"] / m['n'] - (xbar * beta).sum(axis=1)
+    return out.rename(columns={'beta_d_i': 'beta_D', 'beta_e_i': 'beta_E', 'beta_de_i': 'beta_DE'})
+
+
+def ces_params(df):
+    '''sumB, alpha_s, gamma_s and the `bad` flag of 05_finance_loop.do.'''
+    df['sumB']    = df['beta_D'] + df['beta_E']
+    # x/0 is missing in Stata, not +/-inf
+    df['alpha_s'] = df['beta_D'] / df['sumB'].where(df['sumB'] != 0)
+    den = df['alpha_s'] * (1 - df['alpha_s'])
+    inside = df['alpha_s'].between(0, 1) & (den != 0)
+    df['gamma_s'] = np.where(inside, 1 + 2 * df['beta_DE'] / den.where(den != 0), np.nan)
+    # Stata: missing compares greater than any number
+    a = df['alpha_s']
+    df['bad'] = ((a <= 0) | (a >= 1) | a.isna() | (df['gamma_s'] <= 1) | df['gamma_s'].isna()).astype('int8')
+    return df
+
+
+# ── 3. PART 3/4 merge logic ────────────────────────────────────────────────────
+PARAMS = ['beta_D', 'beta_E', 'beta_DE', 'sumB', 'alpha_s']
+
+
+def merge_levels(ind2, ind1, keys):
+    '''ind2 estimates with the 1-digit fallback: inner merge on ind1, 1-digit
+    values where gamma_s is missing, 1-digit gamma_s where the fit is bad.'''
+    ind1 = ind1[keys + ['ind1'] + PARAMS + ['gamma_s']]
+    df = ind2.merge(ind1, on=keys + ['ind1'], how='inner', suffixes=('', '1'))
+    miss = df['gamma_s'].isna()
+    for v in PARAMS:
+        df.loc[miss, v] = df.loc[miss, f"{v}1"]
+    bad = df['bad'] == 1
+    df.loc[bad, 'gamma_s'] = df.loc[bad, 'gamma_s1']
+    cols = keys + ['ind2', 'ind1'] + PARAMS + ['gamma_s']
+    return df[cols].sort_values(keys + ['ind2']).reset_index(drop=True)
+
+
+def collapse_ind1(df, keys, suffix):
+    '''collapse (mean) of the merged parameters by ind1, renamed with `suffix`.'''
+    out = df.groupby(keys + ['ind1'], as_index=False)[PARAMS + ['gamma_s']].mean()
+    return out.rename(columns={v: f"{v}{suffix}" for v in PARAMS + ['gamma_s']})
+
+
+# ── 4. 07_tfpr_finance.do's fallbacks, resolved once per key ───────────────────
+# (level, column suffix) in fallback order. "ctry" is 07_tfpr_finance.do: the
+# betas/alpha_s from ind2 x country, or ind1 x country where gamma_s is
+# missing, and gamma_s down to the pooled levels. "pooled" ignores country.
+SOURCES = {
+    'ctry':   dict(params=[('ctry_ind2', ''), ('ctry_ind1', '1')],
+                   gamma=[('ctry_ind2', ''), ('ctry_ind1', '1'), ('ind2', '2'), ('ind1', '1_1')]),
+    'pooled': dict(params=[('ind2', '2'), ('ind1', '1_1')],
+                   gamma=[('ind2', '2'), ('ind1', '1_1')]),
+}
+
+
+def cascade(df, levels):
+    '''gamma_s and its level: replaced by the next level's value while it is
+    missing or outside GAMMA_RANGE (whether or not that value is any better).'''
+    lo, hi = GAMMA_RANGE
+    gamma = df[f"gamma_s{levels[0][1]}"]
+    level = pd.Series(levels[0][0], index=df.index, dtype=object)
+    for name, sfx in levels[1:]:
+        bad = ~(gamma.notna() & (gamma >= lo) & (gamma <= hi))
+        gamma = gamma.where(~bad, df[f"gamma_s{sfx}"])
+        level = level.where(~bad, name)
+    return gamma, level.where(gamma.notna())
+
+
+def resolve(keys, tables):
+    '''One row per (source, ctryiso, ind2): the parameters a firm in that cell
+    gets and the level that supplied them (param_level for the betas and
+    alpha_s, gamma_level for gamma_s).
+
+    The four merges of 07_tfpr_finance.do happen here on the key table, so
+    attaching parameters to the panel is a single join on (ctryiso, ind2).
+    '''
+    ctry, ctry_1, pooled, pooled_1 = tables
+    keys = keys.assign(ind1=np.floor(keys['ind2'] / 10))
+    df = (keys
+          .merge(ctry.drop(columns='ind1'), on=['ctryiso', 'ind2'], how='left')
+          .merge(ctry_1, on=['ctryiso', 'ind1'], how='left')
+          .merge(pooled, on='ind2', how='left')
+          .merge(pooled_1, on='ind1', how='left'))
+    out = []
+    for source, spec in SOURCES.items():
+        (own, sfx), (fb, fb_sfx) = spec['params']
+        has = df[f"gamma_s{sfx}"].notna()
+        r = keys.assign(source=source)
+        for v in PARAMS:
+            r[v] = df[f"{v}{sfx}"].where(has, df[f"{v}{fb_sfx}"])
+        r['param_level'] = np.where(has, own, np.where(df[f"alpha_s{fb_sfx}"].notna(), fb, None))
+        r['gamma_s'], r['gamma_level'] = cascade(df, spec['gamma'])
+        out.append(r)
+    cols = ['source', 'ctryiso', 'ind2', 'ind1'] + PARAMS + ['gamma_s', 'param_level', 'gamma_level']
+    return pd.concat(out, ignore_index=True)[cols]
+
+
+def save(df, name):
+    df.to_parquet(os.path.join(OUT_DIR, f"{name}.parquet"), index=False)
+    df.to_stata(os.path.join(OUT_DIR, f"{name}.dta"), write_index=False)
+    print(f"  {name}: {len(df):,} rows")
+
+
+if __name__ == '__main__':
+    print(f"Scanning {CLEAN_DIR} ...")
+    m = con.execute(moment_sql()).df()
+    print(f"{len(m):,} groups with at least {MIN_OBS} observations")
+
+    est = ces_params(solve(m))
+    part = {name: est[est['lvl'] == lvl].drop(columns='lvl')
+            for lvl, (name, _) in LEVELS.items()}
+    for name in ('ctry_ind2', 'ind2'):
+        part[name]['ind1'] = np.floor(part[name]['ind2'] / 10)
+    for name, _ in LEVELS.values():
+        p = part[name]
+        print(f"  {name:<10}{len(p):>6,} fits, {int(p['bad'].sum()):,} flagged bad")
+
+    # Country x industry (fin_param_ctry, fin_param_ctry_1)
+    ctry = merge_levels(part['ctry_ind2'], part['ctry_ind1'], ['ctryiso'])
+    ctry_1 = collapse_ind1(ctry, ['ctryiso'], '1')
+    save(ctry, 'fin_param_ctry')
+    save(ctry_1, 'fin_param_ctry_1')
+
+    # Pooled across countries (fin_param: *2, fin_param_1: *1_1)
+    pooled = merge_levels(part['ind2'], part['ind1'], [])
+    pooled_1 = collapse_ind1(pooled, [], '1_1')
+    pooled = pooled.drop(columns='ind1').rename(columns={v: f"{v}2" for v in PARAMS + ['gamma_s']})
+    save(pooled, 'fin_param')
+    save(pooled_1, 'fin_param_1')
+
+    # Resolved lookup for every (ctryiso, ind2) in the panel
+    keys = con.execute(f"""
+      SELECT DISTINCT ctryiso, ind2
+      FROM parquet_scan('{CLEAN_DIR}/*/*.parquet', hive_partitioning => true)
+      WHERE ind2 IS NOT NULL
+      ORDER BY ctryiso, ind2
+    """).df()
+    res = resolve(keys, (ctry, ctry_1, pooled, pooled_1))
+    res.to_parquet(os.path.join(OUT_DIR, "fin_param_resolved.parquet"), index=False)
+    # Stata: the "ctry" rows, for a single merge m:1 ctryiso ind2
+    ctry_res = res[res['source'] == 'ctry'].drop(columns='source')
+    ctry_res.fillna({'param_level': '', 'gamma_level': ''}) \
+        .to_stata(os.path.join(OUT_DIR, "fin_param_resolved.dta"), write_index=False)
+    print(f"  fin_param_resolved: {len(keys):,} keys, gamma_s from "
+          + ", ".join(f"{k or 'none'} {n:,}" for k, n in
+                      ctry_res['gamma_level'].fillna('').value_counts().items()))
+
+    # Raw fits at every level, for diagnostics
+    est['level'] = est['lvl'].map({k: v[0] for k, v in LEVELS.items()})
+    est.drop(columns='lvl').to_parquet(os.path.join(OUT_DIR, "fin_fits.parquet"), index=False)
+    print("All done!")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 1
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_fin_params
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting finance parameters at $(date)" > 08_finance_params.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 08_finance_params.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 08_finance_params.log
+
+# 2) Estimate finance parameters
+echo "Running 08_finance_params.py at $(date)" &>> 08_finance_params.log
+if python3 08_finance_params.py &>> 08_finance_params.log; then
+  echo "08_finance_params.py finished successfully at $(date)" &>> 08_finance_params.log
+else
+  echo "ERROR: 08_finance_params.py failed! See above log." &>> 08_finance_params.log
+  exit 1
+fi
+
+echo "Finished finance parameters at $(date)" &>> 08_finance_params.log
@@ -0,0 +1,228 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Calibrate sigma on a dense grid from shared sector-year aggregates,
+         with golden-section refinement and bootstrap CIs (port of stata/06_sigma.do)
+Version: 2
+'''
+
+# Import packages
+import os
+import duckdb
+import numpy as np
+import pandas as pd
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+CLEAN_DIR = os.path.join(DATA_DIR, "orbis_clean")     # from 07_tfpr_real.py
+OUT_DIR   = DATA_DIR
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+# Stata grid: 1.1 1.2 ... 1.77 ... 5. The dense grid keeps those points.
+STATA_GRID = [1.1, 1.2, 1.3, 1.4, 1.5, 1.6, 1.7, 1.77, 1.8, 1.9, 2, 2.5, 3, 4, 5]
+GRID       = np.unique(np.round(np.r_[np.arange(1.05, 6.0001, 0.01), STATA_GRID], 4))
+
+BY         = []        # [] pooled, ['ctryiso'] per country, ['ind1'] / ['ind2'] per sector
+REFINE     = True      # golden-section search around the grid minimum
+BOOTSTRAP  = 500       # cell bootstrap replications (0 to skip)
+SEED       = 20250814
+THREADS    = os.cpu_count()
+
+# ── DuckDB connection ──────────────────────────────────────────────────────────
+con = duckdb.connect()
+con.execute("PRAGMA memory_limit='60GB';")
+con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
+con.execute(f"PRAGMA threads={THREADS};")
+
+
+# ── 1. Sector-year cells, built once ───────────────────────────────────────────
+def stage_cells():
+    '''ln F_si keyed by an integer (BY x ind2 x year) cell id, plus one row per
+    cell with its group id and the benchmark ln F_s = ln(sum F_si).'''
+    keys = BY + ['ind2', 'year']
+    src  = f"parquet_scan('{CLEAN_DIR}/*/*.parquet', hive_partitioning => true)"
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE cells AS
+    SELECT
+      row_number() OVER (ORDER BY {", ".join(keys)}) - 1 AS cell,
+      dense_rank() OVER (ORDER BY {", ".join(BY) or "1"}) - 1 AS grp,
+      {", ".join(keys)},
+      n, ln(F_s) AS lnF_s
+    FROM (
+      SELECT {", ".join(keys)}, COUNT(*) AS n, SUM(F_si) AS F_s
+      FROM {src}
+      WHERE F_si > 0 AND ind2 IS NOT NULL AND year IS NOT NULL
+      GROUP BY ALL
+    )
+    """)
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE firm_f AS
+    SELECT c.cell, ln(s.F_si) AS lnF
+    FROM {src} AS s
+    JOIN cells AS c USING ({", ".join(keys)})
+    WHERE s.F_si > 0
+    ORDER BY c.cell
+    """)
+    return con.execute("SELECT * FROM cells ORDER BY cell").df()
+
+
+# ── 2. ln A_st(sigma) for a whole vector of sigmas in one pass ─────────────────
+def log_sums(sigmas, idx=None):
+    '''(cells x sigmas) matrix of ln sum_i F_si^((sigma-1)/sigma); with `idx`
+    only those cells (rows in idx order), scanning only their cell-id range.'''
+    rows = np.arange(len(cells)) if idx is None else np.asarray(idx)
+    where = "" if idx is None else f"WHERE f.cell BETWEEN {rows.min()} AND {rows.max()}"
+    grid = pd.DataFrame({'k': np.arange(len(sigmas)), 'rho': (sigmas - 1) / sigmas})
+    con.register('grid_df', grid)
+    a = con.execute(f"""
+      SELECT g.k, f.cell, ln(SUM(exp(g.rho * f.lnF))) AS lnA
+      FROM firm_f AS f CROSS JOIN grid_df AS g
+      {where}
+      GROUP BY ALL
+    """).df()
+    con.unregister('grid_df')
+    pos = np.full(len(cells), -1)
+    pos[rows] = np.arange(len(rows))
+    r = pos[a['cell'].to_numpy()]
+    ok = r >= 0
+    out = np.full((len(rows), len(sigmas)), np.nan)
+    out[r[ok], a['k'].to_numpy()[ok]] = a['lnA'].to_numpy()[ok]
+    return out
+
+
+def residuals(sigmas, idx=None):
+    '''diff = ln F_s - sigma/(sigma-1) ln A, for every cell (or the cells in
+    `idx`) and sigma.'''
+    sigmas = np.atleast_1d(np.asarray(sigmas, dtype=float))
+    lnF_s = cells['lnF_s'].to_numpy()
+    if idx is not None:
+        lnF_s = lnF_s[idx]
+    return lnF_s[:, None] - sigmas / (sigmas - 1) * log_sums(sigmas, idx)
+
+
+def loss(diff, w=None):
+    '''06_sigma.do: mse = Var(diff) + mean(diff)^2 (n-1 variance), mad = mean|diff|.
+
+    `diff` is (cells x sigmas); `w` are optional cell frequency weights
+    (B x cells) for the bootstrap. A single cell has no variance term, so
+    its mse is mean(diff)^2.
+    '''
+    if w is None:
+        w = np.ones((1, diff.shape[0]))
+    n    = w.sum(axis=1, keepdims=True)
+    mean = w @ diff / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.where(n > 1, (w @ diff**2 / n - mean**2) * n / (n - 1), 0.0)
+    mad  = w @ np.abs(diff) / n
+    return var + mean**2, mad
+
+
+# ── 3. Refinement and bootstrap ────────────────────────────────────────────────
+def golden(f, lo, hi, tol=1e-4):
+    '''Golden-section minimum of a unimodal f on [lo, hi].'''
+    r = (np.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    c, d = b - r * (b - a), a + r * (b - a)
+    fc, fd = f(c), f(d)
+    while b - a > tol:
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - r * (b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + r * (b - a)
+            fd = f(d)
+    return (a + b) / 2
+
+
+def parabolic_min(sigmas, mse):
+    '''Vertex of the parabola through the grid minimum and its neighbours,
+    row by row for a (B x sigmas) loss matrix.'''
+    k = np.clip(np.nanargmin(mse, axis=1), 1, len(sigmas) - 2)
+    x0, x1, x2 = sigmas[k - 1], sigmas[k], sigmas[k + 1]
+    rows = np.arange(len(k))
+    y0, y1, y2 = mse[rows, k - 1], mse[rows, k], mse[rows, k + 1]
+    num = (x1 - x0)**2 * (y1 - y2) - (x1 - x2)**2 * (y1 - y0)
+    den = (x1 - x0) * (y1 - y2) - (x1 - x2) * (y1 - y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xv = x1 - 0.5 * num / den
+    return np.where(np.isfinite(xv) & (xv >= x0) & (xv <= x2), xv, x1)
+
+
+def bootstrap(diff, rng):
+    '''Cell bootstrap of the parabolic grid minimiser.'''
+    n = diff.shape[0]
+    w = rng.multinomial(n, np.full(n, 1 / n), size=BOOTSTRAP).astype(float)
+    mse, _ = loss(diff, w)
+    return parabolic_min(GRID, mse)
+
+
+def elbow(curve):
+    '''Slope/curvature diagnostics and elbow picks from 06_sigma.do.'''
+    c = curve.sort_values('sigma_val').reset_index(drop=True)
+    ds = c['sigma_val'].diff()
+    c['d1'] = np.log(c['mse_val']).diff() / ds
+    c['d2'] = c['d1'].diff() / ds
+    c.loc[0:1, 'd2'] = np.nan
+    c['rel_improve'] = -c['mse_val'].diff() / c['mse_val'].shift()
+    c['delta_rel'] = c['rel_improve'].diff()
+    c.loc[0:1, 'delta_rel'] = np.nan
+    pick = c.loc[c['delta_rel'].idxmin(), 'sigma_val'] if c['delta_rel'].notna().any() else np.nan
+    flat = c.loc[c['d1'].abs() < 0.2 * c['d1'].abs().max(), 'sigma_val'].tolist()
+    return c, pick, flat
+
+
+if __name__ == '__main__':
+    print(f"Staging sector-year cells from {CLEAN_DIR} ...")
+    cells = stage_cells()
+    print(f"{len(cells):,} cells, {int(cells['n'].sum()):,} firm-years, "
+          f"{cells['grp'].nunique()} group(s)")
+
+    print(f"Evaluating {len(GRID)} sigmas ...")
+    diff = residuals(GRID)
+    rng = np.random.default_rng(SEED)
+
+    curves, estimates = [], []
+    for g, idx in cells.groupby('grp').indices.items():
+        label = cells.loc[idx[0], BY].to_dict() if BY else {}
+        mse, mad = loss(diff[idx])
+        curve = pd.DataFrame({'sigma_val': GRID, 'mse_val': mse[0], 'mad_val': mad[0]})
+        curve, pick, flat = elbow(curve)
+        k = int(np.nanargmin(mse[0]))
+        est = {**label, 'cells': len(idx), 'sigma_grid': GRID[k], 'mse_grid': mse[0, k],
+               'at_bound': k in (0, len(GRID) - 1), 'sigma_elbow': pick}
+
+        if REFINE:
+            lo, hi = GRID[max(k - 1, 0)], GRID[min(k + 1, len(GRID) - 1)]
+            obj = lambda s: loss(residuals(s, idx))[0][0, 0]   # this group's cells only
+            est['sigma_refined'] = golden(obj, lo, hi)
+            est['mse_refined'] = obj(est['sigma_refined'])
+
+        if BOOTSTRAP and len(idx) > 2:
+            draws = bootstrap(diff[idx], rng)
+            est['sigma_boot_se'] = draws.std(ddof=1)
+            est['sigma_ci_lo'], est['sigma_ci_hi'] = np.percentile(draws, [2.5, 97.5])
+
+        tag = ", ".join(f"{k}={v}" for k, v in label.items()) or "pooled"
+        print(f"  {tag}: sigma={est.get('sigma_refined', est['sigma_grid']):.4f}"
+              f"  grid={est['sigma_grid']:.2f}  elbow={pick}")
+        if est['at_bound']:
+            print("    minimum at the edge of the grid; see the elbow / |d1| picks")
+        if flat:
+            print(f"    |d1| < 20% of max at sigma in {flat[:5]}{' ...' if len(flat) > 5 else ''}")
+        curves.append(curve.assign(**label))
+        estimates.append(est)
+
+    curve = pd.concat(curves, ignore_index=True)
+    curve.to_parquet(os.path.join(OUT_DIR, "sigma_loss_curve.parquet"), index=False)
+    curve[BY + ['sigma_val', 'mse_val', 'mad_val']].to_stata(
+        os.path.join(OUT_DIR, "sigma_loss_curve.dta"), write_index=False)
+    pd.DataFrame(estimates).to_parquet(os.path.join(OUT_DIR, "sigma_estimates.parquet"), index=False)
+
+    print(curve.loc[curve['sigma_val'].isin(STATA_GRID), BY + ['sigma_val', 'mse_val', 'mad_val']]
+          .to_string(index=False, float_format="%9.4f"))
+    print("All done!")
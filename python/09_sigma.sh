@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 1
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_sigma
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting sigma calibration at $(date)" > 09_sigma.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 09_sigma.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 09_sigma.log
+
+# 2) Calibrate sigma
+echo "Running 09_sigma.py at $(date)" &>> 09_sigma.log
+if python3 09_sigma.py &>> 09_sigma.log; then
+  echo "09_sigma.py finished successfully at $(date)" &>> 09_sigma.log
+else
+  echo "ERROR: 09_sigma.py failed! See above log." &>> 09_sigma.log
+  exit 1
+fi
+
+echo "Finished sigma calibration at $(date)" &>> 09_sigma.log
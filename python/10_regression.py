@@ -0,0 +1,256 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Regression sweep over absorb sets with clustered SEs and esttab-style
+         tables (port of stata/09_regression.do)
+Version: 3
+'''
+
+# Import packages
+import os
+import duckdb
+import pandas as pd
+from hdfe import Spec, run_specs, tidy, esttab, wild_bootstrap
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR = "/scratch/[your_group]/wrds_batch"
+FINAL    = os.path.join(DATA_DIR, "orbis_final")      # .parquet (dir or file) or .dta
+ZSCORE   = os.path.join(DATA_DIR, "bank_zscore.dta")  # ctryiso year resilience
+STRINGENCY = os.path.join(DATA_DIR, "stringency.dta") # ctryiso year severity
+EFD_NACE = os.path.join(DATA_DIR, "efd_nace.parquet") # ind2 -> high_efd (14_compustat_efd.py)
+OUT_DIR  = os.path.join(DATA_DIR, "tables")
+os.makedirs(OUT_DIR, exist_ok=True)
+
+HIGH_EFD_CUTOFF = 12.46391     # from Compustat (02_compustat.do)
+# "orbis"     : 09_regression.do, the firm's own efd > HIGH_EFD_CUTOFF
+# "compustat" : the industry's Compustat EFD split (efd_nace.parquet on ind2)
+HIGH_EFD = "orbis"
+
+# ── Wild cluster bootstrap (24 country clusters) ───────────────────────────────
+BOOTSTRAP    = True
+BOOT_Y       = ('sd_ln_tfpr1_real', 'TFPgain')   # pass-through and TFP-loss models
+BOOT_REPS    = 9999
+BOOT_BATCH   = 1000
+BOOT_WORKERS = int(os.environ.get("NSLOTS", os.cpu_count()))
+BOOT_WEIGHTS = "webb"                            # or "rademacher"
+BOOT_SEED    = 20250814
+
+# ── DuckDB connection ──────────────────────────────────────────────────────────
+con = duckdb.connect()
+con.execute("PRAGMA memory_limit='60GB';")
+con.execute("PRAGMA temp_directory='/scratch/[your_group]/duckdb_tmp';")
+con.execute("CREATE MACRO safe_ln(x) AS CASE WHEN x > 0 THEN ln(x) END")
+
+
+def source():
+    if os.path.isdir(FINAL):
+        return f"parquet_scan('{FINAL}/**/*.parquet', hive_partitioning => true)"
+    if os.path.exists(FINAL + ".parquet"):
+        return f"parquet_scan('{FINAL}.parquet')"
+    con.register('final_df', pd.read_stata(FINAL + ".dta", convert_categoricals=False))
+    return "final_df"
+
+
+def optional_dta(path, name, cols):
+    if os.path.exists(path):
+        con.register(name, pd.read_stata(path, convert_categoricals=False)[['ctryiso', 'year'] + cols])
+        return True
+    print(f"WARNING: {path} not found; Model 3 is skipped")
+    return False
+
+
+# ── Analysis frames ────────────────────────────────────────────────────────────
+def main_frame(src, with_m3):
+    '''Models 1-3: 2009 dropped, cell SDs, deviations, covid and high_efd.'''
+    m3_join = """
+      LEFT JOIN zscore_df     USING (ctryiso, year)
+      LEFT JOIN stringency_df USING (ctryiso, year)""" if with_m3 else ""
+    if HIGH_EFD == "compustat":
+        efd_join = f"""
+      LEFT JOIN (SELECT ind2, high_efd AS comp_high_efd FROM read_parquet('{EFD_NACE}')) USING (ind2)"""
+        high_efd = "CAST(comp_high_efd AS INTEGER)"
+    else:
+        # Stata: a missing efd compares greater than the cutoff
+        efd_join, high_efd = "", f"CAST(COALESCE(efd > {HIGH_EFD_CUTOFF}, true) AS INTEGER)"
+    return con.execute(f"""
+    WITH
+      base AS (
+        SELECT *, dense_rank() OVER (ORDER BY ctryiso) AS country2
+        FROM {src}
+        WHERE year <> 2009
+      ),
+      dev AS (
+        SELECT
+          *,
+          safe_ln(tfpr1    / avg(tfpr1)    OVER cst) AS dev_ln_tfpr1,
+          safe_ln(tfpr2    / avg(tfpr2)    OVER cst) AS dev_ln_tfpr2,
+          safe_ln(tfpr_fin / avg(tfpr_fin) OVER cst) AS dev_ln_tfpr_fin,
+          safe_ln(tfpr_fin / avg(tfpr_fin) OVER st)  AS ln_tfpr_dev,
+          safe_ln(Z_si     / avg(Z_si)     OVER st)  AS ln_Z_dev,
+          tfas_usd + ifas_usd AS capex
+        FROM base
+        WINDOW cst AS (PARTITION BY ind2, ctryiso, year),
+               st  AS (PARTITION BY ind2, year)
+      ),
+      lagged AS (
+        SELECT
+          *,
+          CASE WHEN lag(year) OVER w = year - 1 THEN lag(capex) OVER w END AS L_capex
+        FROM dev
+        WINDOW w AS (PARTITION BY id ORDER BY year)
+      ),
+      efd AS (
+        SELECT *, ((capex - L_capex) + depr_usd - cf_usd) / ((capex - L_capex) + depr_usd) AS efd
+        FROM lagged
+      )
+    SELECT
+      *,
+      stddev_samp(dev_ln_tfpr_fin) OVER cst AS sd_ln_tfpr_fin,
+      stddev_samp(dev_ln_tfpr1)    OVER cst AS sd_ln_tfpr1_real,
+      stddev_samp(dev_ln_tfpr2)    OVER cst AS sd_ln_tfpr2_real,
+      CAST(year >= 2020 AS INTEGER) AS covid,
+      CAST(year >= 2020 AS INTEGER) AS post2020,
+      {high_efd} AS high_efd
+    FROM efd {m3_join}{efd_join}
+    WINDOW cst AS (PARTITION BY ind2, country2, year)
+    """).df()
+
+
+def cohort_frame(src):
+    '''Model 4: full sample (2009 kept for the lags), TFPQ deviations, size, age.'''
+    return con.execute(f"""
+    WITH
+      base AS (
+        SELECT
+          *,
+          dense_rank() OVER (ORDER BY ctryiso) AS country2,
+          CAST(year >= 2020 AS INTEGER) AS post2020,
+          safe_ln(tfpq1    / avg(tfpq1)    OVER st) AS ln_tfpq1_dev,
+          safe_ln(tfpq2    / avg(tfpq2)    OVER st) AS ln_tfpq2_dev,
+          safe_ln(tfpr_fin / avg(tfpr_fin) OVER st) AS ln_tfpr_fin_dev,
+          safe_ln(toas) AS ln_assets,
+          year - TRY_CAST(dateinc_year AS DOUBLE) AS age
+        FROM {src}
+        WINDOW st AS (PARTITION BY ind2, year)
+      )
+    SELECT
+      *,
+      CASE WHEN lag(year) OVER w = year - 1 THEN lag(ln_assets)    OVER w END AS L_ln_assets,
+      CASE WHEN lag(year) OVER w = year - 1 THEN lag(ln_tfpq1_dev) OVER w END AS L_ln_tfpq1_dev,
+      CASE WHEN lag(year) OVER w = year - 1 THEN lag(ln_tfpq2_dev) OVER w END AS L_ln_tfpq2_dev
+    FROM base
+    WINDOW w AS (PARTITION BY id ORDER BY year)
+    """).df()
+
+
+# ── Specifications ─────────────────────────────────────────────────────────────
+# Absorb sets a-d of 09_regression.do
+FE_SETS = {
+    'a': ('country2', 'ind2'),
+    'b': ('country2', 'year'),
+    'c': ('ind2', 'year'),
+    'd': ('country2', 'ind2', 'year'),
+}
+
+
+def sweep(prefix, y, terms, letters='abcd'):
+    '''The xtreg ..., fe and reghdfe versions of one model over the absorb sets.'''
+    fe, rg = [], []
+    for l, new in zip('abcd', letters):
+        fe.append(Spec(f"fe_{prefix}{new}", y, terms, FE_SETS[l], family='xtreg'))
+        rg.append(Spec(f"reghdfe_{prefix}{new}", y, terms, FE_SETS[l]))
+    return fe, rg
+
+
+def model_specs(with_m3):
+    specs, tables = [], []
+
+    # Model 1
+    m1 = ['i.covid##c.ln_Z_dev']
+    fe1 = Spec("fe_model1", 'ln_tfpr_dev', m1, FE_SETS['a'], family='xtreg')
+    rg1 = Spec("reghdfe_model1", 'ln_tfpr_dev', m1, FE_SETS['a'])
+    specs += [fe1, rg1]
+    tables.append(("model1.tex", "Productivity-dependence of financial misallocation",
+                   [fe1.name, rg1.name]))
+
+    # Model 2
+    for stage, y, x, letters, title in [
+            ('stg1', 'sd_ln_tfpr1_real', 'c.sd_ln_tfpr_fin##i.high_efd##i.covid', 'abcd',
+             "Stage 1: Real-Misallocation"),
+            ('stg2', 'TFPgain', 'c.sd_ln_tfpr1_real##i.high_efd##i.covid', 'efgh',
+             "Stage 2: TFP-gain")]:
+        fe, rg = sweep('model2', y, [x], letters)
+        specs += fe + rg
+        tables += [(f"model2_{stage}_fe.tex", f"{title} (FE)", [s.name for s in fe]),
+                   (f"model2_{stage}_reg.tex", f"{title} (Many levels FE)", [s.name for s in rg]),
+                   (f"model2_{stage}.tex", title, [fe[0].name, rg[0].name])]
+
+    # Model 3
+    if with_m3:
+        phi = ['c.sd_ln_tfpr_fin', 'c.sd_ln_tfpr_fin#i.post2020',
+               'c.sd_ln_tfpr_fin#i.post2020#c.resilience', 'c.sd_ln_tfpr_fin#i.post2020#c.severity']
+        theta = ['c.sd_ln_tfpr1_real', 'c.sd_ln_tfpr1_real#i.post2020',
+                 'c.sd_ln_tfpr1_real#c.resilience', 'c.sd_ln_tfpr1_real#i.post2020#c.resilience',
+                 'c.sd_ln_tfpr1_real#c.severity', 'c.sd_ln_tfpr1_real#i.post2020#c.severity']
+        for stage, y, x, letters, title in [
+                ('stg1', 'sd_ln_tfpr1_real', phi, 'abcd',
+                 "Stage 1: Resilience and Severity on Real-Misallocation"),
+                ('stg2', 'TFPgain', theta, 'efgh',
+                 "Stage 2: Resilience and Severity on TFP Gain")]:
+            fe, rg = sweep('model3', y, x, letters)
+            specs += fe + rg
+            tables += [(f"model3_{stage}_fe.tex", f"{title} (FE)", [s.name for s in fe]),
+                       (f"model3_{stage}_reg.tex", f"{title} (Many levels FE)", [s.name for s in rg]),
+                       (f"model3_{stage}.tex", title, [fe[0].name, rg[0].name])]
+    return specs, tables
+
+
+def cohort_specs():
+    x  = ['c.ln_assets##i.post2020', 'c.age##i.post2020', 'c.ln_tfpq1_dev##i.post2020']
+    xl = ['c.L_ln_assets##i.post2020', 'c.age##i.post2020', 'c.L_ln_tfpq1_dev##i.post2020']
+    y  = 'ln_tfpr_fin_dev'
+    fe, rg = [], []
+    # Model 4a-d: (country2 ind2), (ind2 year), (country2 year), all three; 4e: lags
+    for l, sets in zip('abcd', ['a', 'c', 'b', 'd']):
+        fe.append(Spec(f"xtreg_model4{l}", y, x, FE_SETS[sets], family='xtreg'))
+        rg.append(Spec(f"reghdfe_model4{l}", y, x, FE_SETS[sets]))
+    fe.append(Spec("xtreg_model4e", y, xl, FE_SETS['d'], family='xtreg'))
+    rg.append(Spec("reghdfe_model4e", y, xl, FE_SETS['d']))
+    tables = [("model4_reg_fe.tex", "Firm-cohort analysis (FE)", [s.name for s in fe]),
+              ("model4_reg.tex", "Firm-cohort analysis (Many levels FE)", [s.name for s in rg]),
+              ("model4.tex", "Firm-cohort analysis", [fe[0].name, rg[0].name])]
+    return fe + rg, tables
+
+
+if __name__ == '__main__':
+    src = source()
+    with_m3 = (optional_dta(ZSCORE, 'zscore_df', ['resilience'])
+               and optional_dta(STRINGENCY, 'stringency_df', ['severity']))
+
+    results = {}
+    for frame, (specs, tables) in [(lambda: main_frame(src, with_m3), model_specs(with_m3)),
+                                   (lambda: cohort_frame(src), cohort_specs())]:
+        df = frame()
+        print(f"{len(df):,} rows, {len(specs)} specifications")
+        for r in run_specs(specs, df, boot_terms='all' if BOOTSTRAP else None, boot_y=BOOT_Y):
+            results[r.spec.name] = r
+            print(f"  {r.spec.name:<22} N={r.N:>10,}  G={r.G}")
+        for fname, title, names in tables:
+            esttab([results[n] for n in names], os.path.join(OUT_DIR, fname), title)
+        del df
+
+    tidy(results.values()).to_parquet(os.path.join(OUT_DIR, "regression_results.parquet"), index=False)
+
+    if BOOTSTRAP:
+        boot = [r for r in results.values() if r.spec.y in BOOT_Y]
+        print(f"Wild cluster bootstrap: {len(boot)} specs x {BOOT_REPS} reps "
+              f"on {BOOT_WORKERS} workers ({BOOT_WEIGHTS} weights)")
+        draws, summary = wild_bootstrap(boot, BOOT_REPS, BOOT_BATCH, BOOT_WORKERS,
+                                        BOOT_SEED, BOOT_WEIGHTS)
+        draws.to_parquet(os.path.join(OUT_DIR, "bootstrap_draws.parquet"), index=False)
+        summary.to_parquet(os.path.join(OUT_DIR, "bootstrap_ci.parquet"), index=False)
+    print(f"Tables written to {OUT_DIR}")
+    print("All done!")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 8
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_regression
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting regressions at $(date)" > 10_regression.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 10_regression.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 10_regression.log
+
+# 2) Run the regression sweep
+echo "Running 10_regression.py at $(date)" &>> 10_regression.log
+if python3 10_regression.py &>> 10_regression.log; then
+  echo "10_regression.py finished successfully at $(date)" &>> 10_regression.log
+else
+  echo "ERROR: 10_regression.py failed! See above log." &>> 10_regression.log
+  exit 1
+fi
+
+echo "Finished regressions at $(date)" &>> 10_regression.log
@@ -0,0 +1,98 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Cell-level (ind2 x ctryiso x year) TFPR/TFPQ moments, sector totals and
+         Hsieh-Klenow gain terms in one streaming pass over the Parquet store
+Version: 2
+'''
+
+# Import packages
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import moments as mo
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR = "/scratch/[your_group]/wrds_batch"
+SRC_DIR  = os.path.join(DATA_DIR, "orbis_clean")      # year=YYYY/ (from 07_tfpr_real.py)
+OUT_FILE = os.path.join(DATA_DIR, "orbis_cells.parquet")
+EFD_FILE = os.path.join(DATA_DIR, "efd_nace.parquet")   # from 14_compustat_efd.py, if run
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+SIGMA       = 1.9                                   # as in 07_tfpr_finance.do
+LOG_VARS    = ['tfpr1', 'tfpr2', 'tfpr_fin', 'tfpq1', 'tfpq2']
+SUM_VARS    = ['F_si', 'D_si', 'E_si', 'PF_si', 'va_usd', 'turn_usd']
+POWERS      = {'pow_F_si': ('F_si', (SIGMA - 1) / SIGMA),  # 06_sigma.do A = sum F^((s-1)/s)
+               'pow_Z_si': ('Z_si', SIGMA - 1)}            # 07_tfpr_finance.do Z weights
+PERCENTILES = [10, 50, 90]
+HK          = dict(tfpq='tfpq2', tfpr='tfpr2', revenue='turn_usd',
+                   capital='tfas', labour='empl', alpha='alpha')
+WORKERS     = int(os.environ.get("NSLOTS", 4))
+
+
+def plan(present):
+    '''Keep only the configured variables the store actually has.'''
+    logs   = [v for v in LOG_VARS if v in present]
+    sums   = [v for v in SUM_VARS if v in present]
+    powers = {k: (v, p) for k, (v, p) in POWERS.items() if v in present}
+    hk     = all(v in present for v in HK.values())
+    cols   = set(mo.CELL[:2]) | set(logs) | set(sums) | {v for v, _ in powers.values()}
+    if hk:
+        cols |= set(HK.values())
+    return logs, sums, powers, hk, sorted(cols)
+
+
+def one_year(args):
+    '''Stream one year=YYYY partition into its finished cell rows.'''
+    year, path, logs, sums, powers, hk, cols = args
+    ln = [f"ln_{v}" for v in logs]
+    hk_sums = ['hk_A', 'hk_AR', 'hk_PY', 'hk_K', 'hk_L', 'hk_alpha', 'hk_n'] if hk else []
+    acc = mo.CellAccumulator(mo.CELL, moments=logs + ln, sums=sums + hk_sums,
+                             powers=powers, quantiles=ln)
+    rows = 0
+    for df in mo.scan(path, cols):
+        df['year'] = year
+        df = mo.log_columns(df, logs)
+        if hk:
+            df = mo.hk_inputs(df, SIGMA, **HK)
+        acc.update(df)
+        rows += len(df)
+    return year, rows, acc.finalize(PERCENTILES)
+
+
+if __name__ == '__main__':
+    parts = mo.year_partitions(SRC_DIR)
+    logs, sums, powers, hk, cols = plan(mo.present_columns(SRC_DIR))
+    print(f"{len(parts)} year partitions in {SRC_DIR}")
+    print(f"  logs: {logs}\n  sums: {sums}\n  powers: {list(powers)}\n  HK terms: {hk}")
+
+    frames = []
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        tasks = [(y, p, logs, sums, powers, hk, cols) for y, p in parts]
+        for year, rows, cells in pool.map(one_year, tasks):
+            print(f"  year {year}: {rows:,} firm-years → {len(cells):,} cells")
+            frames.append(cells)
+    cells = pd.concat(frames, ignore_index=True).sort_values(mo.CELL).reset_index(drop=True)
+
+    if hk:
+        cells = mo.hk_gain(cells, SIGMA)
+
+    # 09_regression.do names: SD of ln(x / cell mean) equals the SD of ln(x)
+    for v, name in (('tfpr1', 'sd_ln_tfpr1_real'), ('tfpr2', 'sd_ln_tfpr2_real'),
+                    ('tfpr_fin', 'sd_ln_tfpr_fin')):
+        if f"sd_ln_{v}" in cells:
+            cells[name] = cells[f"sd_ln_{v}"]
+
+    # Compustat external finance dependence of the cell's NACE ind2
+    if os.path.exists(EFD_FILE):
+        efd = pd.read_parquet(EFD_FILE, columns=['ind2', 'efd', 'high_efd'])
+        cells = cells.merge(efd.rename(columns={'efd': 'comp_efd'}), on='ind2', how='left')
+        print(f"  Compustat EFD for {int(cells['comp_efd'].notna().sum()):,} cells")
+
+    cells.to_parquet(OUT_FILE, index=False)
+    print(f"{len(cells):,} cells x {cells.shape[1]} columns → {OUT_FILE}")
+    print("All done!")
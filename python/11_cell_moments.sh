@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 4
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_cell_moments
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting cell moments at $(date)" > 11_cell_moments.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 11_cell_moments.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 11_cell_moments.log
+
+# 2) Build the cell panel
+echo "Running 11_cell_moments.py at $(date)" &>> 11_cell_moments.log
+if python3 11_cell_moments.py &>> 11_cell_moments.log; then
+  echo "11_cell_moments.py finished successfully at $(date)" &>> 11_cell_moments.log
+else
+  echo "ERROR: 11_cell_moments.py failed! See above log." &>> 11_cell_moments.log
+  exit 1
+fi
+
+echo "Finished cell moments at $(date)" &>> 11_cell_moments.log
@@ -0,0 +1,131 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Sector capital shares (alpha) from the country IO tables in one pass over
+         alpha.xlsx, as one keyed Parquet lookup (port of stata/03_io.do)
+Version: 1
+'''
+
+# Import packages
+import os
+
+import numpy as np
+import pandas as pd
+
+import catalog as cat
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+ALPHA_DIR = os.path.join(DATA_DIR, "alpha")
+IO_FILE   = os.path.join(ALPHA_DIR, "alpha.xlsx")        # one sheet per country (World MRIO)
+OUT_FILE  = os.path.join(ALPHA_DIR, "alpha_io.parquet")  # (ctryiso, level, code) -> alpha
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+SHEETS    = cat.ISO_CODES     # sheets to read, as the `iso` local of 03_io.do
+MIN_ALPHA = 0.01              # below this the broad-sector share is used
+WRITE_DTA = False             # also write alpha_manuf/_others/_broad.dta for the Stata route
+
+VA_VARS = ['va_total', 'va_wages', 'va_taxes', 'va_subs', 'va_nos', 'va_nmi', 'va_dep']
+KEEP    = ['nace2_main_section', 'major_sector', 'industry_io', 'ctryiso'] + VA_VARS
+
+# Lookup levels, most specific first (07_tfpr_real.py falls back in this order)
+LEVELS = ['major_sector', 'nace2_main_section', 'broad_sector']
+
+
+# ── Read ───────────────────────────────────────────────────────────────────────
+def read_workbook(path, sheets=SHEETS):
+    '''All country sheets in one read, stacked, with the sheet name kept.
+
+    Strings are '' when empty (Stata's missing string) and the VA columns are
+    destring'ed: anything non-numeric is missing.
+    '''
+    book = pd.read_excel(path, sheet_name=list(sheets), dtype=object)
+    df = pd.concat([b[KEEP].assign(sheet=s) for s, b in book.items()], ignore_index=True)
+    for v in VA_VARS:
+        df[v] = pd.to_numeric(df[v], errors='coerce')
+    for v in ['nace2_main_section', 'major_sector', 'industry_io', 'ctryiso']:
+        df[v] = df[v].fillna('').astype(str).str.strip()
+    return df
+
+
+# ── Labor shares ───────────────────────────────────────────────────────────────
+def broad_sector(nace2_main_section):
+    '''1 = A, 2 = B, 3 = C, 4 = everything else (including empty).'''
+    first = nace2_main_section.str[:1]
+    return np.select([first == 'A', first == 'B', first == 'C'], [1, 2, 3], 4)
+
+
+def labor_shares(df):
+    '''alpha_nace2 / alpha_ms / alpha_bs and the chosen alpha for every IO row.
+
+    One grouped sum per level over all countries at once (the sheet is part of
+    the key), instead of 03_io.do's per-sheet `bysort ...: egen total()`.
+    total() ignores missings and x/0 is missing, as in Stata; a missing alpha
+    is never replaced by alpha_bs because Stata's missing is not < 0.01.
+    '''
+    df = df.copy()
+    df['broad_sector'] = broad_sector(df['nace2_main_section'])
+    for name, by in (('alpha_nace2', 'nace2_main_section'), ('alpha_ms', 'major_sector'),
+                     ('alpha_bs', 'broad_sector')):
+        g = df.groupby(['sheet', by], sort=False, dropna=False)
+        num = g['va_wages'].transform('sum')
+        den = g['va_total'].transform('sum')
+        df[name] = 1 - num / den.where(den != 0)
+    df['alpha'] = np.where(df['major_sector'] != '', df['alpha_ms'], df['alpha_nace2'])
+    df['alpha'] = df['alpha'].where(~(df['alpha'] < MIN_ALPHA), df['alpha_bs'])
+    return df[df['ctryiso'] != '']
+
+
+def lookup(shares):
+    '''Long (ctryiso, level, code) -> alpha table, one row per key.
+
+    major_sector rows give the manufacturing lookup, rows without a
+    major_sector the NACE-section one, and every row its broad sector (as
+    alpha_manuf / alpha_others / alpha_broad.dta). The first row wins where a
+    key has several alphas, as 07's any_value() did with the .dta files.
+    '''
+    ms = shares[shares['major_sector'] != '']
+    ot = shares[shares['major_sector'] == '']
+    parts = [
+        ms[['ctryiso', 'major_sector', 'alpha']].rename(columns={'major_sector': 'code'})
+          .assign(level='major_sector'),
+        ot[['ctryiso', 'nace2_main_section', 'alpha']].rename(columns={'nace2_main_section': 'code'})
+          .assign(level='nace2_main_section'),
+        shares[['ctryiso', 'broad_sector', 'alpha_bs']]
+          .rename(columns={'broad_sector': 'code', 'alpha_bs': 'alpha'})
+          .assign(level='broad_sector', code=lambda d: d['code'].astype(str)),
+    ]
+    out = pd.concat(parts, ignore_index=True)
+    out = out.groupby(['ctryiso', 'level', 'code'], sort=False, as_index=False)['alpha'].first()
+    out['level'] = pd.Categorical(out['level'], categories=LEVELS)
+    return out.sort_values(['ctryiso', 'level', 'code']).reset_index(drop=True)
+
+
+def to_dta(table, out_dir):
+    '''The three lookups 03_io.do saves, for stata/04_tfpr_real.do.'''
+    sel = lambda lvl: table[table['level'] == lvl].drop(columns='level')
+    sel('major_sector').rename(columns={'code': 'major_sector'}) \
+        .to_stata(os.path.join(out_dir, "alpha_manuf.dta"), write_index=False)
+    sel('nace2_main_section').rename(columns={'code': 'nace2_main_section'}) \
+        .to_stata(os.path.join(out_dir, "alpha_others.dta"), write_index=False)
+    sel('broad_sector').rename(columns={'code': 'broad_sector', 'alpha': 'alpha_bs'}) \
+        .astype({'broad_sector': int}) \
+        .to_stata(os.path.join(out_dir, "alpha_broad.dta"), write_index=False)
+
+
+if __name__ == '__main__':
+    print(f"Reading {len(SHEETS)} sheets of {IO_FILE}")
+    rows = read_workbook(IO_FILE)
+    shares = labor_shares(rows)
+    table = lookup(shares)
+    print(f"  {len(rows):,} IO rows → {len(table):,} lookup keys "
+          + ", ".join(f"{lvl}: {n}" for lvl, n in table['level'].value_counts(sort=False).items()))
+    table.to_parquet(OUT_FILE, index=False)
+    print(f"Wrote {OUT_FILE}")
+    if WRITE_DTA:
+        to_dta(table, ALPHA_DIR)
+        print(f"Wrote alpha_manuf / alpha_others / alpha_broad.dta in {ALPHA_DIR}")
+    print("All done!")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 1
+#$ -l m_mem_free=8G
+#$ -l h_vmem=8G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_io_alpha
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting IO alpha at $(date)" > 12_io_alpha.log
+
+# 1) Check openpyxl (pandas needs it to read alpha.xlsx)
+xlv=$(python3 - <<'PYCODE'
+import openpyxl
+print(openpyxl.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import openpyxl!" &>> 12_io_alpha.log
+  exit 1
+fi
+echo "openpyxl version: $xlv" &>> 12_io_alpha.log
+
+# 2) Build the alpha lookup
+echo "Running 12_io_alpha.py at $(date)" &>> 12_io_alpha.log
+if python3 12_io_alpha.py &>> 12_io_alpha.log; then
+  echo "12_io_alpha.py finished successfully at $(date)" &>> 12_io_alpha.log
+else
+  echo "ERROR: 12_io_alpha.py failed! See above log." &>> 12_io_alpha.log
+  exit 1
+fi
+
+echo "Finished IO alpha at $(date)" &>> 12_io_alpha.log
@@ -0,0 +1,244 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Counterfactual finance-wedge TFP gains for a whole grid of (sigma, gamma
+         scaling, alpha source) scenarios in two vectorised passes over the
+         Parquet store (stata/07_tfpr_finance.do for many scenarios at once)
+Version: 2
+'''
+
+# Import packages
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import catalog as cat
+import moments as mo
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR   = "/scratch/[your_group]/wrds_batch"
+SRC_DIR    = os.path.join(DATA_DIR, "orbis_clean")                  # year=YYYY/ (from 07_tfpr_real.py)
+PARAM_FILE = os.path.join(DATA_DIR, "fin_param_resolved.parquet")   # from 08_finance_params.py
+OUT_FILE   = os.path.join(DATA_DIR, "scenario_gains.parquet")
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+SIGMAS        = [1.5, 1.77, 1.9, 2.5, 3.0, 4.0]   # 07_tfpr_finance.do uses 1.9
+GAMMA_SCALES  = [0.75, 1.0, 1.25, 1.5]            # multiplies the resolved gamma_s
+# "ctry"   : country x industry estimates with 07_tfpr_finance.do's fallbacks
+# "pooled" : industry estimates pooled across countries (fin_param / fin_param_1)
+ALPHA_SOURCES = ['ctry', 'pooled']
+BATCH_ROWS    = 200_000         # rows per batch; arrays are rows x scenarios doubles
+WORKERS       = int(os.environ.get("NSLOTS", 4))
+
+COUNTRIES = cat.ISO_CODES       # ctryiso codebook; anything else counts as missing
+N_IND2    = 100                 # ind2 is a 2-digit code
+COLUMNS   = ['ctryiso', 'ind2', 'D_si', 'E_si', 'PF_si', 'F_si']
+WEDGES    = ['tauD', 'tauE', 'tfpr_fin', 'ln_tfpr_fin']
+
+
+# ── Scenarios and parameters ───────────────────────────────────────────────────
+def scenario_grid():
+    '''One row per scenario: every sigma x gamma scale x alpha source.'''
+    grid = pd.MultiIndex.from_product([SIGMAS, GAMMA_SCALES, ALPHA_SOURCES],
+                                      names=['sigma', 'gamma_scale', 'alpha_source']).to_frame(index=False)
+    grid.insert(0, 'scenario', np.arange(len(grid), dtype=np.int32))
+    return grid
+
+
+def load_params():
+    '''(keys x sources) alpha_s and gamma_s, key = country code * N_IND2 + ind2,
+    from 08_finance_params.py's resolved lookup (07_tfpr_finance.do's merges
+    and gamma_s fallbacks already applied).'''
+    res = pd.read_parquet(PARAM_FILE, columns=['source', 'ctryiso', 'ind2', 'alpha_s', 'gamma_s'])
+    c = pd.Categorical(res['ctryiso'], categories=COUNTRIES).codes.astype(np.int64)
+    known = (c >= 0) | res['ctryiso'].isna().to_numpy()     # other countries have no slot
+    key = (np.where(c < 0, len(COUNTRIES), c) * N_IND2 + res['ind2'].to_numpy(dtype=np.int64))[known]
+    res = res[known]
+    alpha = np.full(((len(COUNTRIES) + 1) * N_IND2, len(ALPHA_SOURCES)), np.nan)
+    gamma = alpha.copy()
+    for i, source in enumerate(ALPHA_SOURCES):
+        m = (res['source'] == source).to_numpy()
+        alpha[key[m], i] = res['alpha_s'].to_numpy()[m]
+        gamma[key[m], i] = res['gamma_s'].to_numpy()[m]
+    return alpha, gamma
+
+
+# ── Firm-level terms, rows x scenarios ─────────────────────────────────────────
+def _fin(x):
+    '''Stata's missing for anything that is not a finite number (x/0, overflow).'''
+    return np.where(np.isfinite(x), x, np.nan)
+
+
+def spow(x, p):
+    '''x^p as Stata: missing for a negative base with a fractional power and
+    for 0 to a negative power.'''
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        return _fin(np.power(x, p))
+
+
+def firm_batches(path, params, grid):
+    '''Per batch: row keys and the (rows x scenarios) sigma, alpha_s, gamma_s,
+    CES exponents and Z_si = PF^(s/(s-1)) / M^(g/(g-1)).'''
+    alpha, gamma = params
+    src = grid['alpha_source'].map({s: i for i, s in enumerate(ALPHA_SOURCES)}).to_numpy()
+    sigma = grid['sigma'].to_numpy()[None, :]
+    scale = grid['gamma_scale'].to_numpy()[None, :]
+    for df in mo.scan(path, COLUMNS, BATCH_ROWS):
+        df = df[df['ind2'].notna()]
+        ind2 = df['ind2'].to_numpy(dtype=np.int64)
+        c = pd.Categorical(df['ctryiso'], categories=COUNTRIES).codes.astype(np.int64)
+        key = np.where(c < 0, len(COUNTRIES), c) * N_IND2 + ind2
+        a = alpha[key][:, src]
+        g = gamma[key][:, src] * scale
+        D, E, PF, F = (df[v].to_numpy(dtype=float)[:, None] for v in ('D_si', 'E_si', 'PF_si', 'F_si'))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rho, inv = _fin((g - 1) / g), _fin(g / (g - 1))
+            M = a * spow(D, rho) + (1 - a) * spow(E, rho)
+            Z = _fin(spow(PF, sigma / (sigma - 1)) / spow(M, inv))
+        yield dict(key=key, ind2=ind2, sigma=sigma, a=a, g=g, rho=rho, inv=inv, Z=Z,
+                   D=D, E=E, PF=PF, F=F)
+
+
+def _flat(idx, S):
+    '''Flat (group x scenario) index of a (rows x scenarios) array.'''
+    return (idx[:, None] * S + np.arange(S)[None, :]).ravel()
+
+
+def _total(idx, x, size):
+    '''egen total(): sum by group, missings ignored.'''
+    x = x.ravel()
+    return np.bincount(idx, weights=np.where(np.isnan(x), 0.0, x), minlength=size)
+
+
+# ── Pass 1: sector totals by ind2 ──────────────────────────────────────────────
+def sector_totals(args):
+    '''D_s, E_s and, per scenario, Z_s = sum Z_si^(sigma-1) by ind2 for one year.'''
+    year, path, params, grid = args
+    S = len(grid)
+    D_s = np.zeros(N_IND2)
+    E_s = np.zeros(N_IND2)
+    Z_s = np.zeros(N_IND2 * S)
+    for b in firm_batches(path, params, grid):
+        D_s += _total(b['ind2'], b['D'], N_IND2)
+        E_s += _total(b['ind2'], b['E'], N_IND2)
+        Z_s += _total(_flat(b['ind2'], S), spow(b['Z'], b['sigma'] - 1), N_IND2 * S)
+    return D_s, E_s, Z_s
+
+
+# ── Pass 2: efficient allocation and cell aggregates ───────────────────────────
+def _moments(idx, x, size):
+    '''(n, mean, m2) by flat index for one batch, in moments.chan_merge form.'''
+    x = x.ravel()
+    ok = np.isfinite(x)
+    i, v = idx[ok], x[ok]
+    n = np.bincount(i, minlength=size).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, np.bincount(i, weights=v, minlength=size) / n, 0.0)
+    m2 = np.bincount(i, weights=(v - mean[i])**2, minlength=size)
+    return pd.DataFrame({'n': n, 'mean': mean, 'm2': m2})
+
+
+def one_year(args):
+    '''Cell (ind2 x ctryiso) x scenario rows of one year=YYYY partition.'''
+    year, path, params, grid, D_s, E_s, Z_s = args
+    S = len(grid)
+    K = (len(COUNTRIES) + 1) * N_IND2
+    Z_s = Z_s.reshape(N_IND2, S)
+    rows = np.zeros(K)
+    sumF, sumFhat = np.zeros(K * S), np.zeros(K * S)
+    state = {v: None for v in WEDGES}
+    for b in firm_batches(path, params, grid):
+        a, g, rho, inv, Z, D, E, PF = (b[v] for v in ('a', 'g', 'rho', 'inv', 'Z', 'D', 'E', 'PF'))
+        sigma = b['sigma']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = _fin(spow(Z, sigma - 1) / Z_s[b['ind2']])
+            D_eff = weight * D_s[b['ind2']][:, None]
+            E_eff = weight * E_s[b['ind2']][:, None]
+            Fhat = Z * spow(a * spow(D_eff, rho) + (1 - a) * spow(E_eff, rho), inv)
+            tauD = _fin(a * (sigma - 1) / sigma * PF
+                        / (a * D + (1 - a) * spow(E, rho) * spow(D, 1 / g)))
+            tauE = _fin((1 - a) * (sigma - 1) / sigma * PF
+                        / (a * spow(D, rho) * spow(E, 1 / g) + (1 - a) * E))
+            tfpr_fin = D / (D + E) * (1 + tauD) + E / (D + E) * (1 + tauE)
+        wedge = {'tauD': tauD, 'tauE': tauE, 'tfpr_fin': tfpr_fin,
+                 'ln_tfpr_fin': np.log(np.where(tfpr_fin > 0, tfpr_fin, np.nan))}
+
+        idx = _flat(b['key'], S)
+        rows += np.bincount(b['key'], minlength=K)
+        sumF += _total(idx, spow(b['F'], (sigma - 1) / sigma), K * S)
+        sumFhat += _total(idx, spow(Fhat, (sigma - 1) / sigma), K * S)
+        for v in WEDGES:
+            state[v] = mo.chan_merge(state[v], _moments(idx, wedge[v], K * S))
+
+    # Long format: one row per non-empty cell and scenario
+    cell = np.repeat(rows > 0, S)
+    keys = np.repeat(np.arange(K), S)[cell]
+    out = pd.DataFrame({
+        'scenario': np.tile(grid['scenario'].to_numpy(), K)[cell],
+        'ind2':     (keys % N_IND2).astype(float),
+        'ctryiso':  pd.Series(COUNTRIES + [None], dtype=object)[keys // N_IND2].to_numpy(),
+        'year':     year,
+        'n':        np.repeat(rows, S)[cell].astype(np.int64),
+        'sumF':     sumF[cell],
+        'sumFhat':  sumFhat[cell],
+    })
+    for v, st in state.items():
+        if st is None:
+            continue
+        st = st[cell]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[f"n_{v}"] = st['n'].to_numpy().astype(np.int64)
+            out[f"mean_{v}"] = st['mean'].where(st['n'] > 0).to_numpy()
+            out[f"sd_{v}"] = np.sqrt(st['m2'] / (st['n'] - 1)).where(st['n'] > 1).to_numpy()
+    return year, int(rows.sum()), out
+
+
+def tfp_gains(out, grid):
+    '''F_agg, Fhat_agg and TFPgain = 100 (Fhat_agg / F_agg - 1) per row.'''
+    out = out.merge(grid, on='scenario', how='left')
+    e = out['sigma'] / (out['sigma'] - 1)
+    out['F_agg'] = spow(out['sumF'].to_numpy(), e.to_numpy())
+    out['Fhat_agg'] = spow(out['sumFhat'].to_numpy(), e.to_numpy())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out['TFPgain'] = _fin(100 * (out['Fhat_agg'] / out['F_agg'] - 1))
+    front = ['scenario', 'sigma', 'gamma_scale', 'alpha_source'] + mo.CELL
+    return out[front + [c for c in out.columns if c not in front]]
+
+
+if __name__ == '__main__':
+    parts = mo.year_partitions(SRC_DIR)
+    grid = scenario_grid()
+    params = load_params()
+    print(f"{len(parts)} year partitions in {SRC_DIR}, {len(grid)} scenarios "
+          f"({len(SIGMAS)} sigma x {len(GAMMA_SCALES)} gamma scale x {len(ALPHA_SOURCES)} alpha source)")
+
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        # Pass 1: the ind2 totals the efficient allocation needs (all years)
+        D_s, E_s, Z_s = (sum(t) for t in zip(*pool.map(
+            sector_totals, [(y, p, params, grid) for y, p in parts])))
+        print(f"  sector totals: {int((D_s != 0).sum())} ind2 sectors")
+
+        # Pass 2: firm wedges and the cell sums of F and Fhat
+        frames = []
+        tasks = [(y, p, params, grid, D_s, E_s, Z_s) for y, p in parts]
+        for year, rows, cells in pool.map(one_year, tasks):
+            print(f"  year {year}: {rows:,} firm-years → {len(cells):,} cell-scenarios")
+            frames.append(cells)
+
+    out = tfp_gains(pd.concat(frames, ignore_index=True), grid)
+    out = out.sort_values(['scenario'] + mo.CELL).reset_index(drop=True)
+    out['alpha_source'] = pd.Categorical(out['alpha_source'], categories=ALPHA_SOURCES)
+    out.to_parquet(OUT_FILE, index=False)
+    print(f"{len(out):,} rows x {out.shape[1]} columns → {OUT_FILE}")
+
+    # Median cell gain per scenario
+    med = out.pivot_table(index=['alpha_source', 'gamma_scale'], columns='sigma',
+                          values='TFPgain', aggfunc='median', observed=True)
+    print("Median cell TFPgain (%):")
+    print(med.round(2).to_string())
+    print("All done!")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 4
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_scenarios
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting scenario grid at $(date)" > 13_scenarios.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 13_scenarios.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 13_scenarios.log
+
+# 2) Run the scenario grid
+echo "Running 13_scenarios.py at $(date)" &>> 13_scenarios.log
+if python3 13_scenarios.py &>> 13_scenarios.log; then
+  echo "13_scenarios.py finished successfully at $(date)" &>> 13_scenarios.log
+else
+  echo "ERROR: 13_scenarios.py failed! See above log." &>> 13_scenarios.log
+  exit 1
+fi
+
+echo "Finished scenario grid at $(date)" &>> 13_scenarios.log
@@ -0,0 +1,172 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Compustat external finance dependence (EFD) by industry from the Parquet
+         pull, with Stata-exact winsorization and a NAICS -> NACE crosswalk onto
+         the ORBIS ind2 codes (port of stata/02_compustat.do)
+Version: 1
+'''
+
+# Import packages
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+COMP_DIR  = "/scratch/[your_group]/wrds_compustat/compustat_parquet"   # from 06_compustat_batch.py
+CROSSWALK = os.path.join(DATA_DIR, "crosswalk", "naics_nace.csv")     # naics, nace[, weight]
+OUT_DIR   = DATA_DIR
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+FYEARS   = (2009, 2013)     # 02_compustat.do appends 2009-2013 (the CSVs run to 2023)
+WINSOR   = (1, 99)          # pctile bounds by (NAICS ind2, fyear); None to skip
+REQUIRED = ['naicsh', 'sich', 'ap', 'invt', 'rect', 'rectr', 'oancf', 'capx']   # dropped if missing
+HIGH_EFD_CUTOFF = None      # None: median of the NACE ind2 EFDs; or a number
+WRITE_DTA = False           # also comp_clean.dta, as 02_compustat.do saves
+
+LAGGED = ['ap', 'invt', 'rect']
+
+
+# ── Read ───────────────────────────────────────────────────────────────────────
+def load(path=COMP_DIR, fyears=FYEARS):
+    '''The fiscal years in the window, rows missing a REQUIRED variable dropped
+    (the import step of 02_compustat.do).'''
+    dset = ds.dataset(path, format='parquet')
+    lo, hi = fyears
+    df = dset.to_table(filter=(ds.field('fyear') >= lo) & (ds.field('fyear') <= hi)).to_pandas()
+    return df.dropna(subset=REQUIRED).reset_index(drop=True)
+
+
+# ── Clean ──────────────────────────────────────────────────────────────────────
+def dedup(df):
+    '''sort conm fyear / by conm fyear: keep if _n==_N, then isid gvkey fyear.
+
+    Stata's sort leaves ties in no particular order; a stable sort keeps the
+    last row in file order, which is one of the orders Stata could produce.
+    '''
+    df = df.sort_values(['conm', 'fyear'], kind='stable')
+    df = df.drop_duplicates(['conm', 'fyear'], keep='last')
+    if df.duplicated(['gvkey', 'fyear']).any():
+        raise ValueError("gvkey fyear do not uniquely identify the observations")
+    return df
+
+
+def panel_lags(df):
+    '''D.ap / D.invt / D.rect under xtset gvkey fyear, from one sort.
+
+    L.x is the value at fyear - 1 of the same gvkey, so a gap in the years
+    gives a missing lag, as with Stata's time-series operators.
+    '''
+    df = df.sort_values(['gvkey', 'fyear'], kind='stable').reset_index(drop=True)
+    prev = (df['gvkey'].eq(df['gvkey'].shift()) & df['fyear'].eq(df['fyear'].shift() + 1)).to_numpy()
+    L_ap = df['ap'].shift().where(prev)
+    for v in LAGGED:
+        df[f"d_{v}"] = (df[v] - df[v].shift().where(prev)).where(L_ap.notna())
+    return df
+
+
+def pctile(df, by, v, p):
+    '''egen pctile(v), p(p) by `by`, broadcast to every row.
+
+    Stata's default definition: with P = n p / 100, the (floor(P) + 1)-th
+    order statistic if P is not an integer, else the mean of the P-th and
+    (P + 1)-th. One sort of (by, v) serves every group. egen stores a float.
+    '''
+    x = df[by + [v]].dropna(subset=[v]).sort_values(by + [v], kind='stable')
+    g = x.groupby(by, sort=False, dropna=False)
+    n = g[v].transform('size').to_numpy()
+    rank = g.cumcount().to_numpy() + 1
+    P = n * p / 100
+    i = np.floor(P).astype(np.int64)
+    lo = np.where(P > i, i + 1, np.maximum(i, 1))
+    hi = np.minimum(i + 1, n)
+    vals = x[v].to_numpy()
+    x = x.assign(_lo=np.where(rank == lo, vals, np.nan), _hi=np.where(rank == hi, vals, np.nan))
+    q = x.groupby(by, sort=False, dropna=False)[['_lo', '_hi']].transform('max').mean(axis=1)
+    return q.astype(np.float32).astype(float).reindex(df.index)
+
+
+def efd(df, winsor=WINSOR):
+    '''Steps 1-5 of 02_compustat.do on the deduplicated panel.'''
+    naics = df['naicsh'].round().astype('Int64').astype(str)
+    df = df[~naics.str.startswith('9')].copy()
+    df['naicsh_str'] = naics[df.index]
+    df = panel_lags(df)
+
+    df['efd'] = ((df['capx'] - df['oancf']) / df['capx']).where(df['capx'] > 0)
+    df['ind2'] = df['naicsh_str'].str[:2]
+    if winsor:
+        p1, p99 = (pctile(df, ['ind2', 'fyear'], 'efd', p) for p in winsor)
+        df['efd'] = df['efd'].mask(df['efd'] < p1, p1).mask(df['efd'] > p99, p99)
+    df['efd_ind2'] = (df.groupby(['ind2', 'fyear'])['efd'].transform('mean')
+                        .astype(np.float32).astype(float))
+    return df
+
+
+# ── NAICS -> NACE ──────────────────────────────────────────────────────────────
+def crosswalk(path=CROSSWALK):
+    '''naics (any number of digits) -> NACE ind2 with weights summing to one
+    per NAICS code (equal shares when the file has no weight column).'''
+    cw = pd.read_csv(path, dtype=str)
+    cw['naics'] = cw['naics'].str.replace(r"\D", "", regex=True)
+    cw['ind2'] = cw['nace'].str.replace(r"\D", "", regex=True).str[:2].astype(float)
+    cw['weight'] = pd.to_numeric(cw['weight']) if 'weight' in cw else 1.0
+    cw = cw.groupby(['naics', 'ind2'], as_index=False)['weight'].sum()
+    cw['weight'] /= cw.groupby('naics')['weight'].transform('sum')
+    return cw
+
+
+def to_nace(df, cw):
+    '''Firm-years matched on the longest NAICS prefix in the crosswalk, then
+    the weighted mean EFD by (NACE ind2, fyear) and over the window.'''
+    firms = df.loc[df['efd'].notna(), ['gvkey', 'fyear', 'naicsh_str', 'efd']]
+    parts, left = [], firms
+    for n in sorted(cw['naics'].str.len().unique(), reverse=True):
+        key = left['naicsh_str'].str[:n]
+        hit = key.isin(cw.loc[cw['naics'].str.len() == n, 'naics']).to_numpy()
+        parts.append(left[hit].assign(naics=key[hit]).merge(cw, on='naics'))
+        left = left[~hit]
+    m = pd.concat(parts, ignore_index=True)
+    m['w_efd'] = m['weight'] * m['efd']
+
+    yearly = m.groupby(['ind2', 'fyear'], as_index=False).agg(
+        w=('weight', 'sum'), w_efd=('w_efd', 'sum'), n_obs=('gvkey', 'size'))
+    yearly['efd'] = yearly['w_efd'] / yearly['w']
+    out = yearly.groupby('ind2', as_index=False).agg(
+        efd=('efd', 'mean'), n_obs=('n_obs', 'sum'), n_years=('fyear', 'size'))
+    cutoff = out['efd'].median() if HIGH_EFD_CUTOFF is None else HIGH_EFD_CUTOFF
+    out['high_efd'] = (out['efd'] > cutoff).astype(np.int8)
+    return out, yearly.drop(columns=['w', 'w_efd']), len(left), cutoff
+
+
+if __name__ == '__main__':
+    raw = load()
+    print(f"{len(raw):,} Compustat firm-years {FYEARS[0]}-{FYEARS[1]} with all of {REQUIRED}")
+    comp = efd(dedup(raw))
+    print(f"  {len(comp):,} after dedup and the NAICS 9x filter, "
+          f"{int(comp['efd'].notna().sum()):,} with capx > 0")
+
+    comp.to_parquet(os.path.join(OUT_DIR, "comp_clean.parquet"), index=False)
+    if WRITE_DTA:
+        comp.to_stata(os.path.join(OUT_DIR, "comp_clean.dta"), write_index=False)
+    naics = comp.groupby(['ind2', 'fyear'], as_index=False).agg(
+        efd_ind2=('efd_ind2', 'first'), n_obs=('efd', 'count'))
+    naics.to_parquet(os.path.join(OUT_DIR, "efd_naics.parquet"), index=False)
+    print(f"  efd_ind2: {len(naics):,} NAICS ind2 x fyear, "
+          f"median {naics['efd_ind2'].median():.4f}")
+
+    if not os.path.exists(CROSSWALK):
+        print(f"WARNING: {CROSSWALK} not found; no NACE table written")
+    else:
+        nace, yearly, unmatched, cutoff = to_nace(comp, crosswalk())
+        nace.to_parquet(os.path.join(OUT_DIR, "efd_nace.parquet"), index=False)
+        yearly.to_parquet(os.path.join(OUT_DIR, "efd_nace_year.parquet"), index=False)
+        print(f"  efd_nace: {len(nace):,} NACE ind2, {int(nace['high_efd'].sum())} above "
+              f"{cutoff:.4f}; {unmatched:,} firm-years without a crosswalk match")
+    print("All done!")
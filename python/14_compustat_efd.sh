@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 1
+#$ -l m_mem_free=16G
+#$ -l h_vmem=16G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N compustat_efd
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting Compustat EFD at $(date)" > 14_compustat_efd.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 14_compustat_efd.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 14_compustat_efd.log
+
+# 2) Build the industry EFD
+echo "Running 14_compustat_efd.py at $(date)" &>> 14_compustat_efd.log
+if python3 14_compustat_efd.py &>> 14_compustat_efd.log; then
+  echo "14_compustat_efd.py finished successfully at $(date)" &>> 14_compustat_efd.log
+else
+  echo "ERROR: 14_compustat_efd.py failed! See above log." &>> 14_compustat_efd.log
+  exit 1
+fi
+
+echo "Finished Compustat EFD at $(date)" &>> 14_compustat_efd.log
@@ -0,0 +1,234 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Descriptive-statistics tables (counts, means, SDs, sums, percentiles by
+         any grouping) from one streaming pass over the Parquet panel, written as
+         LaTeX and CSV (generalises stata/08_desc_stat.do)
+Version: 1
+'''
+
+# Import packages
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import moments as mo
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR = "/scratch/[your_group]/wrds_batch"
+SRC_DIR  = os.path.join(DATA_DIR, "orbis_clean")      # year=YYYY/ (from 07_tfpr_real.py)
+OUT_DIR  = os.path.join(DATA_DIR, "desc_stats")       # <table>.tex and <table>.csv
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+DROP_YEARS = [2009]                                   # as 08_desc_stat.do
+RATIOS     = {'va_to_toas':   ('va_usd', 'toas_usd'), # x / 0 is missing, as in Stata
+              'liab_to_toas': ('D_si', 'toas_usd')}
+# size_class: ORBIS employee thresholds on SIZE_VAR (0 = missing)
+SIZE_VAR     = 'empl'
+SIZE_CLASSES = [(0, 'Small'), (15, 'Medium'), (150, 'Large'), (1000, 'Very large')]
+# period: fiscal-year windows (0 = none of them)
+PERIODS    = [(2004, 2008, '2004-08'), (2010, 2014, '2010-14'),
+              (2015, 2019, '2015-19'), (2020, 2024, '2020-24')]
+DELTA      = 200            # t-digest compression: at most DELTA + 1 centroids per cell
+BATCH_ROWS = 1_000_000
+WORKERS    = int(os.environ.get("NSLOTS", 4))
+
+# One entry per table: the grouping (`by`), the columns as (variable, statistic),
+# optional header labels and a Total row. Statistics: count (rows), n
+# (non-missing), mean, sd, sum, min, max and pNN (from the sketches, so
+# approximate for large cells). All tables come from the same scan.
+TABLES = {
+    # 08_desc_stat.do: collapse (mean) va_to_toas liab_to_toas (sum) observation, by(ctryiso)
+    'summary_table': dict(by=['ctryiso'],
+                          cols=[('obs', 'count'), ('va_to_toas', 'mean'), ('liab_to_toas', 'mean')],
+                          head=['Country', 'Observations', 'VA/Assets', 'Liabilities/Assets']),
+    'country_size_period': dict(by=['ctryiso', 'size_class', 'period'],
+                                cols=[('obs', 'count'), ('va_to_toas', 'mean'), ('va_to_toas', 'p50'),
+                                      ('liab_to_toas', 'mean'), ('liab_to_toas', 'p50')],
+                                head=['Country', 'Size', 'Period', 'Observations', 'VA/Assets',
+                                      'Median', 'Liabilities/Assets', 'Median']),
+    'size_period': dict(by=['size_class', 'period'],
+                        cols=[('obs', 'count'), ('empl', 'mean'), ('empl', 'p50'),
+                              ('va_to_toas', 'mean'), ('va_to_toas', 'sd'),
+                              ('liab_to_toas', 'mean'), ('liab_to_toas', 'sd')],
+                        total=True),
+    'tfpr_dispersion': dict(by=['ctryiso'],
+                            cols=[('ln_tfpr2', 'n'), ('ln_tfpr2', 'sd'), ('ln_tfpr2', 'p10'),
+                                  ('ln_tfpr2', 'p50'), ('ln_tfpr2', 'p90')],
+                            head=['Country', 'N', 'SD ln TFPR', 'p10', 'p50', 'p90'], total=True),
+}
+FORMATS = {'count': '{:,.0f}', 'n': '{:,.0f}', 'sum': '{:,.0f}'}   # others '{:.2f}'
+
+
+# ── Plan ───────────────────────────────────────────────────────────────────────
+def plan(present):
+    '''The tables the store can serve, the cell keys (every `by` column) and
+    the variables behind each kind of statistic.'''
+    have = set(present) | {r for r, (a, b) in RATIOS.items() if a in present and b in present}
+    have |= {'obs', 'year'} | ({'size_class'} if SIZE_VAR in present else set()) | {'period'}
+    tables = {}
+    for name, t in TABLES.items():
+        need = set(t['by']) | {v for v, _ in t['cols']}
+        if need <= have:
+            tables[name] = t
+        else:
+            print(f"WARNING: {name} skipped, the store has no {sorted(need - have)}")
+    keys = list(dict.fromkeys(k for t in tables.values() for k in t['by']))
+    stats = {(v, s) for t in tables.values() for v, s in t['cols'] if s != 'count'}
+    moments = sorted({v for v, s in stats if s in ('n', 'mean', 'sd')})
+    totals = sorted({v for v, s in stats if s in ('sum', 'min', 'max')})
+    sketches = sorted({v for v, s in stats if re.fullmatch(r"p\d+", s)})
+    vars_ = set(moments) | set(totals) | set(sketches) | set(keys)
+    cols = {c for v in vars_ for c in RATIOS.get(v, (v,))
+            if c in present}
+    if 'size_class' in keys:
+        cols.add(SIZE_VAR)
+    return tables, keys, moments, totals, sketches, sorted(cols)
+
+
+def classify(df, year):
+    '''year, size_class, period and the RATIOS on one batch.'''
+    df['year'] = year
+    for name, (num, den) in RATIOS.items():
+        if num in df and den in df:
+            df[name] = df[num] / df[den].where(df[den] != 0)
+    if SIZE_VAR in df:
+        x = df[SIZE_VAR].to_numpy(dtype=float)
+        df['size_class'] = np.where(np.isnan(x), 0, np.searchsorted(
+            [lo for lo, _ in SIZE_CLASSES], x, side='right')).astype(np.int8)
+    df['period'] = np.int8(0)
+    for i, (lo, hi, _) in enumerate(PERIODS, 1):
+        if lo <= year <= hi:
+            df['period'] = np.int8(i)
+    return df
+
+
+# ── One pass ───────────────────────────────────────────────────────────────────
+def merge(a, b):
+    '''Combine two partition states (moments, totals, sketches).'''
+    if a is None or b is None:
+        return b if a is None else a
+    out = {'mom': {v: mo.chan_merge(a['mom'][v], b['mom'][v]) for v in a['mom']},
+           'dig': {v: mo.digest_merge(a['dig'][v], b['dig'][v], DELTA) for v in a['dig']}}
+    for how in ('sum', 'min', 'max'):
+        both = pd.concat([a[how], b[how]])
+        out[how] = both.groupby(level=list(range(both.index.nlevels)), dropna=False).agg(how)
+    return out
+
+
+def one_year(args):
+    '''Stream one year=YYYY partition into its cell state.'''
+    year, path, keys, moments, totals, sketches, cols = args
+    state, rows = None, 0
+    for df in mo.scan(path, cols, BATCH_ROWS):
+        df = classify(df, year)
+        key_df = df[keys]
+        g = key_df.assign(obs=1.0, **{v: df[v] for v in totals}).groupby(keys, dropna=False)
+        state = merge(state, {
+            'mom': {v: mo.batch_moments(key_df, df[v].to_numpy()) for v in moments},
+            'dig': {v: mo.digest(key_df, df[v].to_numpy(dtype=float), DELTA) for v in sketches},
+            'sum': g.sum(), 'min': g[totals].min(), 'max': g[totals].max()})
+        rows += len(df)
+    return year, rows, state
+
+
+# ── Tables ─────────────────────────────────────────────────────────────────────
+def _cut(frame, by, total=False):
+    '''The frame with its cell index cut down to `by` (a single Total label
+    when total), ready to be merged within the new groups.'''
+    idx = frame.index.to_frame(index=False)[by]
+    if total:
+        idx = pd.DataFrame({k: 'Total' if i == 0 else '' for i, k in enumerate(by)},
+                           index=idx.index)
+    return frame.set_axis(pd.MultiIndex.from_frame(idx))
+
+
+def _multi(idx):
+    return idx if isinstance(idx, pd.MultiIndex) else pd.MultiIndex.from_arrays([idx])
+
+
+def table(state, t, total=False):
+    '''One row per `by` group (or the Total row) with the requested columns.'''
+    by, out = t['by'], {}
+    lv = list(range(len(by)))
+    obs = _cut(state['sum'], by, total)['obs'].groupby(level=lv, dropna=False).sum()
+    cells = _multi(obs.index)                      # every group with at least one row
+    for v, s in t['cols']:
+        name = 'obs' if s == 'count' else f"{s}_{v}"
+        if s == 'count':
+            col = obs
+        elif s in ('n', 'mean', 'sd'):
+            st = mo.chan_rollup(_cut(state['mom'][v], by, total))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                col = {'n': st['n'], 'mean': st['mean'].where(st['n'] > 0),
+                       'sd': np.sqrt(st['m2'] / (st['n'] - 1)).where(st['n'] > 1)}[s]
+        elif s in ('sum', 'min', 'max'):
+            col = _cut(state[s], by, total)[v].groupby(level=lv, dropna=False).agg(s)
+        else:
+            d = mo.digest_compress(_cut(state['dig'][v], by, total), DELTA)
+            col = mo.digest_quantiles(d, [int(s[1:])])[s]
+        out[name] = col.set_axis(_multi(col.index)).reindex(cells, fill_value=0 if s == 'n' else np.nan)
+    df = pd.DataFrame(out, index=cells)
+    df.index = df.index.set_names(by)
+    df = df.reset_index()
+    if not total:
+        df = df.sort_values(by).reset_index(drop=True)
+        for k, labels in (('size_class', ['n.a.'] + [l for _, l in SIZE_CLASSES]),
+                          ('period', ['other'] + [l for *_, l in PERIODS])):
+            if k in df:
+                df[k] = df[k].map(dict(enumerate(labels)))
+    return df
+
+
+def _tex(s):
+    return re.sub(r'([_#&%$])', r'\\\1', str(s))
+
+
+def to_latex(df, t, path):
+    '''listtab ..., rstyle(tabular): group columns left-aligned, counts right,
+    statistics centred; missing shows as "." as in Stata.'''
+    by, cols = t['by'], t['cols']
+    head = t.get('head') or by + [f"{v} ({s})" if s != 'count' else 'Observations' for v, s in cols]
+    align = ['l'] * len(by) + ['r' if s in ('count', 'n') else 'c' for _, s in cols]
+    fmts = [FORMATS.get(s, '{:.2f}') for _, s in cols]
+    names = list(df.columns[len(by):])
+    lines = [rf"\begin{{tabular}}{{{' '.join(align)}}}",
+             r"\hline " + " & ".join(_tex(h) for h in head) + r" \\", r"\hline"]
+    for _, r in df.iterrows():
+        if r[by[0]] == 'Total':
+            lines.append(r"\hline")
+        cells = [_tex(r[k]) for k in by] + \
+                ['.' if pd.isna(r[c]) else f.format(r[c]) for c, f in zip(names, fmts)]
+        lines.append(" & ".join(cells) + r" \\")
+    lines.append(r"\hline\end{tabular}")
+    with open(path, 'w') as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+if __name__ == '__main__':
+    os.makedirs(OUT_DIR, exist_ok=True)
+    parts = [(y, p) for y, p in mo.year_partitions(SRC_DIR) if y not in DROP_YEARS]
+    tables, keys, moments, totals, sketches, cols = plan(mo.present_columns(SRC_DIR))
+    print(f"{len(parts)} year partitions in {SRC_DIR} → {len(tables)} table(s)")
+    print(f"  cells: {keys}\n  moments: {moments}\n  totals: {totals}\n  sketches: {sketches}")
+
+    state = None
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        tasks = [(y, p, keys, moments, totals, sketches, cols) for y, p in parts]
+        for year, rows, st in pool.map(one_year, tasks):
+            print(f"  year {year}: {rows:,} firm-years")
+            state = merge(state, st)
+
+    for name, t in tables.items():
+        df = table(state, t)
+        if t.get('total'):
+            df = pd.concat([df, table(state, t, total=True)], ignore_index=True)
+        df.to_csv(os.path.join(OUT_DIR, f"{name}.csv"), index=False)
+        to_latex(df, t, os.path.join(OUT_DIR, f"{name}.tex"))
+        print(f"  {name}: {len(df):,} rows → {name}.tex / {name}.csv")
+    print("All done!")
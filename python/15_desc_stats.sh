@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 4
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_desc_stats
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting descriptive statistics at $(date)" > 15_desc_stats.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> 15_desc_stats.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> 15_desc_stats.log
+
+# 2) Build the summary tables
+echo "Running 15_desc_stats.py at $(date)" &>> 15_desc_stats.log
+if python3 15_desc_stats.py &>> 15_desc_stats.log; then
+  echo "15_desc_stats.py finished successfully at $(date)" &>> 15_desc_stats.log
+else
+  echo "ERROR: 15_desc_stats.py failed! See above log." &>> 15_desc_stats.log
+  exit 1
+fi
+
+echo "Finished descriptive statistics at $(date)" &>> 15_desc_stats.log
@@ -0,0 +1,237 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Stage benchmarks on synthetic ORBIS data (synth_orbis.py): wall time,
+         throughput, peak memory and DuckDB spill per stage and scale, kept in
+         a history across commits
+Version: 1
+
+Usage:
+  python bench_stages.py run     [--rows N ...] [--stages STAGE ...] [--repeats K]
+  python bench_stages.py history [--rows N ...] [--stages STAGE ...]
+
+Each scale gets its own data directory under BENCH_DIR, generated once (and
+again only when synth_orbis.py changes). The stage scripts are run unchanged
+except for their paths and the DuckDB memory limit, which are rewritten into
+a copy under BENCH_DIR/scripts. Results are appended to BENCH_DIR/history.jsonl
+tagged with the git commit, so `history` shows how each stage moved between
+commits.
+'''
+
+# Import packages
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pipeline as pl
+import runlog as rl
+import stage_cache as sc
+import synth_orbis as so
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+BENCH_DIR  = "/scratch/[your_group]/bench"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY    = os.path.join(BENCH_DIR, "history.jsonl")
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+SCALES       = [1_000_000, 10_000_000, 100_000_000, 500_000_000]
+ROWS         = [1_000_000]                          # default scales for `run`
+BENCH_STAGES = ['clean', 'tfpr_real', 'cells', 'csv']   # 'append' benches 03 on CSV input
+REPEATS      = 1                # best-of-K wall time per stage
+MEMORY_LIMIT = '60GB'           # DuckDB memory_limit written into the stage copies
+REGRESSION   = 0.10             # flag a stage >10% slower than at the previous commit
+
+DATA_PATH = "/scratch/[your_group]/wrds_batch"
+TMP_PATH  = "/scratch/[your_group]/duckdb_tmp"
+
+
+# ── Data ───────────────────────────────────────────────────────────────────────
+def data_dir(rows, output):
+    return os.path.join(BENCH_DIR, f"{output}_{rows}")
+
+
+def ensure_data(rows, output):
+    '''Generate the synthetic extraction for one scale unless it is current.'''
+    d = data_dir(rows, output)
+    marker = os.path.join(d, ".synth.json")
+    want = {'rows': rows, 'output': output, 'seed': so.SEED,
+            'code': sc.code_hash(os.path.join(SCRIPT_DIR, "synth_orbis.py"))}
+    if os.path.exists(marker):
+        with open(marker) as fh:
+            if json.load(fh) == want:
+                return d
+    for sub in os.listdir(d) if os.path.isdir(d) else []:
+        sc.remove(os.path.join(d, sub))
+    print(f"generating {rows:,} synthetic rows ({output}) → {d}")
+    t0 = time.time()
+    n = so.generate(d, rows, output)
+    print(f"  {n:,} rows in {time.time() - t0:,.0f}s")
+    with open(marker, 'w') as fh:
+        json.dump(want, fh)
+    return d
+
+
+# ── Stage copies ───────────────────────────────────────────────────────────────
+def patch(script, d, overrides=None):
+    '''Copy of a stage script pointed at data dir `d`, with constant overrides.'''
+    with open(os.path.join(SCRIPT_DIR, script)) as fh:
+        src = fh.read()
+    src = src.replace(DATA_PATH, d).replace(TMP_PATH, os.path.join(BENCH_DIR, "duckdb_tmp"))
+    src = re.sub(r"memory_limit='[^']*'", f"memory_limit='{MEMORY_LIMIT}'", src)
+    for name, value in (overrides or {}).items():
+        src = re.sub(rf"^{name}(\s*)=.*$", rf"{name}\1= {value!r}", src, count=1, flags=re.M)
+    out = os.path.join(BENCH_DIR, "scripts", script)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as fh:
+        fh.write(src)
+    return out
+
+
+def stage_paths(names, d):
+    out = []
+    for name in names:
+        hits = sorted(glob.glob(os.path.join(d, name)))
+        out += hits or [os.path.normpath(os.path.join(d, name))]
+    return out
+
+
+def run_stage(stage, d, run_id, overrides):
+    '''One timed execution of a stage on data dir `d`.'''
+    cfg = pl.STAGES[stage]
+    for p in stage_paths(cfg['outputs'], d):
+        sc.remove(p)
+    script = patch(cfg['script'], d, overrides)
+    log_dir = os.path.join(d, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    env = {**os.environ, 'PIPELINE_RUN': run_id, 'PIPELINE_STAGE': stage,
+           'PIPELINE_LOG_DIR': log_dir,
+           'PYTHONPATH': os.pathsep.join(filter(None, [SCRIPT_DIR, os.environ.get('PYTHONPATH')]))}
+    t0 = time.time()
+    with open(os.path.join(log_dir, f"{stage}.log"), 'w') as out:
+        proc = subprocess.Popen([sys.executable, script], cwd=d, env=env,
+                                stdout=out, stderr=subprocess.STDOUT)
+        _, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return time.time() - t0, proc.returncode, rl.usage(ru)
+
+
+def duckdb_peaks(d, run_id, stage):
+    '''Largest buffer-memory and spill high-water marks among the stage's
+    profiled statements (instrument.Probe events).'''
+    events = [e for e in rl.RunLog(os.path.join(d, "logs", "events.jsonl")).records(run_id)
+              if e['stage'] == stage and e['kind'] == 'duckdb']
+    return {'peak_buffer_mb': max((e.get('peak_buffer_mb', 0) for e in events), default=None),
+            'spill_mb': max((e.get('spill_mb', 0) for e in events), default=None)}
+
+
+# ── Benchmark ──────────────────────────────────────────────────────────────────
+def git_commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True).stdout.strip()
+    return git('rev-parse', '--short', 'HEAD') or None, bool(git('status', '--porcelain',
+                                                                 '--untracked-files=no'))
+
+
+def bench(rows_list, stages, repeats=REPEATS):
+    commit, dirty = git_commit()
+    log = rl.RunLog(HISTORY)
+    order = [s for s in pl.STAGES if s in stages]
+    output = "csv" if 'append' in order else "parquet"
+    overrides = {'RAW_LAYOUT': "chunks"} if output == "csv" else {}
+    failed = 0
+    for rows in rows_list:
+        d = ensure_data(rows, output)
+        run_id = rl.new_run_id()
+        print(f"bench {run_id} @ {commit}{'+dirty' if dirty else ''}: {rows:,} rows, "
+              f"{', '.join(order)}")
+        for stage in order:
+            cfg = pl.STAGES[stage]
+            inputs = sorted(set(stage_paths(cfg['inputs'], d))
+                            | {p for u in cfg['after'] for p in stage_paths(pl.STAGES[u]['outputs'], d)})
+            walls, best = [], None
+            for _ in range(repeats):
+                wall, rc, use = run_stage(stage, d, run_id, overrides)
+                walls.append(round(wall, 2))
+                if rc != 0:
+                    break
+                if best is None or wall < best[0]:
+                    best = (wall, use)
+            if rc != 0:
+                failed += 1
+                print(f"  {stage:<12} FAILED (exit {rc}), see {os.path.join(d, 'logs', stage + '.log')}")
+                break
+            wall, use = best
+            outputs = stage_paths(cfg['outputs'], d)
+            rows_in = rl.parquet_rows(inputs) or rows
+            rec = {'run': run_id, 'commit': commit, 'dirty': dirty,
+                   'time': datetime.now().isoformat(timespec='seconds'),
+                   'rows': rows, 'stage': stage, 'wall_s': round(wall, 2), 'walls': walls,
+                   'rows_in': rows_in, 'rows_out': rl.parquet_rows(outputs),
+                   'rows_per_s': round(rows_in / wall) if wall else None,
+                   'bytes_out': rl.disk_bytes(outputs), **use,
+                   **duckdb_peaks(d, run_id, stage),
+                   'memory_limit': MEMORY_LIMIT, 'cpus': os.cpu_count()}
+            log.write(rec)
+            print(f"  {stage:<12}{wall:>9,.1f}s{rec['rows_per_s']:>14,} rows/s"
+                  f"{use['max_rss_mb']:>10,.0f} MB peak RSS"
+                  f"{rec['spill_mb'] or 0:>8,.0f} MB spilled")
+    return 1 if failed else 0
+
+
+# ── History ────────────────────────────────────────────────────────────────────
+def history(rows_list=None, stages=None):
+    '''Per (scale, stage): one line per commit (best wall of that commit), with
+    the change against the previous commit.'''
+    if not os.path.exists(HISTORY):
+        print("no benchmarks recorded yet")
+        return
+    with open(HISTORY) as fh:
+        recs = [json.loads(line) for line in fh if line.strip()]
+    series = defaultdict(dict)
+    for r in recs:
+        if (rows_list and r['rows'] not in rows_list) or (stages and r['stage'] not in stages):
+            continue
+        tag = r['commit'] + ('+' if r['dirty'] else '') if r['commit'] else '?'
+        prev = series[(r['rows'], r['stage'])].get(tag)
+        if prev is None or r['wall_s'] < prev['wall_s']:
+            series[(r['rows'], r['stage'])].pop(tag, None)
+            series[(r['rows'], r['stage'])][tag] = r     # keeps commits in log order
+    order = {s: i for i, s in enumerate(pl.STAGES)}
+    for (rows, stage), by_commit in sorted(series.items(), key=lambda kv: (kv[0][0], order[kv[0][1]])):
+        print(f"{stage} @ {rows:,} rows")
+        print(f"  {'commit':<12}{'date':<12}{'wall s':>9}{'rows/s':>13}{'peak MB':>10}"
+              f"{'spill MB':>10}{'vs prev':>9}")
+        last = None
+        for tag, r in by_commit.items():
+            delta = (r['wall_s'] / last - 1) if last else None
+            flag = "  slower" if delta is not None and delta > REGRESSION else ""
+            print(f"  {tag:<12}{r['time'][:10]:<12}{r['wall_s']:>9,.1f}{r['rows_per_s'] or 0:>13,}"
+                  f"{r['max_rss_mb']:>10,.0f}{r.get('spill_mb') or 0:>10,.0f}"
+                  f"{'' if delta is None else f'{delta:+.0%}':>9}{flag}")
+            last = r['wall_s']
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.split('Usage:')[0].strip(),
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('command', choices=['run', 'history'])
+    ap.add_argument('--rows', type=int, nargs='+', help=f"scales, e.g. {SCALES}")
+    ap.add_argument('--stages', nargs='+', choices=['append', 'clean', 'csv', 'tfpr_real', 'cells'])
+    ap.add_argument('--repeats', type=int, default=REPEATS)
+    args = ap.parse_args()
+
+    if args.command == 'history':
+        history(args.rows, args.stages)
+        sys.exit(0)
+    sys.exit(bench(args.rows or ROWS, args.stages or BENCH_STAGES, args.repeats))
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 8
+#$ -l m_mem_free=64G
+#$ -l h_vmem=64G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_bench
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting bench_stages at $(date)" > bench_stages.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> bench_stages.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> bench_stages.log
+
+# 2) Benchmark (pass --rows N ... --stages ... after the script), then the history
+echo "Running bench_stages.py at $(date)" &>> bench_stages.log
+if python3 bench_stages.py run "$@" &>> bench_stages.log && python3 bench_stages.py history &>> bench_stages.log; then
+  echo "bench_stages.py finished successfully at $(date)" &>> bench_stages.log
+else
+  echo "ERROR: bench_stages.py failed! See above log." &>> bench_stages.log
+  exit 1
+fi
+
+echo "Finished bench_stages at $(date)" &>> bench_stages.log
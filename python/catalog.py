@@ -0,0 +1,192 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Variable catalog shared by the WRDS extractors and the DuckDB cleaner
+Version: 3
+'''
+
+# ── Universe ───────────────────────────────────────────────────────────────────
+# 1) Emerging Markets ISO Code (Categories by MSCI)
+ISO_CODES = [
+    'BR','CL','CN','CO','CZ','EG','GR','HU','IN','ID','KR','KW',
+    'MY','MX','PE','PH','PL','QA','SA','ZA','TW','TH','TR','AE'
+]
+
+# 2) Static vars FROM company_id_table (alias c)
+STATIC_VARS = [
+    'name_internat','name_native','akaname',
+    'slegalf','legalfrm','dateinc','dateinc_year','dateinc_char',
+    'lei_lei','sd_ticker','sd_isin','city_internat','city_native',
+    'country','region_in_country','bvdid','category_of_company','contact_ctryiso'
+]
+
+# 3) Sector and activities vars FROM ob_industry_classifications (alias p)
+SECTOR_VARS = [
+    'major_sector', 'nace2_main_section', 'naceccod2',
+    'nacecdes2', 'nacepcod2', 'nacepdes2',
+    'naicsccod2017', 'naicscdes2017', 'ussicccod', 'ussiccdes'
+]
+
+# 4) Time-varying vars FROM the cash-flow table (alias f)
+FIN_VARS = [
+    'closdate','filing_type','orig_currency','exchrate',
+    'fias','ifas','tfas','ofas','cuas','debt','ocas','toas',
+    'capi','ltdb','wkca','ncas','empl','opre','turn','taxa',
+    'staf','inte','cf','ace','df_employees','emp_orig_range_value',
+    'av','ncli','oncl','culi','ocli','tshf','_315506','_315507',
+    '_315522', 'cost', 'depr', 'expt', '_315501', '_315502',
+    'fiex', 'shfd', 'osfd', 'cash', 'ebta', 'oppl', 'pl',
+    'fdpp', 'fdpc', 'fcdp', '_315524', '_315525', '_315523'
+]
+
+# fin_vars that are not numeric; every other fin_var is a DOUBLE
+FIN_STRING_VARS = ['filing_type', 'orig_currency', 'emp_orig_range_value']
+
+# Monetary fin_vars: these get <var>_defl and <var>_usd in 04_clean_db and are
+# the `vars` local of 04_tfpr_real.do (empl is a headcount and is not converted)
+MONETARY_VARS = [
+    'toas','ifas','tfas','ofas','cuas','turn','debt','ocas','capi','ltdb',
+    'wkca','ncas','opre','taxa','staf','inte','cf','ace','av','ncli','oncl',
+    'culi','ocli','tshf','_315501','_315502','_315506','_315507','_315522',
+    'cost','depr','fiex','shfd','osfd','cash','ebta','oppl','pl'
+]
+
+# Always extracted and cleaned: identifiers, dedup keys, and the columns the
+# 04_clean_db filters and the deflator/USD conversion rely on
+KEY_VARS = [
+    'bvdid','contact_ctryiso','closdate','filing_type','orig_currency','exchrate',
+    'ussicccod','naicsccod2017','naceccod2','nace2_main_section',
+    'turn','opre','empl','toas','cuas'
+]
+
+# Static / sector vars kept on every cleaned firm-year row, as dictionary codes
+# (DuckDB ENUMs). The other static and sector vars (names, cities, code
+# descriptions, ...) are written once per firm to orbis_firms.parquet
+CODE_VARS = [
+    'contact_ctryiso', 'major_sector', 'nace2_main_section',
+    'naceccod2', 'naicsccod2017', 'ussicccod'
+]
+
+# ── Study selection ────────────────────────────────────────────────────────────
+# None keeps the full catalog. Set a list of variable names to extract and
+# clean only those (KEY_VARS are always added), e.g.
+# STUDY_VARS = ['tfas','staf','av','ebta','oppl','opre','cost','depr',
+#               'cf','pl','tshf','shfd','_315506','major_sector','dateinc_year']
+STUDY_VARS = None
+
+
+def selected(group, study=None):
+    '''Variables of `group` kept by the study selection, in catalog order.'''
+    study = STUDY_VARS if study is None else study
+    if study is None:
+        return list(group)
+    keep = set(study) | set(KEY_VARS)
+    return [v for v in group if v in keep]
+
+
+def select_cols(study=None):
+    '''c./p./f. column lists for the WRDS SELECT.'''
+    c_cols = ", ".join(f"c.{v}" for v in selected(STATIC_VARS, study))
+    p_cols = ", ".join(f"p.{v}" for v in selected(SECTOR_VARS, study))
+    f_cols = ", ".join(f"f.{v}" for v in selected(FIN_VARS, study))
+    return c_cols, p_cols, f_cols
+
+
+# ── SQL blocks for 04_clean_db ─────────────────────────────────────────────────
+def _clean_name(v):
+    return 'ctryiso' if v == 'contact_ctryiso' else v
+
+
+def _cast(v, sql_type, present):
+    out = _clean_name(v)
+    if v not in present:
+        return f"CAST(NULL AS {sql_type}) AS {out}"
+    return f"CAST({v:<20} AS {sql_type}) AS {out}"
+
+
+def cast_block(present, closdate_expr, study=None):
+    '''SELECT list casting every selected raw column to its clean type.
+
+    `present` is the set of columns in the raw scan; selected variables that are
+    missing come out as typed NULLs. contact_ctryiso is renamed to ctryiso.
+    '''
+    lines = []
+    for v in selected(STATIC_VARS, study) + selected(SECTOR_VARS, study):
+        lines.append(_cast(v, 'VARCHAR', present))
+    for v in selected(FIN_VARS, study):
+        if v == 'closdate':
+            lines.append(f"{closdate_expr} AS closdate")
+        elif v in FIN_STRING_VARS:
+            lines.append(_cast(v, 'VARCHAR', present))
+        else:
+            lines.append(_cast(v, 'DOUBLE', present))
+    return ",\n        ".join(lines)
+
+
+def monetary(study=None):
+    return [v for v in MONETARY_VARS if v in selected(FIN_VARS, study)]
+
+
+def defl_block(study=None):
+    return ",\n        ".join(
+        f"{v:<7}* (100.0 / deflator) AS {v}_defl" for v in monetary(study))
+
+
+def usd_block(study=None):
+    return ",\n        ".join(
+        f"{v:<7}* exchrate AS {v}_usd" for v in monetary(study))
+
+
+# ── Firm dimension / fact split ────────────────────────────────────────────────
+def dim_vars(study=None):
+    '''Per-firm columns of orbis_firms.parquet (besides firm_id and bvdid).'''
+    return [v for v in selected(STATIC_VARS, study) + selected(SECTOR_VARS, study)
+            if v not in CODE_VARS and v != 'bvdid']
+
+
+def code_vars(study=None):
+    '''String columns of the cleaned fact table, stored as ENUM codes.'''
+    return [_clean_name(v) for v in CODE_VARS + FIN_STRING_VARS
+            if v in selected(STATIC_VARS + SECTOR_VARS + FIN_VARS, study)]
+
+
+def dim_block(study=None):
+    '''SELECT list of the firm dimension, grouped by bvdid: each attribute as
+    of the firm's latest filing.'''
+    return ",\n  ".join(['bvdid'] + [f"arg_max({v}, closdate) AS {v}" for v in dim_vars(study)])
+
+
+def code_block(study=None):
+    '''REPLACE list casting the fact table's string columns to their ENUM types.'''
+    return ",\n    ".join(f"CAST({v} AS {v}_code) AS {v}" for v in code_vars(study))
+
+
+# ── SQL blocks for 07_tfpr_real ────────────────────────────────────────────────
+# Stata semantics: log/power of a non-positive number is missing, not an error
+STATA_MACROS = [
+    "CREATE MACRO safe_ln(x) AS CASE WHEN x > 0 THEN ln(x) END",
+    """CREATE MACRO safe_pow(x, a) AS
+  CASE WHEN x > 0 THEN pow(x, a) WHEN x = 0 AND a > 0 THEN 0.0 END""",
+]
+
+
+def stata_macros(con):
+    for sql in STATA_MACROS:
+        con.execute(sql)
+
+
+def tfp_block():
+    '''TFPQ / TFPR with the ORBIS alpha (1) and the IO alpha (2).
+
+    A firm with no employees or no fixed assets has a zero denominator; x / 0
+    is missing in Stata but inf in DuckDB, which would carry into the group
+    means of the logs, so the denominator is NULLIF'ed.
+    '''
+    den = {1: "safe_pow(empl, 1 - alpha_1) * safe_pow(tfas, alpha_1)",
+           2: "safe_pow(empl, 1 - alpha)   * safe_pow(tfas, alpha)"}
+    return ",\n  ".join(f"{num:<8} / NULLIF({den[i]}, 0) AS {name}{i}"
+                         for name, num in (('tfpq', 'va_usd'), ('tfpr', 'turn_usd'))
+                         for i in (1, 2))
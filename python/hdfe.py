@@ -0,0 +1,521 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Multi-way fixed-effects OLS (alternating projections) with cluster-robust
+         SEs and esttab-style LaTeX tables, for the regression stage
+Version: 3
+'''
+
+# Import packages
+import math
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# ── Specifications ─────────────────────────────────────────────────────────────
+# family='reghdfe': absorb(...) with singletons dropped;
+# family='xtreg'  : xtreg ..., fe with i.<fe> dummies, i.e. absorb(id + fe).
+Spec = namedtuple("Spec", "name y terms absorb cluster family sample",
+                  defaults=('country2', 'reghdfe', None))
+
+Result = namedtuple("Result", "spec names b se t p V N G df_r r2_within omitted q kernels",
+                    defaults=(None, None))
+
+
+# ── Stata factor-variable notation ─────────────────────────────────────────────
+def _atom(tok, df):
+    '''c.x → {x: values}; i.x → one dummy per non-base level of x.'''
+    kind, var = tok.split('.', 1) if '.' in tok else ('c', tok)
+    if kind == 'c':
+        return {f"c.{var}": df[var].to_numpy(dtype=float)}
+    if kind != 'i':
+        raise ValueError(f"unsupported factor operator in {tok!r}")
+    col = df[var]
+    levels = np.sort(col.dropna().unique())
+    out = {}
+    for lv in levels[1:]:                      # lowest level is the base
+        v = (col == lv).to_numpy(dtype=float)
+        v[col.isna().to_numpy()] = np.nan
+        out[f"{lv:g}.{var}" if isinstance(lv, (int, float, np.number)) else f"{lv}.{var}"] = v
+    return out
+
+
+def _product(parts):
+    names, vals = [''], [None]
+    for part in parts:
+        names = [f"{n}#{k}" if n else k for n in names for k in part]
+        vals = [v if w is None else w * v for w in vals for v in part.values()]
+    return dict(zip(names, vals))
+
+
+def expand(term, df):
+    '''Expand one term (`c.a##i.b`, `c.a#i.b#c.z`, `x`) into named columns.
+
+    `##` adds all lower-order terms, as in Stata; `#` is the interaction only.
+    Continuous variables are named without the `c.` prefix on their own, as
+    esttab prints them.
+    '''
+    if '##' in term:
+        atoms = term.split('##')
+        out = {}
+        for r in range(1, len(atoms) + 1):
+            for combo in _combinations(atoms, r):
+                out.update(expand('#'.join(combo), df))
+        return out
+    out = _product([_atom(tok, df) for tok in term.split('#')])
+    return {(k[2:] if k.startswith('c.') and '#' not in k else k): v for k, v in out.items()}
+
+
+def _combinations(seq, r):
+    if r == 0:
+        yield ()
+        return
+    for i in range(len(seq)):
+        for rest in _combinations(seq[i + 1:], r - 1):
+            yield (seq[i],) + rest
+
+
+def design(spec, df):
+    '''(y, X, names) for a spec; rows with any missing value are NaN.'''
+    cols = {}
+    for term in spec.terms:
+        cols.update(expand(term, df))
+    names = list(cols)
+    X = np.column_stack([cols[n] for n in names]) if names else np.empty((len(df), 0))
+    return df[spec.y].to_numpy(dtype=float), X, names
+
+
+# ── Fixed effects ──────────────────────────────────────────────────────────────
+class Factor:
+    '''Integer codes of one fixed effect with the sort order used for group sums.'''
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        self.levels = sorted_codes[self.starts]
+        self.counts = np.diff(np.r_[self.starts, len(codes)])
+        self.index = np.empty(len(codes), dtype=np.int64)
+        self.index[self.order] = np.repeat(np.arange(len(self.starts)), self.counts)
+
+    def means(self, M):
+        return np.add.reduceat(M[self.order], self.starts, axis=0) / self.counts[:, None]
+
+    def nested_in(self, other):
+        '''True if every level of self falls in a single level of `other`.'''
+        pairs = pd.DataFrame({'a': self.codes, 'b': other.codes}).drop_duplicates()
+        return not pairs['a'].duplicated().any()
+
+
+def codes_of(series):
+    return pd.factorize(series, sort=True)[0].astype(np.int64)
+
+
+def drop_singletons(fe_codes):
+    '''Boolean keep-mask after iteratively removing singleton groups (reghdfe).'''
+    keep = np.ones(len(fe_codes[0]), dtype=bool)
+    while True:
+        changed = False
+        for c in fe_codes:
+            counts = np.bincount(c[keep])
+            single = keep & (counts[c] == 1) if len(counts) else keep & False
+            if single.any():
+                keep &= ~single
+                changed = True
+        if not changed:
+            return keep
+
+
+def demean(M, factors, tol=1e-8, maxiter=10_000):
+    '''Partial every FE out of all columns of M by alternating projections.
+
+    With one factor this is the exact within transform; with several, the
+    sweep is repeated until no column moves by more than `tol` (reghdfe's
+    default tolerance).
+    '''
+    M = M - M.mean(axis=0)
+    if len(factors) == 1:
+        f = factors[0]
+        return M - f.means(M)[f.index]
+    for it in range(maxiter):
+        before = M.copy()
+        for f in factors:
+            M -= f.means(M)[f.index]
+        if np.max(np.abs(M - before), initial=0) < tol:
+            return M
+    raise RuntimeError(f"demeaning did not converge in {maxiter} iterations")
+
+
+# ── Absorbed design shared by specs with the same FE set and sample ───────────
+class Absorbed:
+    '''Demeaned [y X] columns for one (FE set, sample), reused across specs.'''
+
+    def __init__(self, df, mask, absorb, cluster, columns, singletons=True, tol=1e-8):
+        idx = np.flatnonzero(mask)
+        raw = [codes_of(df[a].to_numpy()[idx]) for a in absorb]
+        keep = drop_singletons(raw) if singletons and raw else np.ones(len(idx), dtype=bool)
+        self.rows = idx[keep]
+        self.factors = [Factor(c[keep]) for c in raw]
+        self.cluster = Factor(codes_of(df[cluster].to_numpy()[self.rows]))
+        self.absorb = absorb
+        self.columns = columns
+        self.raw = np.column_stack([columns[c][self.rows] for c in columns])
+        self.data = demean(self.raw, self.factors, tol) if self.factors else self.raw - self.raw.mean(axis=0)
+        self.pos = {c: i for i, c in enumerate(columns)}
+
+    def get(self, names):
+        return self.data[:, [self.pos[n] for n in names]]
+
+    def means(self, names):
+        return self.raw[:, [self.pos[n] for n in names]].mean(axis=0)
+
+    def centred_ss(self, names):
+        r = self.raw[:, [self.pos[n] for n in names]]
+        return ((r - r.mean(axis=0))**2).sum(axis=0)
+
+    def df_absorbed(self, family):
+        '''Degrees of freedom used by the absorbed fixed effects.
+
+        reghdfe: FEs nested in the cluster variable cost nothing; every other FE
+        costs its levels, minus one for each FE after the first.
+        xtreg: the first FE is the panel id and is not counted; each further FE
+        costs levels-1 unless the panel id is nested in it (every firm in one
+        country, say), when Stata omits its dummies as collinear.
+        '''
+        if family == 'xtreg':
+            panel = self.factors[0]
+            return sum(len(f.levels) - 1 for f in self.factors[1:] if not panel.nested_in(f))
+        free = [f for f in self.factors if not f.nested_in(self.cluster)]
+        if not free:
+            return 1
+        return sum(len(f.levels) for f in free) - (len(free) - 1)
+
+
+def _independent(XtX, tss, tol=1e-9):
+    '''Columns kept by an ordered collinearity sweep (Stata's o. omissions).
+
+    A column is dropped if the FEs absorb it (demeaned sum of squares below
+    `tol` times its centred raw sum of squares, as in reghdfe) or if it is
+    collinear with the columns already kept.
+    '''
+    keep = []
+    diag = np.diag(XtX)
+    d = np.sqrt(np.clip(diag, 0, None))
+    for k in range(XtX.shape[0]):
+        if d[k] <= 0 or diag[k] <= tol * tss[k]:
+            continue
+        cand = keep + [k]
+        sub = XtX[np.ix_(cand, cand)] / np.outer(d[cand], d[cand])
+        if np.linalg.cond(sub) < 1 / tol:
+            keep = cand
+    return keep
+
+
+def cluster_scores(X, e, cluster):
+    '''Per-cluster score sums S_g = sum_{i in g} x_i e_i, shape (G, K).'''
+    return np.add.reduceat((X * e[:, None])[cluster.order], cluster.starts, axis=0)
+
+
+def fit(spec, ab, names, boot_terms=None):
+    '''OLS on the demeaned design with CR1 cluster-robust variance.
+
+    With `boot_terms` (a list of term names, or 'all'), the wild cluster
+    bootstrap kernels for those coefficients are built from the same design.
+    '''
+    y = ab.get([spec.y])[:, 0]
+    X = ab.get(names)
+    keep = _independent(X.T @ X, ab.centred_ss(names))
+    Xk = X[:, keep]
+    XtX_inv = np.linalg.inv(Xk.T @ Xk)
+    bk = XtX_inv @ (Xk.T @ y)
+    e = y - Xk @ bk
+
+    N, G = len(y), len(ab.cluster.levels)
+    df_m = len(keep)
+    df_a = ab.df_absorbed(spec.family)
+    if spec.family == 'xtreg':
+        q = G / (G - 1) * (N - 1) / (N - df_m - df_a - 1)
+    else:
+        q = G / (G - 1) * (N - 1) / (N - df_m - df_a)
+    S = cluster_scores(Xk, e, ab.cluster)
+    Vk = q * XtX_inv @ (S.T @ S) @ XtX_inv
+
+    K = len(names)
+    b, V = np.zeros(K), np.full((K, K), np.nan)
+    b[keep] = bk
+    V[np.ix_(keep, keep)] = Vk
+    se = np.sqrt(np.diag(V))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = b / se
+    p = np.array([2 * t_sf(abs(v), G - 1) if np.isfinite(v) else np.nan for v in t])
+
+    # constant at the sample means, as reghdfe / xtreg report it
+    cons = ab.means([spec.y])[0] - ab.means(names) @ b
+    tss = y @ y
+    r2w = 1 - (e @ e) / tss if tss > 0 else np.nan
+    omitted = [n for i, n in enumerate(names) if i not in keep]
+    kernels = None
+    if boot_terms is not None:
+        tested = [n for i, n in enumerate(names) if i in keep
+                  and (boot_terms == 'all' or n in boot_terms)]
+        kernels = wild_kernels(y, Xk, [names[i] for i in keep], XtX_inv, e, ab.cluster, tested)
+    return Result(spec, names + ['_cons'], np.r_[b, cons], np.r_[se, np.nan],
+                  np.r_[t, np.nan], np.r_[p, np.nan], V, N, G, G - 1, r2w, omitted,
+                  q, kernels)
+
+
+# ── Wild cluster bootstrap ─────────────────────────────────────────────────────
+# With bootstrap weights v (one per cluster), y* = X b0 + u0 * v_g. Because the
+# design is fixed, b* - b0 = A S v with A = (X'X)^-1 and S the (K x G) matrix of
+# per-cluster scores X_g'u0_g, and the bootstrap cluster scores are
+# v_h S_h - H_h A S v with H_h = X_h'X_h. For coefficient k everything reduces
+# to a G-vector n = A_k S and a G x G matrix R = [A_k H_h A S]_h:
+#     b*_k - b0_k = n v,   se*_k = sqrt(q sum_h (n_h v_h - R_h v)^2)
+# so each replication costs O(G^2), independent of the number of observations.
+def wild_kernels(y, X, names, A, e, cluster, tested):
+    '''{term: (n_wcu, R_wcu, n_wcr, R_wcr)} for the tested coefficients.
+
+    WCU uses the unrestricted residuals; WCR refits with the coefficient
+    restricted to zero (the null of its t-test) and resamples those residuals.
+    The restricted fit and its cluster scores come from X'X = sum_h H_h and the
+    per-cluster X_h'y, without another pass over the observations.
+    '''
+    H = np.stack([X[cluster.order[s:s + c]].T @ X[cluster.order[s:s + c]]
+                  for s, c in zip(cluster.starts, cluster.counts)])
+    S_y = cluster_scores(X, y, cluster)                     # (G x K) X_h'y_h
+    XtX, Xty = H.sum(axis=0), S_y.sum(axis=0)
+    S_u = cluster_scores(X, e, cluster).T
+    out = {}
+    for name in tested:
+        k = names.index(name)
+        AkH = np.einsum('k,gkl->gl', A[k], H)               # (G x K)
+        rest = [j for j in range(X.shape[1]) if j != k]
+        br = np.linalg.solve(XtX[np.ix_(rest, rest)], Xty[rest]) if rest else np.zeros(0)
+        S_r = (S_y - H[:, :, rest] @ br).T                  # X_h'(y_h - X_h,r b_r)
+        out[name] = (A[k] @ S_u, AkH @ A @ S_u, A[k] @ S_r, AkH @ A @ S_r)
+    return out
+
+
+def draw_weights(rng, G, reps, kind='webb'):
+    '''(G x reps) cluster weights: Webb six-point (default) or Rademacher.'''
+    if kind == 'rademacher':
+        return rng.choice(np.array([-1.0, 1.0]), size=(G, reps))
+    webb = np.sqrt(np.array([0.5, 1.0, 1.5]))
+    return rng.choice(np.r_[-webb, webb], size=(G, reps))
+
+
+def wild_batch(kernels, q, reps, seed, kind='webb'):
+    '''Bootstrap t-statistics and coefficient draws for one batch.'''
+    rng = np.random.default_rng(seed)
+    G = len(next(iter(kernels.values()))[0])
+    V = draw_weights(rng, G, reps, kind)
+    out = {}
+    for name, (n_u, R_u, n_r, R_r) in kernels.items():
+        stats = []
+        for n, R in ((n_u, R_u), (n_r, R_r)):
+            num = n @ V
+            sc = n[:, None] * V - R @ V
+            stats += [num, num / np.sqrt(q * (sc**2).sum(axis=0))]
+        out[name] = stats                                  # [db_u, t_u, db_r, t_r]
+    return out
+
+
+def _wild_task(args):
+    spec_name, kernels, q, reps, seed, kind = args
+    return spec_name, wild_batch(kernels, q, reps, seed, kind)
+
+
+def wild_bootstrap(results, reps=9999, batch=1000, workers=4, seed=12345,
+                   kind='webb', level=0.95):
+    '''Wild cluster bootstrap for every result that carries kernels.
+
+    Replications run in batches over a process pool. Batch j of spec i is
+    seeded with SeedSequence([seed, i, j]), so the draws do not depend on the
+    number of workers or the order in which batches finish. Returns the long
+    table of draws and one summary row per (spec, term) with the WCR p-value
+    and the WCU percentile-t confidence interval.
+    '''
+    tasks = []
+    for i, r in enumerate(results):
+        if not r.kernels:
+            continue
+        for j, start in enumerate(range(0, reps, batch)):
+            ss = np.random.SeedSequence([seed, i, j])
+            tasks.append((r.spec.name, r.kernels, r.q, min(batch, reps - start), ss, kind))
+
+    parts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name, out in pool.map(_wild_task, tasks):
+            for term, stats in out.items():
+                parts.setdefault((name, term), []).append(stats)
+
+    by_name = {r.spec.name: r for r in results}
+    draws, summary = [], []
+    a = (1 - level) / 2
+    for (name, term), chunks in parts.items():
+        r = by_name[name]
+        k = r.names.index(term)
+        db_u, t_u, db_r, t_r = (np.concatenate(x) for x in zip(*chunks))
+        b, se, t = r.b[k], r.se[k], r.t[k]
+        draws.append(pd.DataFrame({'spec': name, 'term': term, 'rep': np.arange(len(t_u)),
+                                   'b_wcu': b + db_u, 't_wcu': t_u, 'b_wcr': db_r, 't_wcr': t_r}))
+        lo_q, hi_q = np.quantile(t_u, [a, 1 - a])
+        summary.append({'spec': name, 'term': term, 'b': b, 'se': se, 't': t, 'p': r.p[k],
+                        'p_wcr': np.mean(np.abs(t_r) >= abs(t)),
+                        'ci_lo': b - hi_q * se, 'ci_hi': b - lo_q * se,
+                        'reps': len(t_u), 'weights': kind, 'G': r.G})
+    draws = pd.concat(draws, ignore_index=True) if draws else pd.DataFrame()
+    return draws, pd.DataFrame(summary)
+
+
+# ── Student t tail ─────────────────────────────────────────────────────────────
+def _betacf(a, b, x, maxit=300, eps=3e-14):
+    qab, qap, qam = a + b, a + 1, a - 1
+    c, d = 1.0, 1 - qab * x / qap
+    d = 1 / (d if abs(d) > 1e-300 else 1e-300)
+    h = d
+    for m in range(1, maxit + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > 1e-300 else 1e-300)
+        c = 1 + aa / c if abs(1 + aa / c) > 1e-300 else 1e-300
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > 1e-300 else 1e-300)
+        c = 1 + aa / c if abs(1 + aa / c) > 1e-300 else 1e-300
+        de = d * c
+        h *= de
+        if abs(de - 1) < eps:
+            break
+    return h
+
+
+def _betainc(a, b, x):
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    lbt = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)
+    if x < (a + 1) / (a + b + 2):
+        return math.exp(lbt) * _betacf(a, b, x) / a
+    return 1 - math.exp(lbt) * _betacf(b, a, 1 - x) / b
+
+
+def t_sf(t, df):
+    '''P(T > t) for Student's t with `df` degrees of freedom (t >= 0).'''
+    return 0.5 * _betainc(df / 2, 0.5, df / (df + t * t))
+
+
+# ── Running a sweep ────────────────────────────────────────────────────────────
+def run_specs(specs, df, panel='id', tol=1e-8, boot_terms=None, boot_y=None):
+    '''Fit every spec, demeaning each (FE set, sample) only once.
+
+    Specs whose estimation samples and absorbed FEs coincide share one
+    Absorbed object holding the union of their columns. `boot_terms` is
+    passed to fit() to keep the wild bootstrap kernels, only for the specs
+    whose dependent variable is in `boot_y` (None = every spec).
+    '''
+    built, groups = {}, {}
+    for s in specs:
+        y, X, names = design(s, df)
+        ok = np.isfinite(y) & np.isfinite(X).all(axis=1)
+        for a in s.absorb + (s.cluster,):
+            ok &= df[a].notna().to_numpy()
+        if s.sample is not None:
+            ok &= df.eval(s.sample).to_numpy(dtype=bool)
+        absorb = ((panel,) if s.family == 'xtreg' else ()) + tuple(s.absorb)
+        key = (absorb, s.cluster, s.family == 'reghdfe', ok.tobytes())
+        built[s.name] = (key, names)
+        cols = groups.setdefault(key, {'absorb': absorb, 'mask': ok, 'specs': [], 'cols': {}})
+        cols['specs'].append(s)
+        cols['cols'][s.y] = y
+        cols['cols'].update(dict(zip(names, X.T)))
+
+    results = {}
+    for key, g in groups.items():
+        ab = Absorbed(df, g['mask'], g['absorb'], key[1], g['cols'], singletons=key[2], tol=tol)
+        for s in g['specs']:
+            boot = boot_terms if boot_y is None or s.y in boot_y else None
+            results[s.name] = fit(s, ab, built[s.name][1], boot)
+    return [results[s.name] for s in specs]
+
+
+def tidy(results):
+    '''Long table of coefficients for every result.'''
+    rows = []
+    for r in results:
+        for n, b, se, t, p in zip(r.names, r.b, r.se, r.t, r.p):
+            rows.append({'spec': r.spec.name, 'y': r.spec.y, 'absorb': ' '.join(r.spec.absorb),
+                         'family': r.spec.family, 'term': n, 'b': b, 'se': se, 't': t, 'p': p,
+                         'N': r.N, 'G': r.G, 'r2_within': r.r2_within,
+                         'omitted': n in r.omitted})
+    return pd.DataFrame(rows)
+
+
+# ── esttab ─────────────────────────────────────────────────────────────────────
+def _stars(p):
+    if not np.isfinite(p):
+        return ''
+    return '***' if p < 0.01 else '**' if p < 0.05 else '*' if p < 0.10 else ''
+
+
+def _tex(s):
+    return re.sub(r'([_#&%$])', r'\\\1', s)
+
+
+def esttab(results, path, title, fmt='%9.4f'):
+    '''esttab ..., se star(* 0.10 ** 0.05 *** 0.01) b(%9.4f) se(%9.4f) booktabs'''
+    f = lambda v: (fmt % v).strip()
+    terms = []
+    for r in results:
+        terms += [n for n in r.names if n not in terms and n != '_cons']
+    terms.append('_cons')
+    ncol = len(results)
+
+    lines = [
+        r"{",
+        r"\def\sym#1{\ifmmode^{#1}\else\(^{#1}\)\fi}",
+        r"\begin{table}[htbp]\centering",
+        rf"\caption{{{title}}}",
+        rf"\begin{{tabular}}{{l*{{{ncol}}}{{c}}}}",
+        r"\toprule",
+        "                    &" + "&".join(f"\\multicolumn{{1}}{{c}}{{({i + 1})}}" for i in range(ncol)) + "\\\\",
+        "                    &" + "&".join(f"\\multicolumn{{1}}{{c}}{{{_tex(r.spec.y)}}}" for r in results) + "\\\\",
+        r"\midrule",
+    ]
+    for term in terms:
+        bl, sl = [], []
+        for r in results:
+            if term not in r.names:
+                bl.append(''), sl.append('')
+                continue
+            i = r.names.index(term)
+            if term in r.omitted:
+                bl.append('0'), sl.append('(.)')
+            else:
+                bl.append(f"{f(r.b[i])}\\sym{{{_stars(r.p[i])}}}" if _stars(r.p[i]) else f(r.b[i]))
+                sl.append(f"({f(r.se[i])})" if np.isfinite(r.se[i]) else '')
+        lines.append(f"{_tex(term):<20}&" + "&".join(f"{v:>12}" for v in bl) + "\\\\")
+        lines.append(f"{'':<20}&" + "&".join(f"{v:>12}" for v in sl) + "\\\\")
+        lines.append(r"[1em]")
+    lines += [
+        r"\midrule",
+        f"{'Observations':<20}&" + "&".join(f"{r.N:>12}" for r in results) + "\\\\",
+        r"\bottomrule",
+        r"\multicolumn{" + str(ncol + 1) + r"}{l}{\footnotesize Standard errors in parentheses}\\",
+        r"\multicolumn{" + str(ncol + 1) + r"}{l}{\footnotesize \sym{*} \(p<0.10\), \sym{**} \(p<0.05\), \sym{***} \(p<0.01\)}\\",
+        r"\end{tabular}",
+        r"\end{table}",
+        r"}",
+    ]
+    with open(path, 'w') as fh:
+        fh.write("\n".join(lines) + "\n")
@@ -0,0 +1,160 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Hot-path events for the WRDS and DuckDB stages (chunk fetch latency,
+         DuckDB profiles, spill, memory high-water marks) in logs/events.jsonl
+Version: 1
+'''
+
+# Import packages
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import runlog as rl
+
+PAGE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb():
+    '''Current resident set of this process (Linux /proc), in MB.'''
+    try:
+        with open('/proc/self/statm') as fh:
+            return round(int(fh.read().split()[1]) * PAGE / 2**20, 1)
+    except OSError:
+        return None
+
+
+def max_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+# ── Probe ──────────────────────────────────────────────────────────────────────
+class Probe:
+    '''Structured events for one script run, appended to <log_dir>/events.jsonl.
+
+    Under pipeline.py the run id, stage name and log directory come from the
+    PIPELINE_RUN / PIPELINE_STAGE / PIPELINE_LOG_DIR environment, so events
+    line up with the stage records in runs.jsonl; run by hand, the script
+    gets its own run id.
+    '''
+
+    def __init__(self, log_dir, stage=None):
+        log_dir = os.environ.get("PIPELINE_LOG_DIR", log_dir)
+        self.log = rl.RunLog(os.path.join(log_dir, "events.jsonl"))
+        self.run = os.environ.get("PIPELINE_RUN") or rl.new_run_id()
+        self.stage = (os.environ.get("PIPELINE_STAGE") or stage
+                      or os.path.splitext(os.path.basename(sys.argv[0]))[0])
+        self.profile_dir = os.path.join(log_dir, "profiles", self.run)
+
+    def event(self, kind, **fields):
+        self.log.write({'run': self.run, 'stage': self.stage, 'kind': kind,
+                        'time': datetime.now().isoformat(timespec='milliseconds'),
+                        'rss_mb': rss_mb(), 'max_rss_mb': max_rss_mb(), **fields})
+
+    # ── DuckDB ─────────────────────────────────────────────────────────────────
+    def sql(self, con, sql, label):
+        '''Run one statement (CTAS, COPY, ...) with DuckDB's JSON profiler on.
+
+        The full profile (the EXPLAIN ANALYZE tree with per-operator timings
+        and cardinalities) is kept in profiles/<run>/<stage>.<label>.json; the
+        event carries latency, rows written, the buffer-memory high-water mark,
+        the peak size of temp_directory (spill) and the slowest operators.
+        '''
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{self.stage}.{label}.json")
+        con.execute("PRAGMA enable_profiling='json';")
+        con.execute(f"PRAGMA profiling_output='{path}';")
+        t0 = time.perf_counter()
+        try:
+            out = con.execute(sql)
+        finally:
+            wall = time.perf_counter() - t0
+            con.execute("PRAGMA disable_profiling;")
+        limit, = con.execute("SELECT current_setting('memory_limit')").fetchone()
+        self.event('duckdb', label=label, wall_s=round(wall, 3), memory_limit=limit,
+                   profile=path, **profile_summary(path))
+        return out
+
+    # ── WRDS ───────────────────────────────────────────────────────────────────
+    def chunk(self, shard, part, rows, fetch_s, write_s, nbytes):
+        '''One raw_sql chunk: time waiting on WRDS vs time writing it out.'''
+        self.event('wrds_chunk', shard=shard, part=part, rows=rows,
+                   fetch_s=round(fetch_s, 3), write_s=round(write_s, 3),
+                   rows_per_s=round(rows / fetch_s) if fetch_s > 0 else None, bytes=nbytes)
+
+
+# Sink operators report one row (the count); the rows they wrote are their input's
+SINKS = {'CREATE_TABLE_AS', 'COPY_TO_FILE', 'INSERT', 'BATCH_CREATE_TABLE_AS',
+         'BATCH_COPY_TO_FILE'}
+
+
+def profile_summary(path, top=3):
+    '''Headline metrics of a DuckDB JSON profile and its slowest operators.'''
+    try:
+        with open(path) as fh:
+            prof = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    timing, sunk = defaultdict(float), []
+
+    def walk(node):
+        op = node.get('operator_type')
+        if op:
+            timing[op] += node.get('operator_timing', 0.0)
+        if op in SINKS:
+            sunk.append(sum(c.get('operator_cardinality', 0) for c in node.get('children', [])))
+        for child in node.get('children', []):
+            walk(child)
+    walk(prof)
+    total = sum(timing.values()) or 1.0
+    return {'latency_s': round(prof.get('latency', 0.0), 3),
+            'cpu_s': round(prof.get('cpu_time', 0.0), 3),
+            'rows': sunk[0] if sunk else prof.get('rows_returned'),
+            'rows_scanned': prof.get('cumulative_rows_scanned'),
+            'peak_buffer_mb': round(prof.get('system_peak_buffer_memory', 0) / 2**20, 1),
+            'spill_mb': round(prof.get('system_peak_temp_dir_size', 0) / 2**20, 1),
+            'top_operators': {op: round(t / total, 3) for op, t in
+                              sorted(timing.items(), key=lambda kv: -kv[1])[:top]}}
+
+
+# ── Report ─────────────────────────────────────────────────────────────────────
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def report(events):
+    '''WRDS fetch vs write per stage, and every profiled DuckDB statement.'''
+    chunks = defaultdict(list)
+    for e in events:
+        if e['kind'] == 'wrds_chunk':
+            chunks[e['stage']].append(e)
+    if chunks:
+        print(f"  WRDS  {'stage':<14}{'chunks':>8}{'rows':>14}{'fetch s':>10}{'write s':>10}"
+              f"{'rows/s':>10}{'p50 s':>8}{'p95 s':>8}{'peak MB':>9}")
+    for stage, cs in chunks.items():
+        rows = sum(c['rows'] for c in cs)
+        fetch = sum(c['fetch_s'] for c in cs)
+        write = sum(c['write_s'] for c in cs)
+        lat = [c['fetch_s'] for c in cs]
+        print(f"        {stage:<14}{len(cs):>8,}{rows:>14,}{fetch:>10,.1f}{write:>10,.1f}"
+              f"{rows / fetch if fetch else 0:>10,.0f}{_pct(lat, .5):>8.2f}{_pct(lat, .95):>8.2f}"
+              f"{max(c['max_rss_mb'] for c in cs):>9,.0f}")
+
+    queries = [e for e in events if e['kind'] == 'duckdb']
+    if queries:
+        print(f"  DuckDB {'stage':<13}{'statement':<16}{'wall s':>9}{'cpu s':>9}{'rows':>14}"
+              f"{'buffer MB':>11}{'limit':>11}{'spill MB':>10}  slowest operators")
+    for q in queries:
+        ops = ", ".join(f"{op} {share:.0%}" for op, share in q.get('top_operators', {}).items())
+        print(f"         {q['stage']:<13}{q['label']:<16}{q['wall_s']:>9,.1f}{q.get('cpu_s', 0):>9,.1f}"
+              f"{q.get('rows') or 0:>14,}{q.get('peak_buffer_mb', 0):>11,.0f}"
+              f"{q.get('memory_limit', ''):>11}{q.get('spill_mb', 0):>10,.0f}  {ops}")
@@ -0,0 +1,242 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: SQLite shard manifest and closdate watermarks for WRDS pulls
+Version: 6
+'''
+
+# Import packages
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# ── Schema ─────────────────────────────────────────────────────────────────────
+# One row per shard, keyed on (schema, suffix, period, grp), plus one row per
+# file the shard wrote. suffix is the WRDS table suffix and the output mode
+# ("s:parquet"); grp is the country-group tag ('' for unsharded pulls), with a
+# hash of the group's countries and the columns for the ORBIS pulls.
+DDL = """
+CREATE TABLE IF NOT EXISTS shards (
+  schema   TEXT NOT NULL,
+  suffix   TEXT NOT NULL,
+  period   TEXT NOT NULL,
+  grp      TEXT NOT NULL,
+  status   TEXT NOT NULL,          -- running / done / failed
+  rows     INTEGER DEFAULT 0,
+  bytes    INTEGER DEFAULT 0,
+  sha256   TEXT,
+  error    TEXT,
+  started  TEXT,
+  finished TEXT,
+  PRIMARY KEY (schema, suffix, period, grp)
+);
+CREATE TABLE IF NOT EXISTS files (
+  schema   TEXT NOT NULL,
+  suffix   TEXT NOT NULL,
+  period   TEXT NOT NULL,
+  grp      TEXT NOT NULL,
+  seq      INTEGER NOT NULL,
+  path     TEXT NOT NULL,
+  bytes    INTEGER NOT NULL,
+  sha256   TEXT NOT NULL,
+  PRIMARY KEY (schema, suffix, period, grp, seq)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+  size     TEXT NOT NULL,
+  ctryiso  TEXT NOT NULL,
+  closdate TEXT NOT NULL,          -- highest closdate in the Parquet store (ISO date)
+  updated  TEXT,
+  PRIMARY KEY (size, ctryiso)
+);
+"""
+
+
+def file_sha256(path, bufsize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(bufsize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class Manifest:
+    '''Shard status book-keeping shared by the extraction worker threads.
+
+    A shard is only marked `done` after its last chunk is on disk, with the row
+    count, total bytes and a content hash (sha256 over the per-file hashes in
+    write order). Anything else is re-fetched on the next run, after deleting
+    the files its previous attempt left behind.
+    '''
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self._lock = threading.Lock()
+        # 01 and 02 can run at the same time (pipeline.py `--with pulls`) and
+        # write the same file: wait for the other's lock, as stage_cache does
+        self._con  = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self._con.executescript(DDL)
+        self._con.commit()
+
+    # ── Queries ────────────────────────────────────────────────────────────────
+    def status(self, key):
+        row = self._con.execute(
+            "SELECT status FROM shards WHERE schema=? AND suffix=? AND period=? AND grp=?",
+            key).fetchone()
+        return row[0] if row else None
+
+    def files(self, key):
+        return self._con.execute(
+            "SELECT path, bytes, sha256 FROM files "
+            "WHERE schema=? AND suffix=? AND period=? AND grp=? ORDER BY seq",
+            key).fetchall()
+
+    def is_done(self, key, verify='size'):
+        '''True if the shard finished and its files still match the manifest.
+
+        verify='size' checks that every file exists with the recorded size;
+        verify='hash' also re-hashes the content.
+        '''
+        with self._lock:
+            if self.status(key) != 'done':
+                return False
+            files = self.files(key)
+        for path, nbytes, digest in files:
+            if not os.path.exists(path) or os.path.getsize(path) != nbytes:
+                return False
+            if verify == 'hash' and file_sha256(path) != digest:
+                return False
+        return True
+
+    # ── Updates ────────────────────────────────────────────────────────────────
+    def start(self, key):
+        '''Mark a shard as running and delete whatever an earlier attempt wrote.'''
+        with self._lock:
+            for path, _, _ in self.files(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._con.execute(
+                "DELETE FROM files WHERE schema=? AND suffix=? AND period=? AND grp=?", key)
+            self._con.execute(
+                "INSERT OR REPLACE INTO shards "
+                "(schema, suffix, period, grp, status, rows, bytes, started) "
+                "VALUES (?, ?, ?, ?, 'running', 0, 0, ?)",
+                (*key, _now()))
+            self._con.commit()
+
+    def retire(self, keys):
+        '''Drop the shards that share (schema, suffix, period) with one of
+        `keys` but are not among them, deleting their files. Returns how many.'''
+        keep = set(map(tuple, keys))
+        periods = {k[:3] for k in keep}
+        with self._lock:
+            rows = self._con.execute("SELECT schema, suffix, period, grp FROM shards").fetchall()
+            stale = [r for r in rows if r[:3] in periods and r not in keep]
+            for key in stale:
+                for path, _, _ in self.files(key):
+                    if os.path.exists(path):
+                        os.remove(path)
+                for table in ('files', 'shards'):
+                    self._con.execute(
+                        f"DELETE FROM {table} WHERE schema=? AND suffix=? AND period=? AND grp=?", key)
+            self._con.commit()
+        return len(stale)
+
+    def add_files(self, key, paths, rows):
+        '''Record the files written for one chunk.'''
+        entries = [(p, os.path.getsize(p), file_sha256(p)) for p in paths]
+        with self._lock:
+            seq = self._con.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM files "
+                "WHERE schema=? AND suffix=? AND period=? AND grp=?", key).fetchone()[0]
+            for i, (p, nbytes, digest) in enumerate(entries, start=seq + 1):
+                self._con.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, i, p, nbytes, digest))
+            self._con.execute(
+                "UPDATE shards SET rows = rows + ?, bytes = bytes + ? "
+                "WHERE schema=? AND suffix=? AND period=? AND grp=?",
+                (rows, sum(e[1] for e in entries), *key))
+            self._con.commit()
+
+    def finish(self, key):
+        with self._lock:
+            h = hashlib.sha256()
+            for _, _, digest in self.files(key):
+                h.update(digest.encode())
+            self._con.execute(
+                "UPDATE shards SET status='done', sha256=?, error=NULL, finished=? "
+                "WHERE schema=? AND suffix=? AND period=? AND grp=?",
+                (h.hexdigest(), _now(), *key))
+            self._con.commit()
+
+    def replace_files(self, old_paths, new_path):
+        '''Point every file entry on `old_paths` (or on `new_path` itself) at
+        `new_path`, e.g. after merge_delta folded a partition into one file,
+        so the shards that wrote those files stay done. Returns their keys.'''
+        paths = list(dict.fromkeys(list(old_paths) + [new_path]))
+        nbytes, digest = os.path.getsize(new_path), file_sha256(new_path)
+        with self._lock:
+            hit = self._con.execute(
+                "SELECT schema, suffix, period, grp, seq FROM files "
+                f"WHERE path IN ({','.join('?' * len(paths))}) "
+                "ORDER BY schema, suffix, period, grp, seq", paths).fetchall()
+            keys = list(dict.fromkeys(r[:4] for r in hit))
+            for key in keys:
+                seqs = [r[4] for r in hit if r[:4] == key]
+                where = "WHERE schema=? AND suffix=? AND period=? AND grp=? AND seq=?"
+                for seq in seqs[1:]:
+                    self._con.execute(f"DELETE FROM files {where}", (*key, seq))
+                self._con.execute(f"UPDATE files SET path=?, bytes=?, sha256=? {where}",
+                                  (new_path, nbytes, digest, *key, seqs[0]))
+                files = self.files(key)
+                h = hashlib.sha256()
+                for _, _, d in files:
+                    h.update(d.encode())
+                self._con.execute(
+                    "UPDATE shards SET bytes=?, sha256=CASE WHEN status='done' THEN ? END "
+                    "WHERE schema=? AND suffix=? AND period=? AND grp=?",
+                    (sum(f[1] for f in files), h.hexdigest(), *key))
+            self._con.commit()
+        return keys
+
+    def fail(self, key, err):
+        with self._lock:
+            self._con.execute(
+                "UPDATE shards SET status='failed', error=?, finished=? "
+                "WHERE schema=? AND suffix=? AND period=? AND grp=?",
+                (repr(err), _now(), *key))
+            self._con.commit()
+
+    # ── Watermarks ─────────────────────────────────────────────────────────────
+    def watermarks(self):
+        '''{(size, ctryiso): 'YYYY-MM-DD'} high-water marks on closdate.'''
+        with self._lock:
+            rows = self._con.execute("SELECT size, ctryiso, closdate FROM watermarks").fetchall()
+        return {(size, ctry): d for size, ctry, d in rows}
+
+    def set_watermark(self, size, ctryiso, closdate):
+        '''Raise the (size, ctryiso) watermark; it never moves backwards.'''
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO watermarks VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (size, ctryiso) DO UPDATE SET "
+                "closdate = MAX(closdate, excluded.closdate), updated = excluded.updated",
+                (size, ctryiso, str(closdate), _now()))
+            self._con.commit()
+
+    def summary(self):
+        return self._con.execute(
+            "SELECT status, COUNT(*), SUM(rows), SUM(bytes) FROM shards GROUP BY status"
+        ).fetchall()
+
+    def close(self):
+        self._con.close()
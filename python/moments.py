@@ -0,0 +1,250 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Streaming, mergeable cell moments (Welford/Chan) and quantile sketches
+         (t-digest) over a year-partitioned Parquet store: means, SDs, sums,
+         power sums, percentiles, HK terms
+Version: 2
+'''
+
+# Import packages
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+CELL = ['ind2', 'ctryiso', 'year']
+
+
+# ── Mergeable accumulators ─────────────────────────────────────────────────────
+def batch_moments(key_df, values):
+    '''Per-cell count, mean and M2 (sum of squared deviations) of one batch.'''
+    frame = key_df.assign(_v=values).dropna(subset=['_v'])
+    g = frame.groupby(list(key_df.columns), sort=False, dropna=False)['_v']
+    out = g.agg(['count', 'mean', 'var'])
+    out['m2'] = out.pop('var').fillna(0.0) * (out['count'] - 1)
+    return out.rename(columns={'count': 'n'})
+
+
+def chan_merge(a, b):
+    '''Combine two (n, mean, m2) frames indexed by cell (Chan et al.).'''
+    if a is None:
+        return b
+    a, b = a.align(b, join='outer', fill_value=0.0)
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, a['mean'] + delta * b['n'] / n, 0.0)
+        m2 = a['m2'] + b['m2'] + np.where(n > 0, delta**2 * a['n'] * b['n'] / n, 0.0)
+    return pd.DataFrame({'n': n, 'mean': mean, 'm2': m2}, index=a.index)
+
+
+def add_sums(a, b):
+    return b if a is None else a.add(b, fill_value=0.0)
+
+
+def _levels(frame):
+    return list(range(frame.index.nlevels))
+
+
+def chan_rollup(st):
+    '''Merge the (n, mean, m2) rows that share an index label, e.g. after the
+    cell index was cut down to a coarser grouping.'''
+    g = lambda s: s.groupby(level=_levels(st), sort=False, dropna=False).sum()
+    n = g(st['n'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = g(st['n'] * st['mean']) / n
+        dev = st['m2'] + st['n'] * (st['mean'] - mean.reindex(st.index).to_numpy())**2
+    return pd.DataFrame({'n': n, 'mean': mean.where(n > 0, 0.0), 'm2': g(dev)})
+
+
+# ── Mergeable quantile sketches ────────────────────────────────────────────────
+# A t-digest per cell: centroids (m = mean, w = weight) indexed by the cell,
+# at most delta + 1 per cell. Sketches of two batches, partitions or workers
+# merge by concatenating and compressing again, so percentiles come from one
+# pass without keeping the values. Accuracy is best in the tails (k1 scale).
+def _sorted_cells(d):
+    g = d.groupby(level=_levels(d), sort=False, dropna=False).ngroup().to_numpy()
+    m, w = d['m'].to_numpy(dtype=float), d['w'].to_numpy(dtype=float)
+    order = np.lexsort((m, g))
+    g, m, w = g[order], m[order], w[order]
+    first = np.r_[True, g[1:] != g[:-1]]
+    start = np.flatnonzero(first)
+    cum = np.cumsum(w)
+    rank = np.cumsum(first) - 1                     # cell number in sorted order
+    off = (cum - w)[start][rank]
+    tot = np.add.reduceat(w, start)[rank]
+    return order, rank, m, w, (cum - w / 2 - off) / tot, first
+
+
+def digest_compress(d, delta=200):
+    '''Merge neighbouring centroids of each cell into k1-scale buckets.'''
+    if d.empty:
+        return d
+    order, rank, m, w, q, _ = _sorted_cells(d)
+    k = np.floor(delta * (np.arcsin(np.clip(2 * q - 1, -1, 1)) / np.pi + 0.5))
+    brk = np.flatnonzero(np.r_[True, (rank[1:] != rank[:-1]) | (k[1:] != k[:-1])])
+    w_new = np.add.reduceat(w, brk)
+    return pd.DataFrame({'m': np.add.reduceat(w * m, brk) / w_new, 'w': w_new},
+                        index=d.index[order][brk])
+
+
+def digest(key_df, values, delta=200):
+    '''t-digest of one batch per cell (missing values skipped).'''
+    d = pd.DataFrame({'m': values, 'w': 1.0}, index=pd.MultiIndex.from_frame(key_df))
+    return digest_compress(d[d['m'].notna().to_numpy()], delta)
+
+
+def digest_merge(a, b, delta=200):
+    if a is None:
+        return b
+    return digest_compress(pd.concat([a, b]), delta)
+
+
+def digest_quantiles(d, percentiles):
+    '''Percentiles of every cell: linear between centroid midpoints, the
+    first / last centroid below / above them. A cell small enough to keep
+    every value gets the Hazen percentile ((i - 0.5) / n plotting positions).'''
+    if d.empty:
+        return pd.DataFrame({f"p{p}": [] for p in percentiles}, index=d.index[:0])
+    order, rank, m, w, q, first = _sorted_cells(d)
+    last = np.r_[rank[1:] != rank[:-1], True]
+    x = np.concatenate([2 * rank[first], 2 * rank + q, 2 * rank[last] + 1])
+    y = np.concatenate([m[first], m, m[last]])
+    o = np.argsort(x, kind='stable')
+    cells = np.arange(first.sum())
+    return pd.DataFrame({f"p{p}": np.interp(2 * cells + p / 100, x[o], y[o]) for p in percentiles},
+                        index=d.index[order][first])
+
+
+class CellAccumulator:
+    '''Running per-cell moments for one partition, fed batch by batch.
+
+    `moments`   : variables with Welford/Chan mean and variance
+    `sums`      : variables summed (missing treated as 0, count kept)
+    `powers`    : {name: (var, exponent)} sums of var**exponent over var > 0
+    `quantiles` : variables whose values are kept for exact cell percentiles
+    '''
+
+    def __init__(self, keys, moments, sums, powers, quantiles):
+        self.keys, self.moments, self.sums = keys, moments, sums
+        self.powers, self.quantiles = powers, quantiles
+        self.state = {v: None for v in moments}
+        self.totals = None
+        self.kept = []
+
+    def update(self, df):
+        key_df = df[self.keys]
+        for v in self.moments:
+            self.state[v] = chan_merge(self.state[v], batch_moments(key_df, df[v].to_numpy()))
+
+        cols = {}
+        for v in self.sums:
+            cols[f"sum_{v}"] = df[v].fillna(0.0)
+        for name, (v, p) in self.powers.items():
+            x = df[v].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cols[name] = np.where(x > 0, x**p, 0.0)
+        if cols:
+            frame = key_df.assign(**cols)
+            self.totals = add_sums(self.totals, frame.groupby(self.keys, sort=False, dropna=False).sum())
+
+        if self.quantiles:
+            self.kept.append(df[self.keys + self.quantiles])
+
+    def finalize(self, percentiles):
+        parts = []
+        for v, st in self.state.items():
+            if st is None:
+                continue
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sd = np.sqrt(st['m2'] / (st['n'] - 1)).where(st['n'] > 1)
+            parts.append(pd.DataFrame({f"n_{v}": st['n'], f"mean_{v}": st['mean'].where(st['n'] > 0),
+                                       f"sd_{v}": sd}, index=st.index))
+        if self.totals is not None:
+            parts.append(self.totals)
+        if self.kept and percentiles:
+            kept = pd.concat(self.kept, ignore_index=True)
+            g = kept.groupby(self.keys, sort=False, dropna=False)
+            for v in self.quantiles:
+                q = g[v].quantile([p / 100 for p in percentiles]).unstack()
+                q.columns = [f"p{p}_{v}" for p in percentiles]
+                parts.append(q)
+        out = pd.concat(parts, axis=1) if parts else pd.DataFrame()
+        return out.reset_index()
+
+
+# ── Streaming over the year partitions ─────────────────────────────────────────
+def year_partitions(root):
+    '''[(year, path)] for a hive store laid out as root/year=YYYY/.'''
+    out = []
+    for path in sorted(glob.glob(os.path.join(root, "year=*"))):
+        m = re.search(r"year=(\d+)$", path)
+        if m:
+            out.append((int(m.group(1)), path))
+    return out
+
+
+def present_columns(root):
+    parts = year_partitions(root)
+    return set(ds.dataset(parts[0][1], format='parquet').schema.names) if parts else set()
+
+
+def scan(path, columns, batch_size=1_000_000):
+    '''Record batches of one partition, as pandas frames, projected to `columns`.'''
+    for batch in ds.dataset(path, format='parquet').to_batches(columns=columns,
+                                                               batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+def log_columns(df, logs):
+    '''ln_<v> for each v in `logs` (missing for v <= 0, as Stata's ln()).'''
+    for v in logs:
+        x = df[v].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[f"ln_{v}"] = np.where(x > 0, np.log(x), np.nan)
+    return df
+
+
+def hk_inputs(df, sigma, tfpq, tfpr, revenue, capital, labour, alpha):
+    '''Row-level pieces of the Hsieh-Klenow gain that sum within a cell.
+
+    With A = TFPQ and a cell TFPR_bar that is constant within the cell,
+        TFP_s   = (TFPR_bar^(sigma-1) * sum (A/TFPR)^(sigma-1))^(1/(sigma-1))
+        TFP*_s  = (sum A^(sigma-1))^(1/(sigma-1))
+    and TFPR_bar = sum PY / (sum K^alpha sum L^(1-alpha)), so a single pass
+    needs sum A^(sigma-1), sum (A/TFPR)^(sigma-1) and the revenue, capital
+    and labour totals over the rows where all of them are valid.
+    '''
+    ok = (df[[tfpq, tfpr, revenue, capital, labour, alpha]].notna().all(axis=1)
+          & (df[tfpq] > 0) & (df[tfpr] > 0)).to_numpy()
+    e = sigma - 1
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        df['hk_A'] = np.where(ok, df[tfpq].to_numpy(dtype=float)**e, 0.0)
+        df['hk_AR'] = np.where(ok, (df[tfpq] / df[tfpr]).to_numpy(dtype=float)**e, 0.0)
+    for name, v in (('hk_PY', revenue), ('hk_K', capital), ('hk_L', labour), ('hk_alpha', alpha)):
+        df[name] = np.where(ok, df[v].to_numpy(dtype=float), 0.0)
+    df['hk_n'] = ok.astype(float)
+    return df
+
+
+def hk_gain(cells, sigma):
+    '''Cell TFPR_bar, actual and efficient TFP and the HK gain (%).'''
+    e = sigma - 1
+    a = cells['sum_hk_alpha'] / cells['sum_hk_n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tfpr_bar = cells['sum_hk_PY'] / (cells['sum_hk_K']**a * cells['sum_hk_L']**(1 - a))
+        tfp = (tfpr_bar**e * cells['sum_hk_AR'])**(1 / e)
+        tfp_eff = cells['sum_hk_A']**(1 / e)
+    cells['hk_alpha'] = a
+    cells['hk_tfpr_bar'] = tfpr_bar
+    cells['hk_tfp'] = tfp
+    cells['hk_tfp_eff'] = tfp_eff
+    cells['hk_gain'] = 100 * (tfp_eff / tfp - 1)
+    return cells
@@ -0,0 +1,150 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Query layer over the cleaned year-partitioned Parquet store: a row-group
+         index written by 04_clean_db.py, and load_panel() that prunes files and
+         row groups on country / NACE division / year and reads only the columns asked
+Version: 1
+'''
+
+# Import packages
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import moments as mo
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR  = "/scratch/[your_group]/wrds_batch"
+CLEAN_DIR = os.path.join(DATA_DIR, "orbis_em_2005_24_cleaned_by_year")   # from 04_clean_db.py
+INDEX     = "_index.parquet"      # in CLEAN_DIR; '_' keeps it out of the */*.parquet scans
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+# The sort key of every year partition (04_clean_db.py), and the columns whose
+# row-group min/max go in the index
+CLUSTER = ['ctryiso', 'nace2', 'firm_id']
+THREADS = int(os.environ.get("NSLOTS", 4))
+
+
+# ── Index ──────────────────────────────────────────────────────────────────────
+def build_index(root=CLEAN_DIR):
+    '''One row per (file, row group): year, rows and the min/max of CLUSTER,
+    from the Parquet footers (no data pages are read).'''
+    rows = []
+    for year, path in mo.year_partitions(root):
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".parquet"):
+                continue
+            meta = pq.ParquetFile(os.path.join(path, name)).metadata
+            cols = {meta.schema.column(i).name: i for i in range(meta.num_columns)}
+            for g in range(meta.num_row_groups):
+                rg = meta.row_group(g)
+                row = {'year': year, 'file': os.path.join(os.path.basename(path), name),
+                       'row_group': g, 'rows': rg.num_rows}
+                for c in CLUSTER:
+                    st = rg.column(cols[c]).statistics if c in cols else None
+                    ok = st is not None and st.has_min_max
+                    row[f"{c}_min"] = st.min if ok else None
+                    row[f"{c}_max"] = st.max if ok else None
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_index(root=CLEAN_DIR):
+    idx = build_index(root)
+    idx.to_parquet(os.path.join(root, INDEX), index=False)
+    return idx
+
+
+def read_index(root=CLEAN_DIR):
+    '''The stored index, or one built from the footers for a store written
+    before 04_clean_db.py kept it.'''
+    path = os.path.join(root, INDEX)
+    return pd.read_parquet(path) if os.path.exists(path) else build_index(root)
+
+
+def prune(idx, countries=None, industries=None, years=None):
+    '''Row groups whose [min, max] can hold a selected value. A row group
+    without statistics is always kept.'''
+    keep = np.ones(len(idx), dtype=bool)
+    if years is not None:
+        keep &= idx['year'].isin(list(years)).to_numpy()
+    for col, values in (('ctryiso', countries), ('nace2', industries)):
+        if values is None or f"{col}_min" not in idx:
+            continue
+        lo, hi = (idx[f"{col}_{s}"].astype('string' if col == 'ctryiso' else float)
+                  for s in ('min', 'max'))
+        hit = np.zeros(len(idx), dtype=bool)
+        for v in values:
+            hit |= ((lo <= v) & (hi >= v)).to_numpy(dtype=bool, na_value=False)
+        keep &= hit | lo.isna().to_numpy()
+    return idx[keep]
+
+
+# ── Query ──────────────────────────────────────────────────────────────────────
+def _read(root, file, row_groups, year, columns, mask):
+    tab = pq.ParquetFile(os.path.join(root, file), memory_map=True) \
+            .read_row_groups(row_groups, columns=columns, use_threads=False)
+    if mask is not None:
+        tab = tab.filter(mask(tab))
+    return tab.append_column('year', pa.array(np.full(tab.num_rows, year, dtype=np.int64)))
+
+
+def load_panel(countries=None, industries=None, years=None, columns=None, root=CLEAN_DIR,
+               threads=THREADS):
+    '''Firm-years of the cleaned store as one pyarrow Table.
+
+    countries : ISO2 codes (ctryiso); industries : 2-digit NACE divisions (nace2);
+    years : fiscal years; columns : variables to read (None = all). None means
+    no restriction. Only the row groups the index cannot rule out are read,
+    only for the requested columns, then filtered exactly; 'year' comes from
+    the partition. The Table shares the Parquet reader's buffers; use
+    to_numpy() for NumPy views. Rows come in (year, ctryiso, nace2, firm_id)
+    order.
+    '''
+    full = read_index(root)
+    idx = prune(full, countries, industries, years)
+    if columns is not None:
+        columns = [c for c in dict.fromkeys(columns) if c != 'year']
+    read_cols = columns
+    conds = [(c, v) for c, v in (('ctryiso', countries), ('nace2', industries)) if v is not None]
+    if columns is not None:
+        read_cols = columns + [c for c, _ in conds if c not in columns]
+
+    def mask(tab):
+        m = None
+        for c, v in conds:
+            hit = pc.fill_null(pc.is_in(tab[c], value_set=pa.array(list(v), type=tab[c].type)), False)
+            m = hit if m is None else pc.and_(m, hit)
+        return m
+
+    tasks = [(root, f, g['row_group'].tolist(), int(g['year'].iloc[0]), read_cols,
+              mask if conds else None) for f, g in idx.groupby('file', sort=True)]
+    if not tasks:       # nothing selected: an empty Table with the store's schema
+        tasks = [(root, full['file'].iloc[0], [], 0, read_cols, None)]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        out = pa.concat_tables(pool.map(lambda a: _read(*a), tasks))
+    if columns is not None:
+        out = out.select(columns + ['year'])
+    return out
+
+
+def to_numpy(table, columns=None):
+    '''{column: ndarray}. A numeric column of one chunk without nulls is a view
+    on the Arrow buffer; anything else is copied once (nulls become NaN).'''
+    out = {}
+    for c in columns or table.column_names:
+        col = table[c]
+        if col.num_chunks == 1 and col.null_count == 0 and pa.types.is_primitive(col.type):
+            out[c] = col.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            out[c] = col.to_numpy()
+    return out
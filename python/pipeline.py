@@ -0,0 +1,444 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: One entry point for the Python pipeline: a DAG of stages 01-15 run on
+         a local worker pool or as SGE/PBS job arrays, recomputing only stale
+         stages (content-addressed cache) and logging per-stage telemetry
+Version: 11
+
+Usage:
+  python pipeline.py plan   [--from STAGE] [--to STAGE] [--with STAGE|pulls ...] [--force]
+  python pipeline.py run    [--from ...] [--jobs N] [--only STAGE] [--run-id ID]
+  python pipeline.py submit [--from ...] [--scheduler sge|pbs]
+  python pipeline.py report [--run-id ID]
+  python pipeline.py status
+  python pipeline.py gc     [--max-gb N]
+
+Optional stages (the WRDS pulls 01/02/06, the CSV-mode 03, the CSV export
+05, the IO alpha builder 12, the scenario grid 13 and the Compustat EFD 14)
+only run when named with --with (or as --from/--to/--only). Otherwise the
+pulls' outputs are treated as external inputs. The pulls are not cached: they
+resume through manifest.sqlite, so running them again is cheap.
+'''
+
+# Import packages
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import instrument as ins
+import runlog as rl
+import stage_cache as sc
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+DATA_DIR   = "/scratch/[your_group]/wrds_batch"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR  = os.path.join(DATA_DIR, "stage_cache")
+LOG_DIR    = os.path.join(DATA_DIR, "logs")              # <stage>.log, runs.jsonl, events.jsonl
+JOB_DIR    = os.path.join(DATA_DIR, "jobs")              # generated array scripts
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+CACHE_MAX_GB = 500            # LRU eviction beyond this (materialised outputs are kept)
+JOBS         = int(os.environ.get("NSLOTS", 4))   # concurrent stages for `run`
+SCHEDULER    = "sge"          # "sge" (qsub -t / -hold_jid) or "pbs" (qsub -J / depend=afterok)
+EMAIL        = "[email address you registered as username in WRDS]"
+
+# ── Stages ─────────────────────────────────────────────────────────────────────
+# script  : the stage's script in SCRIPT_DIR (hashed with its local modules)
+# inputs  : external inputs under DATA_DIR (files, directories or globs)
+# after   : upstream stages; they run first when they are part of the run
+# outputs : what the stage writes under DATA_DIR; removed before a cached stage runs
+# cache   : False for the resumable WRDS pulls (always run, never removed)
+# optional: only part of a run when asked for (--with / --from / --to / --only)
+# slots   : cores to request for the stage's array job, as in its .sh wrapper
+PULLS = ['pull_small', 'pull_medlarge', 'compustat']
+
+STAGES = {
+    'pull_small':    dict(script='01_orbis_batch_small.py', inputs=[], after=[],
+                          outputs=['orbis_dataset'], cache=False, optional=True),
+    'pull_medlarge': dict(script='02_orbis_batch_medlarge.py', inputs=[], after=[],
+                          outputs=['orbis_dataset'], cache=False, optional=True),
+    'compustat':     dict(script='06_compustat_batch.py', inputs=[], after=[],
+                          outputs=['../wrds_compustat/compustat_parquet'],
+                          cache=False, optional=True),
+    'append':        dict(script='03_append_parquet.py',
+                          inputs=['orbis_em_*_part*.csv'],
+                          after=['pull_small', 'pull_medlarge'],
+                          outputs=['orbis_parquet'], optional=True),
+    'clean':         dict(script='04_clean_db.py',
+                          inputs=['orbis_dataset', 'orbis_parquet', 'gdp_deflator_long.csv'],
+                          after=['pull_small', 'pull_medlarge', 'append'],
+                          outputs=['orbis_em_2005_24_cleaned_by_year', 'orbis_firms.parquet']),
+    'csv':           dict(script='05_parquet_to_csv.py', inputs=[], after=['clean'],
+                          outputs=['orbis_em_2005_24_cleaned_by_year_csv'], optional=True),
+    'alpha':         dict(script='12_io_alpha.py', inputs=['alpha/alpha.xlsx'], after=[],
+                          outputs=['alpha/alpha_io.parquet'], optional=True),
+    'tfpr_real':     dict(script='07_tfpr_real.py',
+                          inputs=['alpha/alpha_io.parquet', 'alpha/alpha_*.dta'],
+                          after=['clean', 'alpha'],
+                          outputs=['orbis_clean']),
+    'finance':       dict(script='08_finance_params.py',
+                          inputs=[],
+                          after=['tfpr_real'],
+                          outputs=[f"{n}.{ext}" for n in ('fin_param_ctry', 'fin_param_ctry_1',
+                                                          'fin_param', 'fin_param_1',
+                                                          'fin_param_resolved')
+                                   for ext in ('parquet', 'dta')] + ['fin_fits.parquet']),
+    'sigma':         dict(script='09_sigma.py',
+                          inputs=[],
+                          after=['tfpr_real'],
+                          outputs=['sigma_loss_curve.parquet', 'sigma_loss_curve.dta',
+                                   'sigma_estimates.parquet']),
+    'efd':           dict(script='14_compustat_efd.py',
+                          inputs=['../wrds_compustat/compustat_parquet', 'crosswalk/naics_nace.csv'],
+                          after=['compustat'],
+                          outputs=['comp_clean.parquet', 'comp_clean.dta', 'efd_naics.parquet',
+                                   'efd_nace.parquet', 'efd_nace_year.parquet'], optional=True),
+    'cells':         dict(script='11_cell_moments.py',
+                          inputs=['efd_nace.parquet'],
+                          after=['tfpr_real', 'efd'],
+                          outputs=['orbis_cells.parquet'], slots=4),
+    'scenarios':     dict(script='13_scenarios.py',
+                          inputs=[],
+                          after=['tfpr_real', 'finance'],
+                          outputs=['scenario_gains.parquet'], slots=4, optional=True),
+    'desc':          dict(script='15_desc_stats.py',
+                          inputs=[],
+                          after=['tfpr_real'],
+                          outputs=['desc_stats'], slots=4, optional=True),
+    'regression':    dict(script='10_regression.py',
+                          inputs=['orbis_final', 'orbis_final.parquet', 'orbis_final.dta',
+                                  'bank_zscore.dta', 'stringency.dta', 'efd_nace.parquet'],
+                          after=['efd'],
+                          outputs=['tables'], slots=8),
+}
+for cfg in STAGES.values():
+    cfg.setdefault('cache', True)
+    cfg.setdefault('optional', False)
+    cfg.setdefault('slots', 1)
+    cfg.setdefault('mem', '48G')
+AFTER = {s: cfg['after'] for s, cfg in STAGES.items()}
+
+
+def downstream(stage):
+    out, todo = set(), [stage]
+    while todo:
+        s = todo.pop()
+        out.add(s)
+        todo += [t for t, cfg in STAGES.items() if s in cfg['after'] and t not in out]
+    return out
+
+
+def upstream(stage):
+    out, todo = set(), [stage]
+    while todo:
+        s = todo.pop()
+        out.add(s)
+        todo += [u for u in STAGES[s]['after'] if u not in out]
+    return out
+
+
+def select(start=None, stop=None, extra=(), only=None):
+    '''Stages of a run, in topological order (the order of STAGES).'''
+    if only:
+        return [only]
+    extra = set(PULLS if 'pulls' in extra else []) | set(extra) | {start, stop}
+    chosen = {s for s, cfg in STAGES.items() if not cfg['optional'] or s in extra}
+    if start:
+        chosen &= downstream(start)
+    if stop:
+        chosen &= upstream(stop)
+    return [s for s in STAGES if s in chosen]
+
+
+def levels(chosen):
+    '''DAG depth of each chosen stage, counting only edges inside the run.'''
+    depth = {}
+    for s in chosen:
+        depth[s] = 1 + max((depth[u] for u in STAGES[s]['after'] if u in depth), default=-1)
+    return depth
+
+
+def paths(names):
+    out = []
+    for name in names:
+        full = os.path.normpath(os.path.join(DATA_DIR, name))
+        out += sorted(glob.glob(full)) if any(c in name for c in '*?[') else [full]
+    return out
+
+
+# ── Planning ───────────────────────────────────────────────────────────────────
+def stage_parts(stage, keys):
+    cfg = STAGES[stage]
+    script = os.path.join(SCRIPT_DIR, cfg['script'])
+    params = sc.script_params(script)
+    recorded = sc.recorded_hashes(os.path.join(DATA_DIR, "manifest.sqlite"))
+    inputs = {name: sc.fingerprint(p, recorded) for name in cfg['inputs'] for p in paths([name])}
+    key, parts = sc.stage_key(sc.code_hash(script), params, inputs,
+                              {u: keys[u] for u in cfg['after'] if u in keys})
+    return key, {**parts, 'param_values': params, 'script': cfg['script']}
+
+
+def why(old, new):
+    '''Which parts of the key moved since the materialised run.'''
+    if old is None:
+        return "no previous run"
+    reasons = []
+    if old['code'] != new['code']:
+        changed = {k for k in set(old['param_values']) | set(new['param_values'])
+                   if old['param_values'].get(k) != new['param_values'].get(k)}
+        reasons.append(f"params {sorted(changed)}" if changed else "code")
+    for part in ('inputs', 'upstream'):
+        moved = sorted(k for k in set(old[part]) | set(new[part]) if old[part].get(k) != new[part].get(k))
+        if moved:
+            reasons.append(f"{part} {moved}")
+    return ", ".join(reasons) or "outputs missing"
+
+
+def upstream_keys(cache, chosen):
+    '''Keys of the cached stages the run reads but does not run: the recorded
+    key if the stage was materialised by the pipeline, else computed. Optional
+    stages left out of the run count as external inputs, not as upstream.'''
+    keys = {}
+    for stage in STAGES:
+        cfg = STAGES[stage]
+        if stage in chosen or not cfg['cache'] or cfg['optional'] \
+                or not any(stage in upstream(c) for c in chosen):
+            continue
+        keys[stage] = cache.current(stage) or stage_parts(stage, keys)[0]
+    return keys
+
+
+def decide(cache, stage, keys, force=False):
+    '''(key, action, reason, meta) for one stage given its upstream keys.'''
+    if not STAGES[stage]['cache']:
+        return None, 'run', "resumable pull, not cached", {}
+    key, meta = stage_parts(stage, keys)
+    recorded = cache.current(stage)
+    on_disk = all(os.path.exists(p) for p in paths(STAGES[stage]['outputs']))
+    if force:
+        return key, 'run', "forced", meta
+    if recorded == key and on_disk:
+        return key, 'fresh', "up to date", meta
+    old = cache.meta(recorded) if recorded else None
+    return key, ('restore' if cache.has(key) else 'run'), why(old, meta), meta
+
+
+def plan(cache, chosen, force=False):
+    '''[(stage, key, action, reason)] as far as it can be known before running.
+
+    Keys only depend on code, parameters, external inputs and upstream keys,
+    so the plan is exact, except downstream of a pull in the run, whose new
+    data is only fingerprinted once the pull has finished.
+    '''
+    keys, steps, blocked = upstream_keys(cache, chosen), [], set()
+    for stage in chosen:
+        if any(u in blocked or (u in chosen and not STAGES[u]['cache'])
+               for u in STAGES[stage]['after']):
+            blocked.add(stage)
+            steps.append((stage, None, 'pending', "decided after the pulls finish"))
+            continue
+        key, action, reason, _ = decide(cache, stage, keys, force)
+        if key:
+            keys[stage] = key
+        steps.append((stage, key, action, reason))
+    return steps
+
+
+# ── Execution ──────────────────────────────────────────────────────────────────
+def finish(cache, log, run_id, stage, key, action, meta, t0, start, ru=None, rc=0):
+    '''Cache a finished stage and write its telemetry record.'''
+    cfg = STAGES[stage]
+    outputs = paths(cfg['outputs'])
+    wall = round(time.time() - t0, 1)
+    if action == 'run' and rc == 0 and cfg['cache']:
+        meta['seconds'] = wall
+        cache.put(key, stage, outputs, meta)
+    if rc == 0 and key:
+        cache.set_current(stage, key)
+    inputs = sorted(set(paths(cfg['inputs']))
+                    | {p for u in cfg['after'] for p in paths(STAGES[u]['outputs'])})
+    log.write({'run': run_id, 'stage': stage, 'action': action, 'key': key,
+               'start': start, 'end': datetime.now().isoformat(timespec='seconds'),
+               'wall_s': wall, 'returncode': rc, **(rl.usage(ru) if ru else {}),
+               'rows_in': rl.parquet_rows(inputs) if action == 'run' else None,
+               'rows_out': rl.parquet_rows(outputs) if rc == 0 else None,
+               'bytes_out': rl.disk_bytes(outputs) if rc == 0 else None})
+    print(f"[{stage}] {'done' if rc == 0 else f'FAILED (exit {rc})'} in {wall:,.0f}s"
+          + ("" if action != 'run' else f", log {os.path.join(LOG_DIR, stage + '.log')}"))
+
+
+def execute(cache, chosen, jobs=JOBS, force=False, run_id=None):
+    '''Run the chosen stages, up to `jobs` at a time, each as soon as the
+    stages it reads from have finished.
+
+    Fresh and restorable stages complete inline. Every other stage is a
+    subprocess writing to logs/<stage>.log; os.wait4 reaps whichever finishes
+    first and returns its rusage (CPU time, peak RSS, blocks written).
+    '''
+    run_id = run_id or rl.new_run_id()
+    log = rl.RunLog(os.path.join(LOG_DIR, "runs.jsonl"))
+    keys = upstream_keys(cache, chosen)
+    todo, running, state = list(chosen), {}, {}
+    print(f"run {run_id}: {', '.join(chosen)} on {jobs} worker(s)")
+
+    while todo or running:
+        for stage in list(todo):
+            deps = [u for u in STAGES[stage]['after'] if u in chosen]
+            if any(state.get(u) in ('failed', 'skipped') for u in deps):
+                todo.remove(stage)
+                state[stage] = 'skipped'
+                print(f"[{stage}] skipped: an upstream stage failed")
+                continue
+            if len(running) >= jobs or not all(state.get(u) == 'done' for u in deps):
+                continue
+            todo.remove(stage)
+            key, action, reason, meta = decide(cache, stage, keys, force)
+            keys.update({stage: key} if key else {})
+            print(f"[{stage}] {action} ({reason})" + (f"  key {key[:12]}" if key else ""))
+            t0, start = time.time(), datetime.now().isoformat(timespec='seconds')
+            if action in ('fresh', 'restore'):
+                if action == 'restore':
+                    cache.restore(key, paths(STAGES[stage]['outputs']))
+                finish(cache, log, run_id, stage, key, action, meta, t0, start)
+                state[stage] = 'done'
+                continue
+            if STAGES[stage]['cache']:
+                cache.clear_current(stage)
+                for p in paths(STAGES[stage]['outputs']):
+                    sc.remove(p)
+            os.makedirs(LOG_DIR, exist_ok=True)
+            with open(os.path.join(LOG_DIR, f"{stage}.log"), 'w') as out:
+                env = {**os.environ, 'PIPELINE_RUN': run_id, 'PIPELINE_STAGE': stage,
+                       'PIPELINE_LOG_DIR': LOG_DIR}
+                proc = subprocess.Popen([sys.executable, STAGES[stage]['script']], cwd=SCRIPT_DIR,
+                                        env=env, stdout=out, stderr=subprocess.STDOUT)
+            running[proc.pid] = (stage, key, action, meta, t0, start, proc)
+
+        if not running:
+            continue
+        pid, status, ru = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        stage, key, action, meta, t0, start, proc = running.pop(pid)
+        proc.returncode = rc = os.waitstatus_to_exitcode(status)
+        finish(cache, log, run_id, stage, key, action, meta, t0, start, ru, rc)
+        state[stage] = 'done' if rc == 0 else 'failed'
+
+    for stage, key, nbytes in cache.evict():
+        print(f"evicted {stage} {key[:12]} ({nbytes / 1e9:,.2f} GB)")
+    report(run_id)
+    return 0 if all(v == 'done' for v in state.values()) else 1
+
+
+# ── Job arrays ─────────────────────────────────────────────────────────────────
+def array_script(scheduler, run_id, k, stages):
+    '''One array job per DAG level; task i runs the level's i-th stage through
+    `pipeline.py run --only`, so the cache and the run log still apply.'''
+    slots = max(STAGES[s]['slots'] for s in stages)
+    mem = max((STAGES[s]['mem'] for s in stages), key=lambda m: int(m.rstrip('G')))
+    n = len(stages)
+    if scheduler == 'sge':
+        header = [f"#$ -cwd", f"#$ -pe onenode {slots}", f"#$ -l m_mem_free={mem}",
+                  f"#$ -l h_vmem={mem}", f"#$ -t 1-{n}", "#$ -m abe", f"#$ -M {EMAIL}",
+                  f"#$ -N orbis_L{k}"]
+        index = "$SGE_TASK_ID"
+    else:
+        header = [f"#PBS -N orbis_L{k}", f"#PBS -l select=1:ncpus={slots}:mem={mem.lower()}b",
+                  "#PBS -m abe", f"#PBS -M {EMAIL}"] + ([f"#PBS -J 1-{n}"] if n > 1 else [])
+        index = "${PBS_ARRAY_INDEX:-1}"
+    return "\n".join(["#!/bin/bash", *header, "",
+                      f"STAGES=({' '.join(stages)})",
+                      f"stage=${{STAGES[$(({index} - 1))]}}",
+                      f"cd {SCRIPT_DIR}",
+                      f'python3 pipeline.py run --only "$stage" --run-id {run_id}', ""])
+
+
+def submit(chosen, scheduler):
+    '''Write jobs/<run>/level<k>.sh and a submit.sh that chains the levels.'''
+    run_id = rl.new_run_id()
+    out = os.path.join(JOB_DIR, run_id)
+    os.makedirs(out, exist_ok=True)
+    depth = levels(chosen)
+    lines = ["#!/bin/bash", 'cd "$(dirname "$0")"', "jid="]
+    for k in range(max(depth.values()) + 1):
+        stages = [s for s in chosen if depth[s] == k]
+        with open(os.path.join(out, f"level{k}.sh"), 'w') as fh:
+            fh.write(array_script(scheduler, run_id, k, stages))
+        if scheduler == 'sge':
+            hold = '${jid:+-hold_jid $jid}'
+            lines.append(f"jid=$(qsub -terse {hold} level{k}.sh | cut -d. -f1)")
+        else:
+            hold = '${jid:+-W depend=afterok:$jid}'
+            lines.append(f"jid=$(qsub {hold} level{k}.sh)")
+        lines.append(f'echo "level {k} ({", ".join(stages)}): job $jid"')
+    with open(os.path.join(out, "submit.sh"), 'w') as fh:
+        fh.write("\n".join(lines) + "\n")
+    for name in os.listdir(out):
+        os.chmod(os.path.join(out, name), 0o755)
+    print(f"{max(depth.values()) + 1} array job(s) in {out}; submit with bash {out}/submit.sh")
+    print(f"then: python pipeline.py report --run-id {run_id}")
+
+
+def report(run_id=None):
+    '''Stage table and critical path, then the WRDS and DuckDB hot-path events.'''
+    records = rl.RunLog(os.path.join(LOG_DIR, "runs.jsonl")).records(run_id)
+    rl.report(records, AFTER)
+    run_id = run_id or (records[0]['run'] if records else None)
+    events = rl.RunLog(os.path.join(LOG_DIR, "events.jsonl")).records(run_id)
+    if events:
+        ins.report(events)
+
+
+def status(cache):
+    print(f"cache {CACHE_DIR}: {cache.size() / 1e9:,.2f} GB of {CACHE_MAX_GB} GB")
+    for stage, key, nbytes, nfiles, created, last_used, hits in cache.entries():
+        mark = '*' if cache.current(stage) == key else ' '
+        print(f" {mark} {stage:<13} {key[:12]}  {nbytes / 1e9:8.2f} GB  {nfiles:6,} files"
+              f"  created {created}  used {last_used}  hits {hits}")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.split('Usage:')[0].strip(),
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('command', choices=['plan', 'run', 'submit', 'report', 'status', 'gc'])
+    ap.add_argument('--from', dest='start', choices=list(STAGES))
+    ap.add_argument('--to', dest='stop', choices=list(STAGES))
+    ap.add_argument('--with', dest='extra', nargs='+', default=[],
+                    choices=[s for s, cfg in STAGES.items() if cfg['optional']] + ['pulls'])
+    ap.add_argument('--only', choices=list(STAGES), help="run one stage (array tasks)")
+    ap.add_argument('--force', action='store_true', help="recompute the selected stages")
+    ap.add_argument('--jobs', type=int, default=JOBS)
+    ap.add_argument('--scheduler', choices=['sge', 'pbs'], default=SCHEDULER)
+    ap.add_argument('--run-id')
+    ap.add_argument('--max-gb', type=float, default=CACHE_MAX_GB)
+    args = ap.parse_args()
+
+    cache = sc.StageCache(CACHE_DIR, DATA_DIR, CACHE_MAX_GB * 1e9)
+    chosen = select(args.start, args.stop, args.extra, args.only)
+    rc = 0
+    if args.command == 'status':
+        status(cache)
+    elif args.command == 'gc':
+        for stage, key, nbytes in cache.evict(args.max_gb * 1e9):
+            print(f"evicted {stage} {key[:12]} ({nbytes / 1e9:,.2f} GB)")
+        status(cache)
+    elif args.command == 'report':
+        report(args.run_id)
+    elif args.command == 'plan':
+        depth = levels(chosen)
+        for stage, key, action, reason in plan(cache, chosen, args.force):
+            print(f"L{depth[stage]} {stage:<13} {action:<8} {(key or '-')[:12]:<12}  {reason}")
+    elif args.command == 'submit':
+        submit(chosen, args.scheduler)
+    else:
+        rc = execute(cache, chosen, args.jobs, args.force, args.run_id)
+    cache.close()
+    sys.exit(rc)
@@ -0,0 +1,36 @@
+#!/bin/bash
+#$ -cwd
+#$ -pe onenode 8
+#$ -l m_mem_free=48G
+#$ -l h_vmem=48G
+#$ -m abe
+#$ -M [email address you registered as username in WRDS]
+#$ -N orbis_pipeline
+
+cd /scratch/[your group]/wrds_batch
+
+# Start fresh log
+echo "Starting pipeline at $(date)" > pipeline.log
+
+# 1) Check DuckDB version
+dbv=$(python3 - <<'PYCODE'
+import duckdb
+print(duckdb.__version__)
+PYCODE
+)
+if [ $? -ne 0 ]; then
+  echo "ERROR: Could not import duckdb!" &>> pipeline.log
+  exit 1
+fi
+echo "DuckDB version: $dbv" &>> pipeline.log
+
+# 2) Plan, then run the stale stages (pass --from STAGE etc. after the script)
+echo "Running pipeline.py at $(date)" &>> pipeline.log
+if python3 pipeline.py plan "$@" &>> pipeline.log && python3 pipeline.py run "$@" &>> pipeline.log; then
+  echo "pipeline.py finished successfully at $(date)" &>> pipeline.log
+else
+  echo "ERROR: pipeline.py failed! See above log." &>> pipeline.log
+  exit 1
+fi
+
+echo "Finished pipeline at $(date)" &>> pipeline.log
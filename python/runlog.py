@@ -0,0 +1,156 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Per-stage run telemetry (wall time, CPU, peak RSS, rows, bytes) in a
+         JSONL log, with the critical path of each pipeline run
+Version: 2
+'''
+
+# Import packages
+import fcntl
+import json
+import os
+import socket
+from datetime import datetime
+
+import pyarrow.parquet as pq
+
+
+# ── Measurements ───────────────────────────────────────────────────────────────
+def _files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        elif os.path.isdir(path):
+            for d, _, fs in os.walk(path):
+                for f in fs:
+                    yield os.path.join(d, f)
+
+
+def parquet_rows(paths):
+    '''Rows in every .parquet file under `paths`, from the footers only.'''
+    return sum(pq.ParquetFile(f).metadata.num_rows
+               for f in _files(paths) if f.endswith('.parquet'))
+
+
+def disk_bytes(paths):
+    return sum(os.path.getsize(f) for f in _files(paths))
+
+
+def usage(ru):
+    '''CPU, peak RSS and block writes from os.wait4's rusage (Linux units).
+
+    ru_maxrss is the largest resident set of the stage process or any child it
+    waited for (DuckDB threads, pool workers), not their sum.
+    '''
+    return {'user_s': round(ru.ru_utime, 2), 'sys_s': round(ru.ru_stime, 2),
+            'max_rss_mb': round(ru.ru_maxrss / 1024, 1),
+            'write_bytes': ru.ru_oublock * 512}
+
+
+# ── Log ────────────────────────────────────────────────────────────────────────
+def new_run_id():
+    return datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+
+class RunLog:
+    '''Append-only JSONL, one record per stage execution.
+
+    Stages running in parallel (or as array tasks on several nodes) share the
+    file. O_APPEND alone is not atomic on NFS, so each record is written whole
+    under an exclusive POSIX lock (fcntl.lockf, honoured by NFS lockd).
+    records() skips a line it cannot decode, e.g. one torn by a node that
+    died mid-write.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, record):
+        record = {'host': socket.gethostname(), **record}
+        line = (json.dumps(record, default=str) + "\n").encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)                 # releases the lock
+
+    def records(self, run=None):
+        '''Records of one run (default: the latest), in log order.'''
+        if not os.path.exists(self.path):
+            return []
+        rows, bad = [], 0
+        with open(self.path, errors='replace') as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    bad += 1
+        if bad:
+            print(f"WARNING: skipped {bad} unreadable line(s) in {self.path}")
+        rows = [r for r in rows if isinstance(r, dict)]
+        if run is None and rows:
+            run = rows[-1].get('run')
+        return [r for r in rows if r.get('run') == run]
+
+
+# ── Critical path ──────────────────────────────────────────────────────────────
+def critical_path(records, after):
+    '''Longest wall-time chain through the stages of one run.
+
+    `after` maps stage -> upstream stages; only those in the run count.
+    Returns (path, length_s, slack) where slack[s] is how much stage s could
+    grow before it lengthens the run.
+    '''
+    wall = {r['stage']: r['wall_s'] for r in records}
+    order = [r['stage'] for r in sorted(records, key=lambda r: r['start'])]
+    deps = {s: [u for u in after.get(s, []) if u in wall] for s in order}
+
+    finish, prev = {}, {}
+    for s in order:
+        best = max(deps[s], key=lambda u: finish.get(u, 0), default=None)
+        finish[s] = wall[s] + (finish.get(best, 0) if best else 0)
+        prev[s] = best
+    tail = {s: 0.0 for s in order}
+    for s in reversed(order):
+        for u in deps[s]:
+            tail[u] = max(tail[u], wall[s] + tail[s])
+
+    if not finish:
+        return [], 0.0, {}
+    end = max(finish, key=finish.get)
+    length, path = finish[end], [end]
+    while prev[path[-1]]:
+        path.append(prev[path[-1]])
+    slack = {s: max(round(length - finish[s] - tail[s], 1), 0.0) for s in order}
+    return path[::-1], length, slack
+
+
+def report(records, after):
+    '''Per-stage table and the critical path of one run.'''
+    if not records:
+        print("no runs logged yet")
+        return
+    path, length, slack = critical_path(records, after)
+    t0 = min(datetime.fromisoformat(r['start']) for r in records)
+    t1 = max(datetime.fromisoformat(r['end']) for r in records)
+    print(f"run {records[0]['run']}: {len(records)} stage(s), "
+          f"makespan {(t1 - t0).total_seconds():,.0f}s, critical path {length:,.0f}s")
+    print(f"  {'stage':<14}{'action':<9}{'wall s':>9}{'cpu s':>9}{'peak MB':>10}"
+          f"{'rows in':>14}{'rows out':>14}{'GB out':>9}{'slack s':>9}")
+    for r in records:
+        cpu = r.get('user_s', 0) + r.get('sys_s', 0)
+        print(f"  {r['stage']:<14}{r['action']:<9}{r['wall_s']:>9,.1f}{cpu:>9,.1f}"
+              f"{r.get('max_rss_mb', 0):>10,.0f}{r.get('rows_in') or 0:>14,}"
+              f"{r.get('rows_out') or 0:>14,}{(r.get('bytes_out') or 0) / 1e9:>9.2f}"
+              f"{slack.get(r['stage'], 0):>9,.1f}"
+              + ("" if r.get('returncode', 0) == 0 else f"  exit {r['returncode']}"))
+    print("  critical path: " + " → ".join(path))
@@ -0,0 +1,279 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Content-addressed cache of stage outputs on scratch (keys, hard-linked
+         objects, LRU/size eviction) used by pipeline.py
+Version: 2
+'''
+
+# Import packages
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+from manifest import file_sha256
+
+# ── Schema ─────────────────────────────────────────────────────────────────────
+# entries: one row per cached stage output set, keyed on its stage key.
+# current: which key is materialised at the fixed paths under DATA_DIR.
+DDL = """
+CREATE TABLE IF NOT EXISTS entries (
+  key       TEXT PRIMARY KEY,
+  stage     TEXT NOT NULL,
+  bytes     INTEGER NOT NULL,
+  files     INTEGER NOT NULL,
+  created   TEXT NOT NULL,
+  last_used TEXT NOT NULL,
+  hits      INTEGER DEFAULT 0,
+  meta      TEXT                   -- JSON: code / params / inputs / upstream parts
+);
+CREATE TABLE IF NOT EXISTS current (
+  stage     TEXT PRIMARY KEY,
+  key       TEXT NOT NULL,
+  updated   TEXT NOT NULL
+);
+"""
+
+HASH_LIMIT = 256 << 20     # single input files up to 256 MB are content-hashed
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# ── Key parts ──────────────────────────────────────────────────────────────────
+def local_modules(script):
+    '''The script plus every module it imports from its own directory, recursively.'''
+    root, seen, todo = os.path.dirname(os.path.abspath(script)), [], [os.path.abspath(script)]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.append(path)
+        with open(path) as fh:
+            tree = ast.parse(fh.read(), filename=path)
+        for node in ast.walk(tree):
+            names = ([a.name for a in node.names] if isinstance(node, ast.Import)
+                     else [node.module] if isinstance(node, ast.ImportFrom) and node.module
+                     else [])
+            for name in names:
+                cand = os.path.join(root, name.split('.')[0] + ".py")
+                if os.path.exists(cand):
+                    todo.append(cand)
+    return sorted(seen)
+
+
+def code_hash(script):
+    '''sha256 over the source of the script and its local modules.'''
+    h = hashlib.sha256()
+    for path in local_modules(script):
+        h.update(os.path.basename(path).encode())
+        h.update(file_sha256(path).encode())
+    return h.hexdigest()
+
+
+def script_params(script):
+    '''Top-level UPPER_CASE constants with literal values (SIGMA = 1.9, ...).
+
+    They are already covered by the code hash; keeping them separately lets
+    `pipeline.py plan` say which parameter changed.
+    '''
+    with open(script) as fh:
+        tree = ast.parse(fh.read(), filename=script)
+    out = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id.isupper():
+            try:
+                out[node.targets[0].id] = ast.literal_eval(node.value)
+            except (ValueError, SyntaxError, TypeError):
+                continue
+    return out
+
+
+def recorded_hashes(manifest_path):
+    '''{path: (bytes, sha256)} of the files a WRDS pull recorded in its
+    manifest.sqlite (empty if there is none).'''
+    if not os.path.exists(manifest_path):
+        return {}
+    con = sqlite3.connect(f"file:{manifest_path}?mode=ro", uri=True, timeout=60)
+    try:
+        rows = con.execute("SELECT path, bytes, sha256 FROM files").fetchall()
+    finally:
+        con.close()
+    return {os.path.normpath(p): (nbytes, digest) for p, nbytes, digest in rows}
+
+
+def fingerprint(path, recorded=None):
+    '''Fingerprint of an external input file or directory.
+
+    A single file up to HASH_LIMIT is hashed by content, so a touched-but-
+    unchanged deflator CSV keeps its key; a larger one by size and mtime.
+    A directory (the raw Parquet store: thousands of files, hundreds of GB
+    in total) is never read: each file counts by its path, size and mtime,
+    or by the sha256 a pull already `recorded` for it at that size.
+    '''
+    if not os.path.exists(path):
+        return 'missing'
+    recorded, single = recorded or {}, os.path.isfile(path)
+    files = ([path] if single else
+             sorted(os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs))
+    h = hashlib.sha256()
+    for f in files:
+        st = os.stat(f)
+        h.update(os.path.relpath(f, path).encode())
+        known = recorded.get(os.path.normpath(f))
+        if single and st.st_size <= HASH_LIMIT:
+            h.update(file_sha256(f).encode())
+        elif known is not None and known[0] == st.st_size:
+            h.update(known[1].encode())
+        else:
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def stage_key(code, params, inputs, upstream):
+    '''Merkle key: a stage's key changes iff its code, parameters, external
+    inputs or the key of any upstream stage changes.'''
+    parts = {'code': code, 'params': _digest(params), 'inputs': inputs, 'upstream': upstream}
+    return _digest(parts), parts
+
+
+# ── Output files ───────────────────────────────────────────────────────────────
+def _walk(path):
+    if os.path.isfile(path):
+        yield path
+    elif os.path.isdir(path):
+        for d, _, fs in os.walk(path):
+            for f in sorted(fs):
+                yield os.path.join(d, f)
+
+
+def _place(src, dst):
+    '''Hard link src to dst (same filesystem on scratch), else copy.'''
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class StageCache:
+    '''Stage outputs stored under root/objects/<key>/, mirroring their paths
+    relative to DATA_DIR.
+
+    Objects are hard links, so a cached copy of what is currently on disk costs
+    no extra space. Stages must therefore write fresh files, never rewrite one
+    in place: pipeline.py removes a stage's outputs before running it.
+    '''
+
+    def __init__(self, root, data_dir, max_bytes):
+        self.root, self.data_dir, self.max_bytes = root, data_dir, max_bytes
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._con = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=60)
+        self._con.executescript(DDL)
+        self._con.commit()
+
+    def _dir(self, key):
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    # ── Queries ────────────────────────────────────────────────────────────────
+    def has(self, key):
+        row = self._con.execute("SELECT 1 FROM entries WHERE key=?", (key,)).fetchone()
+        return bool(row) and os.path.isdir(self._dir(key))
+
+    def meta(self, key):
+        row = self._con.execute("SELECT meta FROM entries WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def current(self, stage):
+        row = self._con.execute("SELECT key FROM current WHERE stage=?", (stage,)).fetchone()
+        return row[0] if row else None
+
+    def entries(self):
+        return self._con.execute(
+            "SELECT stage, key, bytes, files, created, last_used, hits FROM entries "
+            "ORDER BY stage, last_used DESC").fetchall()
+
+    def size(self):
+        return self._con.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+
+    # ── Updates ────────────────────────────────────────────────────────────────
+    def put(self, key, stage, outputs, meta):
+        '''Link the stage's outputs (paths under DATA_DIR) into the cache.'''
+        tmp = self._dir(key) + ".tmp"
+        remove(tmp)
+        nbytes = nfiles = 0
+        for out in outputs:
+            for f in _walk(out):
+                _place(f, os.path.join(tmp, os.path.relpath(f, self.data_dir)))
+                nbytes += os.path.getsize(f)
+                nfiles += 1
+        os.makedirs(tmp, exist_ok=True)
+        remove(self._dir(key))
+        os.replace(tmp, self._dir(key))
+        self._con.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+            (key, stage, nbytes, nfiles, _now(), _now(), json.dumps(meta, default=str)))
+        self._con.commit()
+        return nbytes
+
+    def restore(self, key, outputs):
+        '''Replace the outputs at their fixed paths with the cached copies.'''
+        for out in outputs:
+            remove(out)
+        src = self._dir(key)
+        for f in _walk(src):
+            _place(f, os.path.join(self.data_dir, os.path.relpath(f, src)))
+        self._con.execute(
+            "UPDATE entries SET last_used=?, hits = hits + 1 WHERE key=?", (_now(), key))
+        self._con.commit()
+
+    def set_current(self, stage, key):
+        self._con.execute("INSERT OR REPLACE INTO current VALUES (?, ?, ?)", (stage, key, _now()))
+        self._con.execute("UPDATE entries SET last_used=? WHERE key=?", (_now(), key))
+        self._con.commit()
+
+    def clear_current(self, stage):
+        self._con.execute("DELETE FROM current WHERE stage=?", (stage,))
+        self._con.commit()
+
+    def evict(self, max_bytes=None):
+        '''Drop least-recently-used entries until the cache fits in max_bytes.
+        Entries that are currently materialised are kept.'''
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        keep = {k for (k,) in self._con.execute("SELECT key FROM current")}
+        total, dropped = self.size(), []
+        for key, stage, nbytes in self._con.execute(
+                "SELECT key, stage, bytes FROM entries ORDER BY last_used").fetchall():
+            if total <= limit:
+                break
+            if key in keep:
+                continue
+            remove(self._dir(key))
+            self._con.execute("DELETE FROM entries WHERE key=?", (key,))
+            total -= nbytes
+            dropped.append((stage, key, nbytes))
+        self._con.commit()
+        return dropped
+
+    def close(self):
+        self._con.close()
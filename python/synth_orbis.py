@@ -0,0 +1,295 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Synthetic ORBIS-shaped extraction (orbis_dataset/ Parquet or _partN.csv)
+         and deflator CSV, for benchmarking 03/04/05 and later stages offline
+Version: 2
+
+Same schema, partitioning and file naming as 01/02 write from WRDS, with
+firm-level static attributes that stay fixed across years, catalog columns with
+realistic null rates, a few negative core values, and duplicate filings:
+non-annual copies of an annual report and second annual reports with another
+closing date in the same fiscal year, which is what the 04 dedup window sees.
+Values are lognormal around a persistent firm size; they only need to look
+like the data to the cleaning and TFP code, not to be right. The debt share
+of total funds moves from year to year, and cash flow follows the Whited-Zhao
+form in ln D and ln E, so 08_finance_params has something to fit.
+'''
+
+# Import packages
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import catalog as cat
+import wrds_extract as wx
+
+# ── Paths ──────────────────────────────────────────────────────────────────────
+OUT_DIR = "/scratch/[your_group]/synth_orbis"
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+ROWS       = 1_000_000          # total firm-year filings, 1M ... 500M
+OUTPUT     = "parquet"          # "parquet" (orbis_dataset/) or "csv" (for 03_append_parquet.py)
+CHUNK_ROWS = 1_000_000          # rows per generated chunk (one write per chunk)
+YEARS      = list(range(2005, 2025))
+SEED       = 20251018
+WORKERS    = int(os.environ.get("NSLOTS", 4))
+
+SIZE_SHARE = {'small': 0.60, 'medium': 0.30, 'large': 0.10}      # share of rows
+SIZE_LNTA  = {'small': 13.0, 'medium': 15.5, 'large': 18.0}      # mean ln(toas), local currency
+ACTIVE     = 0.75               # P(firm files in a given year)
+DUP_COPY   = 0.08               # extra non-annual filing with the same closdate
+DUP_SHIFT  = 0.03               # extra annual filing, other closdate, same fiscal year
+NEGATIVE   = 0.005              # turn / cuas / empl flipped negative
+# ln cf = const + FIN_BETA_D d + FIN_BETA_E e + FIN_BETA_DE (d - e)^2 + firm + noise,
+# i.e. alpha_s = 0.4 and gamma_s = 2 in 08_finance_params
+FIN_BETA_D, FIN_BETA_E, FIN_BETA_DE = 0.4, 0.6, 0.12
+
+# Null rates; catalog variables not listed use NULL_DEFAULT
+NULL_DEFAULT = 0.35
+NULL_RATES = {
+    'bvdid': 0, 'contact_ctryiso': 0, 'closdate': 0, 'filing_type': 0, 'exchrate': 0,
+    'orig_currency': 0.01, 'name_internat': 0.01, 'country': 0, 'category_of_company': 0.02,
+    'akaname': 0.9, 'lei_lei': 0.95, 'sd_ticker': 0.98, 'sd_isin': 0.98, 'name_native': 0.4,
+    'major_sector': 0.03, 'nace2_main_section': 0.02, 'naceccod2': 0.02,
+    'naicsccod2017': 0.03, 'ussicccod': 0.03,
+    'toas': 0.03, 'turn': 0.12, 'opre': 0.08, 'empl': 0.20, 'cuas': 0.06, 'tfas': 0.08,
+    'staf': 0.30, 'av': 0.45, 'cost': 0.35, 'depr': 0.40, 'ebta': 0.30, 'pl': 0.10,
+    'cf': 0.40, 'shfd': 0.10, 'debt': 0.45, 'cash': 0.25,
+}
+
+# Country weights (rows), currency and 2015 LCU per USD
+COUNTRY = {
+    'BR': (6, 'BRL', 3.3),  'CL': (2, 'CLP', 654),   'CN': (20, 'CNY', 6.2), 'CO': (3, 'COP', 2740),
+    'CZ': (3, 'CZK', 24.6), 'EG': (1, 'EGP', 7.7),   'GR': (2, 'EUR', 0.9),  'HU': (3, 'HUF', 280),
+    'IN': (12, 'INR', 64),  'ID': (4, 'IDR', 13400), 'KR': (10, 'KRW', 1130), 'KW': (1, 'KWD', 0.3),
+    'MY': (4, 'MYR', 3.9),  'MX': (5, 'MXN', 15.9),  'PE': (2, 'PEN', 3.2),  'PH': (2, 'PHP', 45.5),
+    'PL': (6, 'PLN', 3.8),  'QA': (1, 'QAR', 3.6),   'SA': (2, 'SAR', 3.75), 'ZA': (3, 'ZAR', 12.8),
+    'TW': (4, 'TWD', 31.9), 'TH': (3, 'THB', 34.2),  'TR': (4, 'TRY', 2.7),  'AE': (1, 'AED', 3.67),
+}
+
+# NACE Rev. 2 divisions by section, with row weights
+SECTIONS = {
+    'A': ([1, 2, 3], 3), 'B': ([5, 6, 7, 8, 9], 1), 'C': (list(range(10, 34)), 25),
+    'D': ([35], 1), 'E': ([36, 37, 38, 39], 1), 'F': ([41, 42, 43], 8),
+    'G': ([45, 46, 47], 25), 'H': ([49, 50, 51, 52, 53], 5), 'I': ([55, 56], 4),
+    'J': ([58, 59, 60, 61, 62, 63], 4), 'K': ([64, 65, 66], 2), 'L': ([68], 3),
+    'M': ([69, 70, 71, 72, 73, 74, 75], 6), 'N': ([77, 78, 79, 80, 81, 82], 4),
+    'P': ([85], 1), 'Q': ([86, 87, 88], 2), 'R': ([90, 91, 92, 93], 1), 'S': ([94, 95, 96], 1),
+}
+MAJOR = {'A': 'Primary sector', 'B': 'Primary sector', 'C': 'Manufacturing',
+         'D': 'Utilities', 'E': 'Utilities', 'F': 'Construction', 'G': 'Wholesale & retail trade',
+         'H': 'Transport', 'I': 'Hotels & restaurants', 'J': 'Publishing & broadcasting',
+         'K': 'Banks & insurance', 'L': 'Real estate', 'M': 'Business services',
+         'N': 'Business services', 'P': 'Education & health', 'Q': 'Education & health',
+         'R': 'Other services', 'S': 'Other services'}
+CATEGORY = {'small': 'SMALL COMPANY', 'medium': 'MEDIUM SIZED COMPANY', 'large': 'LARGE COMPANY'}
+LEGAL = ['Private limited company', 'Public limited company', 'Partnership', 'Sole trader', 'Other']
+
+
+# ── Deterministic per-firm draws ───────────────────────────────────────────────
+def _mix(ids, salt):
+    '''splitmix64 of (firm id, salt): the same firm gets the same static draws
+    in every year and every chunk without keeping a firm table.'''
+    with np.errstate(over='ignore'):           # wrap-around is the point
+        x = ids.astype(np.uint64) + np.uint64(salt) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return x
+
+
+def _unif(ids, salt):
+    return (_mix(ids, salt) >> np.uint64(11)).astype(np.float64) / 2.0**53 + 2.0**-54
+
+
+def _normal(ids, salt):
+    return np.sqrt(-2 * np.log(_unif(ids, salt))) * np.cos(2 * np.pi * _unif(ids, salt + 1000))
+
+
+def _pick(ids, salt, weights):
+    '''Index of a weighted draw per firm.'''
+    p = np.asarray(weights, dtype=float)
+    return np.searchsorted(np.cumsum(p / p.sum()), _unif(ids, salt)).clip(0, len(p) - 1)
+
+
+def _cat(*parts):
+    '''Element-wise string concatenation of Arrow arrays / scalars.'''
+    return pc.binary_join_element_wise(*parts, "")
+
+
+def _str(values, width=0):
+    out = pc.cast(pa.array(values), pa.string())
+    return pc.utf8_lpad(out, width=width, padding="0") if width else out
+
+
+def firm_counts(rows):
+    '''Firms per size class so that the panel has about `rows` filings.'''
+    per_firm = len(YEARS) * ACTIVE * (1 + DUP_COPY + DUP_SHIFT)
+    return {size: max(1, int(rows * share / per_firm)) for size, share in SIZE_SHARE.items()}
+
+
+# ── One chunk ──────────────────────────────────────────────────────────────────
+def static_block(ids, size):
+    '''company_id_table + industry_classifications columns of these firms.
+
+    Built with Arrow compute kernels: per-row Python string formatting is
+    what would otherwise dominate the generator at 100M+ rows.
+    '''
+    ctry = pa.array(list(COUNTRY)).take(_pick(ids, 1, [w for w, _, _ in COUNTRY.values()]))
+    s_ix = _pick(ids, 2, [w for _, w in SECTIONS.values()])
+    divs = [d for ds, _ in SECTIONS.values() for d in ds]
+    n_dv = np.array([len(ds) for ds, _ in SECTIONS.values()])
+    div  = np.take(divs, np.concatenate([[0], np.cumsum(n_dv)[:-1]])[s_ix]
+                   + (_unif(ids, 3) * n_dv[s_ix]).astype(int))
+    sect = pa.array(list(SECTIONS)).take(s_ix)
+    nace = _cat(_str(div, 2), _str((_unif(ids, 4) * 9).astype(int) * 10 + (_unif(ids, 5) * 3).astype(int), 2))
+    num  = _str(ids, 9)
+    inc  = _str(1950 + (_unif(ids, 6) * 70).astype(int))
+    naics = _str(1100 + (_unif(ids, 7) * 8000).astype(int))
+    sic   = _str(100 + (_unif(ids, 8) * 9800).astype(int))
+    legal = pa.array(LEGAL).take(_pick(ids, 9, [1] * len(LEGAL)))
+    city  = _cat(ctry, " CITY ", _str((_unif(ids, 10) * 20).astype(int)))
+    out = {
+        'name_internat': _cat("FIRM ", num), 'name_native': _cat("FIRMA ", num),
+        'akaname': _cat("AKA ", num), 'slegalf': legal, 'legalfrm': legal,
+        'dateinc': _cat(inc, "-01-01"), 'dateinc_year': inc, 'dateinc_char': _cat(inc, "0101"),
+        'lei_lei': _cat("LEI", num), 'sd_ticker': _cat("T", num), 'sd_isin': _cat(ctry, num),
+        'city_internat': city, 'city_native': city,
+        'country': ctry, 'region_in_country': _cat(ctry, " REGION"),
+        'bvdid': _cat(ctry, size[0].upper(), num),
+        'category_of_company': pa.array([CATEGORY[size]] * len(ids)), 'contact_ctryiso': ctry,
+        'major_sector': pa.array([MAJOR[s] for s in SECTIONS]).take(s_ix),
+        'nace2_main_section': sect, 'naceccod2': nace, 'nacecdes2': _cat("NACE ", nace),
+        'nacepcod2': nace, 'nacepdes2': _cat("NACE ", nace),
+        'naicsccod2017': naics, 'naicscdes2017': _cat("NAICS ", naics),
+        'ussicccod': sic, 'ussiccdes': _cat("SIC ", sic),
+    }
+    return pa.table(out).to_pandas()
+
+
+def chunk_rows(size, year, lo, hi, rng):
+    '''Filings of firms [lo, hi) of one size class closing in calendar `year`.'''
+    ids = np.arange(lo, hi, dtype=np.int64)
+    ids = ids[rng.random(len(ids)) < ACTIVE]
+    # Duplicates: non-annual copies (same closdate) and shifted annual reports
+    copy  = ids[rng.random(len(ids)) < DUP_COPY]
+    shift = ids[rng.random(len(ids)) < DUP_SHIFT]
+    firm  = np.concatenate([ids, copy, shift])
+    kind  = np.repeat([0, 1, 2], [len(ids), len(copy), len(shift)])
+    df = static_block(firm, size)
+
+    # Fiscal year end: Dec for most, then Mar / Jun / Sep; shifted reports close
+    # at the other half of the fiscal year
+    month = np.array([12, 3, 6, 9])[_pick(firm, 20, [70, 15, 10, 5])]
+    month = np.where(kind == 2, np.where(month >= 6, month - 3, month + 3), month)
+    df['closdate'] = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1})) \
+                     + pd.offsets.MonthEnd(0)
+    df['filing_type'] = np.where(kind == 1, 'Local registry filing', 'Annual report')
+    c_ix = _pick(firm, 1, [w for w, _, _ in COUNTRY.values()])     # = static_block's country
+    df['orig_currency'] = np.take([cur for _, cur, _ in COUNTRY.values()], c_ix)
+    drift = 1.03 ** (year - 2015)
+    df['exchrate'] = 1 / (np.take([fx for _, _, fx in COUNTRY.values()], c_ix)
+                          * drift * np.exp(rng.normal(0, 0.02, len(firm))))
+
+    # Firm-year scale: persistent firm size, common growth, idiosyncratic noise
+    n = len(firm)
+    ln_ta = SIZE_LNTA[size] + 1.2 * _normal(firm, 30) + 0.03 * (year - 2015) + rng.normal(0, 0.25, n)
+    toas = np.exp(ln_ta)
+    turn = toas * np.exp(-0.2 + 0.5 * _normal(firm, 31) + rng.normal(0, 0.2, n))
+    vals = {
+        'toas': toas, 'turn': turn, 'opre': turn * np.exp(rng.normal(0, 0.05, n)),
+        'tfas': toas * _unif(firm, 32) * 0.7, 'cuas': toas * (0.2 + 0.5 * _unif(firm, 33)),
+        'empl': np.maximum(1, np.round(turn / (40_000 * drift * np.exp(0.8 * _normal(firm, 34))))),
+        'staf': turn * (0.10 + 0.25 * _unif(firm, 35)), 'cost': turn * (0.55 + 0.3 * _unif(firm, 36)),
+        'av': turn * (0.15 + 0.35 * _unif(firm, 37)),
+    }
+    # Equity share of total funds: persistent per firm, with yearly shocks, so
+    # ln D and ln E are not collinear within a firm
+    eq = 1 / (1 + np.exp(-(0.6 * _normal(firm, 38) + rng.normal(0, 0.5, n))))
+    vals['tshf'] = toas                    # shareholders funds + liabilities
+    vals['shfd'] = toas * eq
+    d, e = np.log(toas * (1 - eq)), np.log(toas * eq)
+    vals['cf'] = np.exp(-2.3 + FIN_BETA_D * d + FIN_BETA_E * e + FIN_BETA_DE * (d - e)**2
+                        + 0.3 * _normal(firm, 39) + rng.normal(0, 0.3, n))
+    vals['depr'] = vals['tfas'] * 0.08
+    vals['ebta'] = vals['av'] - vals['staf']
+    vals['pl'] = vals['cf'] - vals['depr']
+    vals['_315506'] = vals['pl']
+    for v in cat.FIN_VARS:
+        if v not in vals and v not in cat.FIN_STRING_VARS and v not in ('closdate', 'exchrate'):
+            vals[v] = toas * np.exp(rng.normal(-2.5, 1.0, n))
+    for v in ('turn', 'cuas', 'empl'):
+        vals[v] = np.where(rng.random(n) < NEGATIVE, -vals[v], vals[v])
+    df = df.assign(**vals)
+    df['emp_orig_range_value'] = pd.cut(df['empl'], [-np.inf, 9, 49, 249, np.inf],
+                                        labels=['0-9', '10-49', '50-249', '250+']).astype(str)
+
+    # Nulls, independent by column; static attributes are missing for a firm
+    # in every year or in none, as in ORBIS
+    static = set(cat.STATIC_VARS) | set(cat.SECTOR_VARS)
+    for i, col in enumerate(df.columns):
+        rate = NULL_RATES.get(col, NULL_DEFAULT)
+        if rate:
+            u = _unif(firm, 200 + i) if col in static else rng.random(n)
+            df[col] = df[col].where(u >= rate)
+    return df
+
+
+def write_unit(args):
+    '''Every chunk of one (size, year): the analogue of one WRDS shard.'''
+    out_dir, output, size, year, n_firms, schema = args
+    step = max(1, int(CHUNK_ROWS / (ACTIVE * (1 + DUP_COPY + DUP_SHIFT))))
+    rows = 0
+    for part, lo in enumerate(range(0, n_firms, step), start=1):
+        rng = np.random.default_rng([SEED, list(SIZE_SHARE).index(size), year, part])
+        df = chunk_rows(size, year, lo, min(lo + step, n_firms), rng)
+        tag = f"{size}_{year}"
+        if output == "parquet":
+            shard = wx.Shard(size, size[0], str(year), None, None, 1, ())
+            wx.write_parquet_chunk(os.path.join(out_dir, "orbis_dataset"), shard, tag, part, df, schema)
+        else:
+            df.to_csv(os.path.join(out_dir, f"orbis_em_{tag}_part{part}.csv"), index=False)
+        rows += len(df)
+    return size, year, rows
+
+
+def deflator(out_dir):
+    '''gdp_deflator_long.csv (ctryiso, year, gdpdef), 2015 = 100.'''
+    rows = []
+    for i, c in enumerate(COUNTRY):
+        infl = 0.02 + 0.01 * (i % 7)
+        rows += [(c, y, round(100 * (1 + infl) ** (y - 2015), 4)) for y in YEARS]
+    pd.DataFrame(rows, columns=['ctryiso', 'year', 'gdpdef']) \
+      .to_csv(os.path.join(out_dir, "gdp_deflator_long.csv"), index=False)
+
+
+def generate(out_dir, rows=ROWS, output=OUTPUT, workers=WORKERS):
+    '''Write the synthetic extraction and the deflator CSV; returns rows written.'''
+    os.makedirs(out_dir, exist_ok=True)
+    schema = wx.orbis_schema(cat.selected(cat.STATIC_VARS), cat.selected(cat.SECTOR_VARS),
+                             cat.selected(cat.FIN_VARS))
+    units = [(out_dir, output, size, year, n, schema)
+             for size, n in firm_counts(rows).items() for year in YEARS]
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for size, year, n in pool.map(write_unit, units):
+            total += n
+    deflator(out_dir)
+    return total
+
+
+if __name__ == '__main__':
+    print(f"Generating ~{ROWS:,} synthetic filings ({OUTPUT}) → {OUT_DIR}")
+    n = generate(OUT_DIR)
+    print(f"{n:,} rows written; firms per size: {firm_counts(ROWS)}")
+    print("All done!")
@@ -0,0 +1,113 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: hdfe.py against brute force: dummy-variable OLS with CR1 SEs and a
+         refitted wild cluster bootstrap (run with pytest)
+Version: 2
+'''
+
+# Import packages
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hdfe import Absorbed, Spec, draw_weights, fit, run_specs, wild_batch
+
+
+def panel(seed=0, firms=300, years=10, countries=24):
+    '''Firms nested in countries (the clusters); a few switch industry.'''
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'id': np.repeat(np.arange(firms), years),
+                       'year': np.tile(np.arange(years), firms)})
+    df['country2'] = df['id'] % countries
+    ind = rng.integers(0, 5, firms)[df['id']]
+    move = rng.random(len(df)) < 0.1
+    df['ind2'] = np.where(move, rng.integers(0, 5, len(df)), ind)
+    df['x1'] = rng.normal(size=len(df))
+    df['x2'] = rng.normal(size=len(df)) + 0.3 * df['ind2']
+    df['y'] = (df['x1'] - 0.5 * df['x2'] + rng.normal(size=firms)[df['id']]
+               + 0.2 * df['ind2'] + rng.normal(size=len(df)))
+    return df
+
+
+def dummies(s):
+    return pd.get_dummies(s, drop_first=True, dtype=float).to_numpy()
+
+
+def dummy_ols(df, fes, k_extra):
+    '''OLS of y on [1, x1, x2, FE dummies] with CR1 SEs on country2;
+    K = rank of the design minus `k_extra` absorbed columns Stata does not count.'''
+    Z = np.column_stack([np.ones(len(df)), df[['x1', 'x2']].to_numpy()] + [dummies(df[f]) for f in fes])
+    y = df['y'].to_numpy()
+    b, *_ = np.linalg.lstsq(Z, y, rcond=None)
+    e = y - Z @ b
+    A = np.linalg.pinv(Z.T @ Z)
+    g = df['country2'].to_numpy()
+    S = np.stack([Z[g == c].T @ e[g == c] for c in np.unique(g)])
+    N, G = len(y), len(S)
+    K = np.linalg.matrix_rank(Z) - k_extra
+    q = G / (G - 1) * (N - 1) / (N - K)
+    V = q * A @ (S.T @ S) @ A
+    return b[1:3], np.sqrt(np.diag(V))[1:3], q
+
+
+def test_reghdfe_matches_dummy_ols():
+    df = panel()
+    r, = run_specs([Spec('rg', 'y', ['x1', 'x2'], ('country2', 'ind2'))], df)
+    # reghdfe: country2 is nested in the cluster and costs nothing
+    b, se, q = dummy_ols(df, ['ind2', 'country2'], k_extra=df['country2'].nunique() - 1)
+    assert np.allclose(r.b[:2], b) and np.allclose(r.se[:2], se) and np.isclose(r.q, q)
+
+
+def test_xtreg_matches_dummy_ols():
+    df = panel()
+    r, = run_specs([Spec('fe', 'y', ['x1', 'x2'], ('country2', 'ind2'), family='xtreg')], df)
+    # xtreg, fe: the firm dummies are not counted; country2 dummies are
+    # collinear with them (every firm in one country) and omitted
+    b, se, q = dummy_ols(df, ['id', 'country2', 'ind2'], k_extra=df['id'].nunique() - 1)
+    assert np.allclose(r.b[:2], b) and np.allclose(r.se[:2], se) and np.isclose(r.q, q)
+
+
+def test_wild_kernels_match_brute_force():
+    '''A few wild cluster bootstrap replications from the closed-form kernels
+    against rebuilding y*, refitting and recomputing the CR1 SE.'''
+    df = panel(seed=1)
+    spec = Spec('rg', 'y', ['x1', 'x2'], ('ind2',))
+    ab = Absorbed(df, np.ones(len(df), dtype=bool), spec.absorb, spec.cluster,
+                  {'y': df['y'].to_numpy(), 'x1': df['x1'].to_numpy(), 'x2': df['x2'].to_numpy()})
+    r = fit(spec, ab, ['x1', 'x2'], boot_terms='all')
+    y, X = ab.get(['y'])[:, 0], ab.get(['x1', 'x2'])
+    A = np.linalg.inv(X.T @ X)
+    g = ab.cluster.index
+    G = len(ab.cluster.levels)
+
+    reps, seed = 5, 7
+    out = wild_batch(r.kernels, r.q, reps, seed)
+    V = draw_weights(np.random.default_rng(seed), G, reps)
+
+    def refit(y_star, k):
+        b = A @ (X.T @ y_star)
+        e = y_star - X @ b
+        S = np.stack([X[g == h].T @ e[g == h] for h in range(G)])
+        return b[k], np.sqrt(r.q * (A @ S.T @ S @ A)[k, k])
+
+    for k, name in enumerate(['x1', 'x2']):
+        b0 = A @ (X.T @ y)
+        e0 = y - X @ b0
+        rest = [j for j in range(2) if j != k]
+        br = np.linalg.lstsq(X[:, rest], y, rcond=None)[0]
+        fit_r = X[:, rest] @ br
+        e_r = y - fit_r
+        db_u, t_u, db_r, t_r = out[name]
+        for j in range(reps):
+            v = V[g, j]
+            b, se = refit(X @ b0 + e0 * v, k)
+            assert np.isclose(db_u[j], b - b0[k]) and np.isclose(t_u[j], (b - b0[k]) / se)
+            b, se = refit(fit_r + e_r * v, k)
+            assert np.isclose(db_r[j], b) and np.isclose(t_r[j], b / se)
@@ -0,0 +1,98 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Pull bookkeeping of wrds_extract.py: a full pull after an incremental
+         merge keeps the store unique on DEDUP_KEYS, and the output mode is
+         part of the shard key (run with pytest)
+Version: 2
+'''
+
+# Import packages
+import os
+import sys
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wrds_extract as wx
+from manifest import Manifest
+
+SCHEMA = wx.orbis_schema(['bvdid', 'contact_ctryiso'], [], ['closdate', 'filing_type', 'toas'])
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=['bvdid', 'contact_ctryiso', 'closdate', 'filing_type', 'toas'])
+
+
+# Stands in for the WRDS connections: the "query" is the shard label
+WRDS = {
+    '2010': frame([('BR1', 'BR', '2010-12-31', 'Annual', 1.0),
+                   ('BR2', 'BR', '2010-12-31', 'Annual', 2.0)]),
+    '2011': frame([('BR1', 'BR', '2011-12-31', 'Annual', 3.0)]),
+    'delta': frame([('BR1', 'BR', '2011-12-31', 'Annual', 3.5),     # restated
+                    ('BR2', 'BR', '2011-12-31', 'Annual', 4.0)]),   # new
+}
+
+
+class FakePool:
+    def __init__(self, size, wrds_username):
+        pass
+
+    def acquire(self):
+        return self
+
+    def release(self, db):
+        pass
+
+    def close(self):
+        pass
+
+    def raw_sql(self, query, chunksize, return_iter):
+        return iter([WRDS[query].copy()])
+
+
+def pull(root, manifest, shards, output='parquet'):
+    def write(s, part, chunk):
+        if output == 'parquet':
+            return wx.write_parquet_chunk(root, s, wx.shard_tag(s, 1), part, chunk, SCHEMA)
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, f"orbis_em_{wx.shard_tag(s, 1)}_part{part}.csv")
+        chunk.to_csv(path, index=False)
+        return [path]
+    wx.run_shards(shards, lambda s: s.label.split('_')[0], write, 'nobody', workers=1,
+                  manifest=manifest, key_for=lambda s: wx.shard_key(s, ('cols',), output))
+
+
+def test_full_incremental_full_keeps_keys_unique(tmp_path, monkeypatch):
+    monkeypatch.setattr(wx, 'ConnectionPool', FakePool)
+    store, staging = str(tmp_path / 'orbis_dataset'), str(tmp_path / 'orbis_delta')
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    full = wx.make_shards({'small': 's'}, [('2010', None, None), ('2011', None, None)], ['BR'])
+
+    pull(store, manifest, full)
+    pull(staging, manifest, wx.make_delta_shards({'small': 's'}, ['BR'], label='delta_x'))
+    wx.merge_delta(staging, store, manifest)
+    pull(store, manifest, full)
+
+    df = ds.dataset(store, format='parquet', partitioning='hive').to_table().to_pandas()
+    assert len(df) == 4
+    assert not df.duplicated(subset=wx.DEDUP_KEYS).any()
+    assert df.loc[(df['bvdid'] == 'BR1') & (df['year'] == 2011), 'toas'].tolist() == [3.5]
+    assert all(manifest.is_done(wx.shard_key(s, ('cols',)), verify='hash') for s in full)
+
+
+def test_csv_pull_does_not_count_for_parquet(tmp_path, monkeypatch):
+    monkeypatch.setattr(wx, 'ConnectionPool', FakePool)
+    store = str(tmp_path / 'orbis_dataset')
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    full = wx.make_shards({'small': 's'}, [('2010', None, None)], ['BR'])
+
+    pull(str(tmp_path), manifest, full, output='csv')
+    pull(store, manifest, full)
+
+    assert len(ds.dataset(store, format='parquet', partitioning='hive').to_table()) == 2
+    assert os.path.exists(tmp_path / 'orbis_em_small_2010_part1.csv')
@@ -0,0 +1,52 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: TFPQ/TFPR of 07_tfpr_real.py follow Stata's missing values (run with pytest)
+Version: 1
+'''
+
+# Import packages
+import math
+import os
+import sys
+
+import duckdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import catalog as cat
+
+
+def test_zero_employment_is_missing_not_inf():
+    '''One firm without employees: its TFPQ/TFPR are missing, as in Stata, and
+    the group means of the logs (and so every d_ln_*) stay finite.'''
+    con = duckdb.connect()
+    cat.stata_macros(con)
+    con.execute("""
+      CREATE TABLE alpha AS SELECT * FROM (VALUES
+        (1, 'C', 'BR', 100.0, 200.0, 10.0, 50.0, 0.3, 0.4),
+        (2, 'C', 'BR', 120.0, 260.0, 20.0, 80.0, 0.3, 0.4),
+        (3, 'C', 'BR',  90.0, 150.0,  0.0, 40.0, 0.3, 0.4)
+      ) AS t(firm_id, nace2_main_section, ctryiso, va_usd, turn_usd, empl, tfas, alpha_1, alpha)
+    """)
+    con.execute(f"""
+      CREATE TABLE tfp AS
+      SELECT *, {cat.tfp_block()}, safe_ln(tfpq1) AS ln_tfpq1, safe_ln(tfpr2) AS ln_tfpr2
+      FROM alpha
+    """)
+    zero = con.execute("SELECT tfpq1, tfpq2, tfpr1, tfpr2 FROM tfp WHERE firm_id = 3").fetchone()
+    assert zero == (None, None, None, None)
+
+    rows = con.execute("""
+      SELECT t.ln_tfpq1 - avg(t.ln_tfpq1) OVER g, t.ln_tfpr2 - avg(t.ln_tfpr2) OVER g
+      FROM tfp AS t
+      WHERE firm_id <> 3
+      WINDOW g AS (PARTITION BY nace2_main_section, ctryiso)
+    """).fetchall()
+    means = con.execute("""
+      SELECT avg(ln_tfpq1), avg(ln_tfpr2) FROM tfp GROUP BY nace2_main_section, ctryiso
+    """).fetchone()
+    assert all(math.isfinite(v) for v in means)
+    assert all(math.isfinite(v) for r in rows for v in r)
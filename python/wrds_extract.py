@@ -0,0 +1,430 @@
+'''
+Misallocating Finance, Misallocating Factors: Firm-Level Evidence from Emerging Markets
+
+Author: Lovina Putri
+Date Created: 18/10/2026
+Last Updated: 18/10/2026
+Project: Shared sharded WRDS extraction engine for the ORBIS batch scripts
+Version: 7
+'''
+
+# Import packages
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from catalog import FIN_STRING_VARS
+
+# ── Shards ─────────────────────────────────────────────────────────────────────
+# One shard = one (size, period, country group) query. `label` is the period tag
+# used in file names ("2010" or "2010_2014"), `group` is the country-group index.
+Shard = namedtuple("Shard", "size suffix label start end group countries")
+
+# SQL shared by 01 and 02; the date window and ISO list come from the shard
+SQL_TEMPLATE = """
+SELECT {c_cols}, {p_cols}, {f_cols}
+FROM {schema}.ob_w_ind_g_fins_cfl_usd_{suffix}   AS f
+  JOIN {schema}.ob_w_company_id_table_{suffix}   AS c ON f.bvdid = c.bvdid
+  JOIN {schema}.ob_industry_classifications_{suffix}   AS p ON f.bvdid = p.bvdid
+WHERE c.contact_ctryiso IN ({iso_list})
+  AND f.closdate BETWEEN '{start}' AND '{end}'
+ORDER BY c.contact_ctryiso, c.bvdid, f.closdate
+"""
+
+# Incremental variant: one closdate lower bound per country
+DELTA_SQL_TEMPLATE = """
+SELECT {c_cols}, {p_cols}, {f_cols}
+FROM {schema}.ob_w_ind_g_fins_cfl_usd_{suffix}   AS f
+  JOIN {schema}.ob_w_company_id_table_{suffix}   AS c ON f.bvdid = c.bvdid
+  JOIN {schema}.ob_industry_classifications_{suffix}   AS p ON f.bvdid = p.bvdid
+WHERE {window}
+ORDER BY c.contact_ctryiso, c.bvdid, f.closdate
+"""
+
+
+def country_groups(iso_codes, n_groups):
+    '''Split the ISO list into `n_groups` contiguous, roughly equal groups.'''
+    n_groups = max(1, min(n_groups, len(iso_codes)))
+    size, extra = divmod(len(iso_codes), n_groups)
+    groups, pos = [], 0
+    for g in range(n_groups):
+        step = size + (1 if g < extra else 0)
+        groups.append(tuple(iso_codes[pos:pos + step]))
+        pos += step
+    return groups
+
+
+def make_shards(suffix_map, periods, iso_codes, n_groups=1):
+    '''Cross sizes × periods × country groups; periods are (label, start, end).'''
+    groups = country_groups(iso_codes, n_groups)
+    return [
+        Shard(size, suffix, str(label), start, end, g, countries)
+        for size, suffix in suffix_map.items()
+        for label, start, end in periods
+        for g, countries in enumerate(groups, start=1)
+    ]
+
+
+def shard_tag(shard, n_groups):
+    '''File-name stem for a shard; the group index is only added when sharding by country.'''
+    tag = f"{shard.size}_{shard.label}"
+    return f"{tag}_g{shard.group}" if n_groups > 1 else tag
+
+
+def shard_key(shard, columns=(), output="parquet"):
+    '''Manifest key (schema, suffix, period, grp) of a shard.
+
+    suffix carries the `output` mode ("s:parquet", "s:csv"), so the files of
+    one mode never count for the other. grp carries a short hash of the
+    shard's countries and the selected `columns` next to the group index, so
+    a shard pulled before n_groups, the ISO list or the variable selection
+    changed is not taken as done.
+    '''
+    spec = ",".join(sorted(shard.countries)) + "|" + ",".join(columns)
+    digest = hashlib.sha256(spec.encode()).hexdigest()[:8]
+    return (f"bvd_orbis_{shard.size}", f"{shard.suffix}:{output}", shard.label,
+            f"g{shard.group}_{digest}")
+
+
+def build_query(shard, c_cols, p_cols, f_cols):
+    return SQL_TEMPLATE.format(
+        schema   = f"bvd_orbis_{shard.size}",
+        suffix   = shard.suffix,
+        c_cols   = c_cols,
+        p_cols   = p_cols,
+        f_cols   = f_cols,
+        iso_list = ",".join(f"'{c}'" for c in shard.countries),
+        start    = shard.start,
+        end      = shard.end,
+    )
+
+
+# ── Incremental (delta) pulls ──────────────────────────────────────────────────
+# Rows in the store are unique on these keys; newer pulls win on merge
+DEDUP_KEYS = ['bvdid', 'closdate', 'filing_type']
+
+
+def make_delta_shards(suffix_map, iso_codes, n_groups=1, label=None):
+    '''One delta shard per size × country group, labelled with today's date.'''
+    label = label or f"delta_{date.today():%Y%m%d}"
+    return make_shards(suffix_map, [(label, None, None)], iso_codes, n_groups)
+
+
+def store_watermarks(root):
+    '''Highest closdate per (size, ctryiso) found in an existing hive store.'''
+    marks = {}
+    if not os.path.isdir(root):
+        return marks
+    for size_dir in os.listdir(root):
+        for ctry_dir in os.listdir(os.path.join(root, size_dir)):
+            base  = os.path.join(root, size_dir, ctry_dir)
+            years = sorted((d for d in os.listdir(base) if d[5:].isdigit()),
+                           key=lambda d: int(d[5:]))
+            if not years:
+                continue
+            files = [os.path.join(base, years[-1], f)
+                     for f in os.listdir(os.path.join(base, years[-1])) if f.endswith('.parquet')]
+            if not files:
+                continue
+            top = max(pq.read_table(f, columns=['closdate'])['closdate'].to_pandas().max()
+                      for f in files)
+            marks[(size_dir[5:], ctry_dir[8:])] = str(top)
+    return marks
+
+
+def delta_since(manifest, root, suffix_map, iso_codes, restatement_days=0,
+                floor='2005-01-01'):
+    '''Per-(size, ctryiso) lower bound on closdate for an incremental pull.
+
+    Uses the manifest watermark, falls back to scanning the store, and finally
+    to `floor` (full history) for pairs never pulled before. The bound is moved
+    back by `restatement_days` so recently restated filings are fetched again.
+    '''
+    marks = manifest.watermarks()
+    if len(marks) < len(suffix_map) * len(iso_codes):
+        for k, v in store_watermarks(root).items():
+            marks.setdefault(k, v)
+            manifest.set_watermark(*k, v)
+    since = {}
+    for size in suffix_map:
+        for c in iso_codes:
+            mark = marks.get((size, c))
+            if mark is None:
+                since[(size, c)] = (date.fromisoformat(floor) - timedelta(days=1)).isoformat()
+            else:
+                since[(size, c)] = (date.fromisoformat(mark)
+                                    - timedelta(days=restatement_days)).isoformat()
+    return since
+
+
+def build_delta_query(shard, c_cols, p_cols, f_cols, since):
+    window = "\n   OR ".join(
+        f"(c.contact_ctryiso = '{c}' AND f.closdate > '{since[(shard.size, c)]}')"
+        for c in shard.countries)
+    return DELTA_SQL_TEMPLATE.format(
+        schema = f"bvd_orbis_{shard.size}",
+        suffix = shard.suffix,
+        c_cols = c_cols,
+        p_cols = p_cols,
+        f_cols = f_cols,
+        window = window,
+    )
+
+
+def merge_delta(staging_root, store_root, manifest):
+    '''Fold a staged delta into the store and advance the watermarks.
+
+    Each touched size/ctryiso/year partition is rewritten as one file,
+    merged_0.parquet, with the staged rows replacing stored rows on DEDUP_KEYS.
+    The file is written under a temporary name and renamed into place before
+    the old files are removed. A crash therefore leaves the old files, or the
+    merged file next to some old files it already contains. Staging is only
+    cleared at the end, so re-running the merge on it rebuilds the same
+    partition either way. The manifest entries of the replaced files are
+    pointed at merged_0.parquet, so a later full pull still finds the shards
+    that wrote them done instead of fetching them again next to it.
+    '''
+    marks = {}
+    for dirpath, _, filenames in os.walk(staging_root):
+        staged = sorted(f for f in filenames if f.endswith('.parquet'))
+        if not staged:
+            continue
+        rel     = os.path.relpath(dirpath, staging_root)
+        target  = os.path.join(store_root, rel)
+        os.makedirs(target, exist_ok=True)
+        current = sorted(f for f in os.listdir(target) if f.endswith('.parquet'))
+
+        new = pd.concat([pq.read_table(os.path.join(dirpath, f)).to_pandas() for f in staged])
+        old = [pq.read_table(os.path.join(target, f)).to_pandas() for f in current]
+        merged = (pd.concat(old + [new])
+                    .drop_duplicates(subset=DEDUP_KEYS, keep='last')
+                    .sort_values(['bvdid', 'closdate']))
+
+        schema = pq.read_schema(os.path.join(dirpath, staged[0]))
+        tmp = os.path.join(target, 'merged.parquet.tmp')
+        pq.write_table(pa.Table.from_pandas(merged, schema=schema, preserve_index=False), tmp)
+        dest = os.path.join(target, 'merged_0.parquet')
+        os.replace(tmp, dest)
+        manifest.replace_files([os.path.join(target, f) for f in current], dest)
+        for f in current:
+            if f != 'merged_0.parquet':
+                os.remove(os.path.join(target, f))
+        log(f"  merged {len(new):,} delta rows into {rel} ({len(merged):,} rows)")
+
+        size, ctry = rel.split(os.sep)[0][5:], rel.split(os.sep)[1][8:]
+        top = str(new['closdate'].max())
+        marks[(size, ctry)] = max(marks.get((size, ctry), top), top)
+
+    for (size, ctry), mark in marks.items():
+        manifest.set_watermark(size, ctry, mark)
+
+    # Staging is only cleared once every partition is merged
+    for dirpath, _, filenames in os.walk(staging_root, topdown=False):
+        for f in filenames:
+            os.remove(os.path.join(dirpath, f))
+        os.rmdir(dirpath)
+
+
+# ── Typed Parquet output ───────────────────────────────────────────────────────
+# Hive partition keys of the extraction dataset: size=/ctryiso=/year=
+PARTITION_COLS = ['size', 'ctryiso', 'year']
+
+
+def orbis_schema(static_vars, sector_vars, fin_vars):
+    '''Fixed Arrow schema for an extraction chunk (without the partition keys).'''
+    fields = {}
+    for v in list(static_vars) + list(sector_vars):
+        fields[v] = pa.string()
+    for v in fin_vars:
+        if v == 'closdate':
+            fields[v] = pa.date32()
+        elif v in FIN_STRING_VARS:
+            fields[v] = pa.string()
+        else:
+            fields[v] = pa.float64()
+    return pa.schema(list(fields.items()))
+
+
+def write_parquet_chunk(root, shard, tag, part, chunk, schema):
+    '''Cast one streamed chunk to `schema` and append it to the hive dataset at `root`.
+
+    File names are derived from the shard tag and chunk number, so re-running a
+    shard overwrites its own files instead of adding duplicates. Returns the
+    paths written (one per size/ctryiso/year partition touched).
+    '''
+    df = chunk.loc[:, ~chunk.columns.duplicated()].copy()
+    for field in schema:
+        v = field.name
+        if v not in df.columns:
+            df[v] = None
+        if pa.types.is_floating(field.type):
+            df[v] = pd.to_numeric(df[v], errors='coerce').astype('float64')
+        elif pa.types.is_date(field.type):
+            df[v] = pd.to_datetime(df[v], errors='coerce').dt.date
+        else:
+            df[v] = df[v].astype('string')
+    df = df[schema.names]
+
+    # Partition keys
+    df['size']    = shard.size
+    df['ctryiso'] = df['contact_ctryiso'].astype('string')
+    df['year']    = pd.to_datetime(df['closdate']).dt.year.astype('Int32')
+
+    full  = schema.append(pa.field('size', pa.string())) \
+                  .append(pa.field('ctryiso', pa.string())) \
+                  .append(pa.field('year', pa.int32()))
+    table = pa.Table.from_pandas(df, schema=full, preserve_index=False)
+    paths = []
+    pq.write_to_dataset(
+        table, root,
+        partition_cols         = PARTITION_COLS,
+        basename_template      = f"{tag}_part{part}_{{i}}.parquet",
+        existing_data_behavior = 'overwrite_or_ignore',
+        file_visitor           = lambda f: paths.append(f.path),
+    )
+    return paths
+
+
+# ── Connection pool ────────────────────────────────────────────────────────────
+class ConnectionPool:
+    '''Bounded pool of WRDS connections.
+
+    All connections are opened up front in the calling thread, so any password
+    prompt happens once, before the workers start.
+    '''
+
+    def __init__(self, size, wrds_username):
+        import wrds      # here, so the schema/writer helpers work without WRDS (synth_orbis.py)
+        self._free = queue.Queue()
+        self._all  = []
+        for _ in range(size):
+            db = wrds.Connection(wrds_username=wrds_username)
+            self._all.append(db)
+            self._free.put(db)
+
+    def acquire(self):
+        return self._free.get()
+
+    def release(self, db):
+        self._free.put(db)
+
+    def close(self):
+        for db in self._all:
+            db.close()
+
+
+# ── Runner ─────────────────────────────────────────────────────────────────────
+_print_lock = threading.Lock()
+
+
+def log(msg):
+    with _print_lock:
+        print(msg, flush=True)
+
+
+def fetch_shard(pool, shard, query, write_chunk, chunksize, manifest=None, key=None,
+                probe=None):
+    '''Stream one shard on a pooled connection; `write_chunk(shard, part, chunk)` persists it.
+
+    With a `probe` (instrument.Probe), every chunk is logged with the time spent
+    waiting on WRDS for it and the time spent writing it.
+    '''
+    db = pool.acquire()
+    tag = f"{shard.size} {shard.label} g{shard.group}"
+    try:
+        if manifest is not None:
+            manifest.start(key)
+        t0, rows, part = time.time(), 0, 0
+        fetch_s = write_s = 0.0
+        chunks = iter(db.raw_sql(query, chunksize=chunksize, return_iter=True))
+        while True:
+            t_fetch = time.perf_counter()
+            chunk = next(chunks, None)
+            t_write = time.perf_counter()
+            if chunk is None:
+                break
+            part += 1
+            paths = write_chunk(shard, part, chunk)
+            t_done = time.perf_counter()
+            rows += len(chunk)
+            fetch_s += t_write - t_fetch
+            write_s += t_done - t_write
+            if probe is not None:
+                probe.chunk(tag, part, len(chunk), t_write - t_fetch, t_done - t_write,
+                            sum(os.path.getsize(p) for p in paths or []))
+            if manifest is not None:
+                manifest.add_files(key, paths, len(chunk))
+        if manifest is not None:
+            manifest.finish(key)
+        log(f"[{tag}] done: {rows:,} rows in {part} chunks, {time.time() - t0:,.0f}s "
+            f"(WRDS {fetch_s:,.0f}s, write {write_s:,.0f}s)")
+        if probe is not None:
+            probe.event('wrds_shard', shard=tag, rows=rows, chunks=part,
+                        wall_s=round(time.time() - t0, 1), fetch_s=round(fetch_s, 1),
+                        write_s=round(write_s, 1))
+        return rows
+    except Exception as err:
+        if manifest is not None:
+            manifest.fail(key, err)
+        raise
+    finally:
+        pool.release(db)
+
+
+def run_shards(shards, query_for, write_chunk, wrds_username,
+               workers=4, chunksize=50_000, manifest=None, verify='size',
+               key_for=shard_key, probe=None):
+    '''Run every shard over a pool of `workers` WRDS connections.
+
+    `query_for(shard)` returns the SQL; `write_chunk(shard, part, chunk)` is
+    called from worker threads, must only touch shard-specific files and
+    returns the paths it wrote. With a `manifest`, shards already recorded as
+    done (and whose files pass `verify`) are skipped, and unfinished ones are
+    cleaned up and fetched again. Shards of the same periods and output under
+    another key (an earlier grouping or column selection) are dropped with their files
+    first, so they cannot leave duplicate rows next to the new pull. A `probe`
+    logs per-chunk fetch/write timings.
+    '''
+    if manifest is not None:
+        stale = manifest.retire([key_for(s) for s in shards])
+        if stale:
+            log(f"Manifest {manifest.path}: removed {stale} shard(s) from an earlier "
+                f"grouping or column selection")
+        todo = [s for s in shards if not manifest.is_done(key_for(s), verify=verify)]
+        log(f"Manifest {manifest.path}: {len(shards) - len(todo)} of {len(shards)} "
+            f"shards already done, {len(todo)} to fetch")
+        shards = todo
+    if not shards:
+        return
+    workers = max(1, min(workers, len(shards)))
+    log(f"Running {len(shards)} shards on {workers} WRDS connection(s)")
+    pool   = ConnectionPool(workers, wrds_username)
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {
+                ex.submit(fetch_shard, pool, s, query_for(s), write_chunk, chunksize,
+                          manifest, key_for(s), probe): s
+                for s in shards
+            }
+            for fut in as_completed(futures):
+                shard = futures[fut]
+                try:
+                    fut.result()
+                except Exception as err:
+                    failed.append(shard)
+                    log(f"[{shard.size} {shard.label} g{shard.group}] FAILED: {err!r}")
+    finally:
+        pool.close()
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(shards)} shards failed")